@@ -0,0 +1,131 @@
+#
+# coldstart.py
+#
+# Measures, for each lambda function, how long its module takes to
+# import and how long the first (cold) invocation takes compared to
+# the warm invocations that follow it. Each handler is measured in
+# a fresh Python process so nothing is shared between them.
+#
+# The events used are read-only or fail early on purpose (e.g. a
+# product id that doesn't exist), so running this against a live
+# configuration doesn't change the cart.
+#
+# Usage, from the directory holding ikeaapp-config.ini:
+#
+#   python benchmarks/coldstart.py [warm invocations]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS = os.path.join(ROOT, "lambda functions")
+
+MISSING_PRODUCT = 0
+
+# the cart of a user who never adds anything:
+HEADERS = {"X-User-Id": "coldstart"}
+
+EVENTS = {
+    "ikea_recommend": {
+        "body": json.dumps({"search": "office chair", "budget": "100"})
+    },
+    "ikea_get_product_url": {
+        "body": json.dumps({"product_id": MISSING_PRODUCT})
+    },
+    "ikea_list": {
+        "headers": HEADERS
+    },
+    "ikea_upload": {
+        "headers": HEADERS,
+        "body":
+        json.dumps({
+            "productid": MISSING_PRODUCT,
+            "filename": "coldstart.jpg",
+            "data": ""
+        })
+    },
+    "ikea_remove": {
+        "headers": HEADERS,
+        "body": json.dumps({"productid": MISSING_PRODUCT})
+    },
+    "ikea_download": {
+        "headers": HEADERS
+    },
+    "ikea_compute": {
+        "Records": [{
+            "s3": {
+                "object": {
+                    "key": "ikeaapp/coldstart.txt"
+                }
+            }
+        }]
+    },
+}
+
+
+###################################################################
+#
+# measure: runs inside the child process for one handler
+#
+def measure(name, warm):
+  sys.path[:0] = [ROOT, LAMBDAS]
+
+  start = time.perf_counter()
+  module = importlib.import_module(name)
+  import_ms = (time.perf_counter() - start) * 1000
+
+  times = []
+  for i in range(warm + 1):
+    start = time.perf_counter()
+    module.lambda_handler(EVENTS[name], None)
+    times.append((time.perf_counter() - start) * 1000)
+
+  return {
+      "import_ms": import_ms,
+      "first_ms": times[0],
+      "warm_ms": sum(times[1:]) / max(len(times) - 1, 1)
+  }
+
+
+###################################################################
+#
+# main
+#
+if __name__ == "__main__":
+  if len(sys.argv) == 4 and sys.argv[1] == "--child":
+    # handlers print a lot, so keep stdout for the result only:
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    result = measure(sys.argv[2], int(sys.argv[3]))
+    stdout.write(json.dumps(result))
+    sys.exit(0)
+
+  warm = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+  print(f"{'handler':<22}{'import ms':>12}{'first ms':>12}{'warm ms':>12}")
+
+  for name in EVENTS:
+    proc = subprocess.run(
+        [sys.executable, __file__, "--child", name,
+         str(warm)],
+        capture_output=True,
+        text=True)
+
+    if proc.returncode != 0:
+      lines = proc.stderr.strip().splitlines() or ["exit code " + str(proc.returncode)]
+      print(f"{name:<22}  failed: {lines[-1]}")
+      continue
+
+    result = json.loads(proc.stdout)
+    print(f"{name:<22}{result['import_ms']:>12.1f}"
+          f"{result['first_ms']:>12.1f}{result['warm_ms']:>12.1f}")
@@ -0,0 +1,59 @@
+#
+# download_concurrency.py
+#
+# Wall time of building the /download zip as the cart grows, with
+# thumbnails fetched one at a time (1 worker) versus by a thread
+# pool, against a fake S3 bucket that sleeps for a simulated round
+# trip on every request. Carts over 1000 items also check that the
+# listing is paginated (every item ends up in the zip).
+#
+# Usage:
+#
+#   python benchmarks/download_concurrency.py [latency ms] [cart sizes...]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import os
+import sys
+import time
+import zipfile
+
+sys.path[:0] = [
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "lambda functions")
+]
+
+import fakes3
+import ikea_download
+
+WORKERS = [1, 4, 8, 16]
+
+if __name__ == "__main__":
+  latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.010
+  sizes = [int(arg) for arg in sys.argv[2:]] or [10, 100, 500, 1500]
+
+  print(f"simulated S3 round trip: {latency * 1000:.0f} ms")
+  print(f"{'items':>6}" + "".join(f"{str(w) + ' workers':>14}" for w in WORKERS))
+
+  for n in sizes:
+    s3_client = fakes3.make_cart(n, latency=latency)
+    line = f"{n:>6}"
+
+    for workers in WORKERS:
+      start = time.perf_counter()
+      keys = ikea_download.list_cart_keys(s3_client, 'bucket',
+                                          fakes3.BENCH_USER)
+      buffer = ikea_download.build_cart_zip(s3_client, 'bucket', keys, workers)
+      elapsed = time.perf_counter() - start
+
+      with zipfile.ZipFile(buffer) as archive:
+        assert len(archive.namelist()) == n
+
+      line += f"{elapsed * 1000:>11.0f} ms"
+
+    print(line)
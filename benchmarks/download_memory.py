@@ -0,0 +1,99 @@
+#
+# download_memory.py
+#
+# Compares peak memory and latency of building the /download
+# response the original way (download every thumbnail to /tmp,
+# shutil.make_archive, read the zip back, base64, json.dumps) with
+# the in-memory streaming zip in ikea_download, for carts of 10, 100
+# and 1000 items held in a fake S3 bucket.
+#
+# Usage:
+#
+#   python benchmarks/download_memory.py [cart sizes...]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path[:0] = [
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "lambda functions")
+]
+
+import fakes3
+import ikea_download
+
+
+###################################################################
+#
+# old_download: the original implementation, with /tmp replaced by
+# a temporary directory
+#
+def old_download(s3_client, bucketname, tmp):
+  bucket = fakes3.FakeBucket(s3_client, bucketname)
+  response = s3_client.list_objects_v2(Bucket=bucketname,
+                                       Prefix='ikeaapp/cart_ikeaapp')
+  dir = os.path.join(tmp, "cart_ikeaapp")
+  os.makedirs(dir)
+
+  for obj in response['Contents']:
+    obj_key = obj['Key']
+    bucket.download_file(obj_key, os.path.join(dir, os.path.basename(obj_key)))
+
+  zip_filepath = os.path.join(tmp, "cart_ikeaapp.zip")
+  shutil.make_archive(zip_filepath[:-4], 'zip', dir)
+
+  infile = open(zip_filepath, "rb")
+  bytes = infile.read()
+  infile.close()
+
+  datastr = base64.b64encode(bytes).decode()
+  return json.dumps(datastr)
+
+
+###################################################################
+#
+# new_download: the body-building steps of ikea_download
+#
+def new_download(s3_client, bucketname, tmp):
+  keys = ikea_download.list_cart_keys(s3_client, bucketname,
+                                      fakes3.BENCH_USER)
+  buffer = ikea_download.build_cart_zip(s3_client, bucketname, keys)
+  return ikea_download.base64_json_string(buffer)
+
+
+def run(fn, n):
+  s3_client = fakes3.make_cart(n)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tracemalloc.start()
+    start = time.perf_counter()
+    body = fn(s3_client, 'bucket', tmp)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  return elapsed * 1000, peak / 1024, len(body)
+
+
+if __name__ == "__main__":
+  sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+
+  print(f"{'items':>6} {'impl':<8}{'ms':>10}{'peak KiB':>12}{'body KiB':>12}")
+
+  for n in sizes:
+    for name, fn in (("old", old_download), ("new", new_download)):
+      ms, peak, size = run(fn, n)
+      print(f"{n:>6} {name:<8}{ms:>10.1f}{peak:>12.0f}{size / 1024:>12.0f}")
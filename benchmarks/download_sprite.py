@@ -0,0 +1,138 @@
+#
+# download_sprite.py
+#
+# Payload size and end-to-end time of /download as a zip of PNGs
+# versus /download?format=sprite, for carts of 10 to 1000 thumbnails
+# held in a fake S3 bucket. "cold" is the first call (nothing cached
+# in S3 yet), "warm" a later call served from the cache; "client" is
+# the time to decode the response and get every thumbnail as an
+# image (open each PNG in the zip, or crop each one out of the atlas).
+#
+# Usage:
+#
+#   python benchmarks/download_sprite.py [cart sizes...]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import base64
+import io
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+
+from configparser import ConfigParser
+
+sys.path[:0] = [
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "lambda functions")
+]
+
+import bootstrap
+import fakes3
+import ikea_download
+import thumbnails
+
+from PIL import Image, ImageDraw
+
+
+###################################################################
+#
+# make_thumbnail_cart:
+#
+# n product-like thumbnails (a few colored shapes on white, at most
+# 50x50) in the cart folder of a fake bucket.
+#
+def make_thumbnail_cart(n):
+  objects = {}
+
+  for i in range(n):
+    rng = random.Random(80001 + i)
+    width, height = rng.choice([(50, 50), (50, 38), (38, 50), (50, 28)])
+
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for shape in range(rng.randint(2, 5)):
+      x0, y0 = rng.randrange(width - 8), rng.randrange(height - 8)
+      box = [x0, y0, rng.randint(x0 + 4, width), rng.randint(y0 + 4, height)]
+      color = tuple(rng.randrange(256) for c in range(3))
+      if rng.random() < 0.5:
+        draw.rectangle(box, fill=color)
+      else:
+        draw.ellipse(box, fill=color)
+
+    key = "ikeaapp/cart_ikeaapp/{}/{}.PNG".format(fakes3.BENCH_USER,
+                                                  80001 + i)
+    objects[key] = thumbnails.encode_png(image)
+
+  return fakes3.FakeS3Client(objects)
+
+
+def client_zip(body):
+  data = base64.b64decode(json.loads(body))
+  images = []
+  with zipfile.ZipFile(io.BytesIO(data)) as archive:
+    for name in archive.namelist():
+      image = Image.open(io.BytesIO(archive.read(name)))
+      image.load()
+      images.append(image)
+  return images
+
+
+def client_sprite(body):
+  body = json.loads(body)
+  atlas = Image.open(io.BytesIO(base64.b64decode(body['atlas'])))
+  atlas.load()
+  return [
+      atlas.crop((x, y, x + w, y + h))
+      for x, y, w, h in body['index'].values()
+  ]
+
+
+def call(format):
+  event = {'headers': {'X-User-Id': fakes3.BENCH_USER}}
+  if format == 'sprite':
+    event['queryStringParameters'] = {'format': 'sprite'}
+  start = time.perf_counter()
+  response = ikea_download.lambda_handler(event, None)
+  elapsed = time.perf_counter() - start
+  assert response['statusCode'] == 200, response['body']
+  return (response['body'], elapsed * 1000)
+
+
+if __name__ == "__main__":
+  sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 1000]
+
+  configur = ConfigParser()
+  configur.read_string("[s3]\nbucket_name = bucket\n")
+  bootstrap._configur = configur
+
+  # the handlers print a lot:
+  stdout = sys.stdout
+
+  stdout.write(f"{'items':>6} {'format':<8}{'body KiB':>10}{'cold ms':>10}"
+               f"{'warm ms':>10}{'client ms':>11}\n")
+
+  for n in sizes:
+    bootstrap._s3_client = make_thumbnail_cart(n)
+
+    for format, client in (("zip", client_zip), ("sprite", client_sprite)):
+      sys.stdout = open(os.devnull, "w")
+      body, cold = call(format)
+      body, warm = call(format)
+      sys.stdout = stdout
+
+      start = time.perf_counter()
+      images = client(body)
+      decode = (time.perf_counter() - start) * 1000
+      assert len(images) == n
+
+      stdout.write(f"{n:>6} {format:<8}{len(body) / 1024:>10.1f}{cold:>10.1f}"
+                   f"{warm:>10.1f}{decode:>11.1f}\n")
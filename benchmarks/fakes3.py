@@ -0,0 +1,223 @@
+#
+# fakes3.py
+#
+# A small in-memory stand-in for the parts of the boto3 S3 client and
+# Bucket resource the lambda functions use, so the benchmarks can run
+# without AWS. An optional per-request latency simulates the round
+# trip to S3.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import hashlib
+import io
+import random
+import threading
+import time
+import urllib.parse
+
+
+class FakeClientError(Exception):
+  """
+  Mimics botocore's ClientError: the S3 error code is in
+  err.response['Error']['Code']
+  """
+
+  def __init__(self, code):
+    super().__init__("An error occurred (" + code + ")")
+    self.response = {'Error': {'Code': code}}
+
+
+def _etag(data):
+  return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+class FakeS3Client:
+  """
+  In-memory S3 client: objects are kept in a dict key -> bytes
+  """
+
+  def __init__(self, objects=None, latency=0.0):
+    """
+    Parameters
+    ----------
+    objects : optional dict of key -> bytes to start with,
+    latency : seconds each request sleeps, to simulate a round trip
+    """
+    self.objects = dict(objects or {})
+    self.metadata = {}
+    self.latency = latency
+    self.requests = 0
+    self._lock = threading.Lock()
+
+  def _request(self):
+    with self._lock:
+      self.requests += 1
+    if self.latency > 0:
+      time.sleep(self.latency)
+
+  def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000,
+                      ContinuationToken=None):
+    self._request()
+
+    keys = sorted(key for key in self.objects if key.startswith(Prefix))
+    if ContinuationToken is not None:
+      keys = [key for key in keys if key > ContinuationToken]
+
+    page = keys[:MaxKeys]
+    response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys}
+    if len(page) > 0:
+      response['Contents'] = [{
+          'Key': key,
+          'Size': len(self.objects[key])
+      } for key in page]
+    if response['IsTruncated']:
+      response['NextContinuationToken'] = page[-1]
+
+    return response
+
+  def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+    self._request()
+    if Key not in self.objects:
+      raise FakeClientError('NoSuchKey')
+    data = self.objects[Key]
+    if IfNoneMatch is not None and IfNoneMatch == _etag(data):
+      raise FakeClientError('304')
+    return {
+        'Body': io.BytesIO(data),
+        'ContentLength': len(data),
+        'ETag': _etag(data),
+        'Metadata': self.metadata.get(Key, {})
+    }
+
+  def head_object(self, Bucket, Key, **kwargs):
+    self._request()
+    if Key not in self.objects:
+      raise FakeClientError('404')
+    return {
+        'ContentLength': len(self.objects[Key]),
+        'ETag': _etag(self.objects[Key]),
+        'Metadata': self.metadata.get(Key, {})
+    }
+
+  def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None,
+                 Metadata=None, **kwargs):
+    self._request()
+    data = bytes(Body) if isinstance(Body, (bytes, bytearray)) else Body.read()
+    with self._lock:
+      if IfNoneMatch == '*' and Key in self.objects:
+        raise FakeClientError('PreconditionFailed')
+      if IfMatch is not None and (Key not in self.objects or
+                                  _etag(self.objects[Key]) != IfMatch):
+        raise FakeClientError('PreconditionFailed')
+      self.objects[Key] = data
+      self.metadata[Key] = dict(Metadata or {})
+    return {'ETag': _etag(data)}
+
+  def copy_object(self, Bucket, Key, CopySource, Metadata=None,
+                  MetadataDirective='COPY', **kwargs):
+    self._request()
+    with self._lock:
+      if CopySource['Key'] not in self.objects:
+        raise FakeClientError('NoSuchKey')
+      self.objects[Key] = self.objects[CopySource['Key']]
+      if MetadataDirective == 'REPLACE':
+        self.metadata[Key] = dict(Metadata or {})
+      else:
+        self.metadata[Key] = dict(self.metadata.get(CopySource['Key'], {}))
+    return {'CopyObjectResult': {'ETag': _etag(self.objects[Key])}}
+
+  def delete_object(self, Bucket, Key, **kwargs):
+    self._request()
+    self.objects.pop(Key, None)
+    self.metadata.pop(Key, None)
+    return {}
+
+  def download_file(self, Bucket, Key, Filename):
+    self._request()
+    with open(Filename, "wb") as outfile:
+      outfile.write(self.objects[Key])
+
+  def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+    """
+    Returns a fake:// URL that put_presigned() accepts until it
+    expires; like S3, the ACL and content type are part of the
+    signature, so the PUT has to send the same headers
+    """
+    if ClientMethod != 'put_object':
+      raise FakeClientError('UnsupportedMethod')
+
+    query = {
+        'expires': str(time.time() + ExpiresIn),
+        'acl': Params.get('ACL', ''),
+        'content-type': Params.get('ContentType', '')
+    }
+    return ("fake://" + Params['Bucket'] + "/" +
+            urllib.parse.quote(Params['Key']) + "?" +
+            urllib.parse.urlencode(query))
+
+  def put_presigned(self, url, data, headers):
+    """
+    Does what an HTTP PUT to a presigned URL would do, returning the
+    status code S3 would answer with
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+
+    if time.time() > float(query['expires']):
+      return 403
+    if (headers.get('x-amz-acl', '') != query['acl'] or
+        headers.get('Content-Type', '') != query['content-type']):
+      return 403
+
+    self.put_object(Bucket=parts.netloc,
+                    Key=urllib.parse.unquote(parts.path[1:]),
+                    Body=data,
+                    ContentType=query['content-type'])
+    return 200
+
+
+class FakeBucket:
+  """
+  The boto3 Bucket resource methods used by the lambda functions
+  """
+
+  def __init__(self, client, name='bucket'):
+    self.client = client
+    self.name = name
+
+  def download_file(self, Key, Filename):
+    self.client.download_file(self.name, Key, Filename)
+
+  def upload_file(self, Filename, Key, ExtraArgs=None):
+    with open(Filename, "rb") as infile:
+      self.client.put_object(Bucket=self.name, Key=Key, Body=infile.read(),
+                             **(ExtraArgs or {}))
+
+
+# the user whose cart the benchmarks fill:
+BENCH_USER = 'bench'
+
+
+###################################################################
+#
+# make_cart:
+#
+# Fills a fake bucket with n thumbnail-sized objects in the cart
+# folder of user_id.
+#
+def make_cart(n, size=3000, latency=0.0, user_id=BENCH_USER):
+  """
+  Returns a FakeS3Client holding n cart thumbnails of ~size bytes
+  """
+  objects = {}
+  for i in range(n):
+    # random bytes, since PNG data doesn't compress any further:
+    data = random.Random(80001 + i).randbytes(size)
+    objects["ikeaapp/cart_ikeaapp/" + user_id + "/" + str(80001 + i) +
+            ".PNG"] = data
+
+  return FakeS3Client(objects, latency)
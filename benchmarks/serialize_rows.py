@@ -0,0 +1,104 @@
+#
+# serialize_rows.py
+#
+# Encode time and payload size of a 10,000 row cart listing: the
+# original ikea_list approach (copy every row, convert each Decimal
+# cell to float, json.dumps) against serialize.dumps of the rows as
+# pymysql returns them, in both the "rows" and "columnar" shapes,
+# with the standard json module and (if installed) orjson. "old dicts"
+# is the one-object-per-row shape ikea_recommend returns, which the
+# columnar shape replaces.
+#
+# Usage:
+#
+#   python benchmarks/serialize_rows.py [# of rows]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import json
+import os
+import sys
+import time
+
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialize
+
+COLUMNS = ["product_id", "product_name", "price"]
+
+REPEAT = 20
+
+
+def old_encode(rows):
+  # convert all decimals to floats for compatibility with JSON
+  new_rows = []
+  for row in rows:
+    new_row = list(row)
+    for i, value in enumerate(new_row):
+      if isinstance(value, Decimal):
+        new_row[i] = float(value)
+    new_rows.append(new_row)
+  return json.dumps(new_rows)
+
+
+def old_dicts(rows):
+  return json.dumps([{
+      "product_id": product_id,
+      "product_name": product_name,
+      "price": float(price)
+  } for product_id, product_name, price in rows])
+
+
+def time_ms(fn, rows):
+  best = None
+  for i in range(REPEAT):
+    start = time.perf_counter()
+    body = fn(rows)
+    elapsed = (time.perf_counter() - start) * 1000
+    best = elapsed if best is None else min(best, elapsed)
+  return (best, body)
+
+
+if __name__ == "__main__":
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+  # what pymysql returns for SELECT * FROM cart:
+  rows = [(80001 + i, "IKEA product number " + str(i) + ", black-brown",
+           Decimal(str(round(9.99 + i * 0.37, 2)))) for i in range(n)]
+
+  variants = [
+      ("old (convert + json)", old_encode),
+      ("old dicts", old_dicts),
+      ("rows", lambda rows: serialize.dumps(serialize.table(COLUMNS, rows))),
+      ("columnar",
+       lambda rows: serialize.dumps(serialize.table(COLUMNS, rows, "columnar"))),
+  ]
+
+  encoders = [("json", None)]
+  if serialize.orjson is not None:
+    encoders.append(("orjson", serialize.orjson))
+
+  print(f"{n} rows, best of {REPEAT}")
+  print(f"{'variant':<24}{'encoder':<8}{'ms':>8}{'KiB':>8}")
+
+  expected = json.loads(old_encode(rows))
+
+  for encoder, module in encoders:
+    serialize.orjson = module
+    for name, fn in variants:
+      if name.startswith("old") and module is not None:
+        continue
+      ms, body = time_ms(fn, rows)
+      decoded = json.loads(body)
+      if name == "columnar":
+        decoded = decoded["rows"]
+      elif name == "old dicts":
+        decoded = [list(row.values()) for row in decoded]
+      assert decoded == expected
+      print(f"{name:<24}{encoder:<8}{ms:>8.2f}{len(body.encode()) / 1024:>8.0f}")
@@ -0,0 +1,177 @@
+#
+# thumbnail_throughput.py
+#
+# Images/sec, peak RSS and average thumbnail size of making cart
+# thumbnails over a corpus of synthetic JPEGs of varied sizes (640px
+# up to 4000px). Compares the original ikea_compute steps (write the
+# image to a file, Image.open, thumbnail((50, 50)), save as RGB PNG)
+# with thumbnails.make_thumbnails: in-memory, draft-mode decode, one
+# decode shared by every profile, palette PNGs.
+#
+# "old" variants with two sizes decode the image once per size, as
+# separate functions would have to. The corpus is made, and each
+# variant runs, in a fresh Python process, so peak RSS only counts
+# the variant itself.
+#
+# Usage:
+#
+#   python benchmarks/thumbnail_throughput.py [images per size]
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = [(640, 480), (1600, 1200), (4000, 3000)]
+
+VARIANTS = [
+    "old 50", "new 50", "old 50+200", "new 50+200", "new 50+200 rgb"
+]
+
+
+###################################################################
+#
+# make_corpus: writes n synthetic JPEGs of each size into dir
+#
+def make_corpus(dir, n):
+  from PIL import Image
+
+  paths = []
+  for width, height in SIZES:
+    for i in range(n):
+      # detail (fractal), smooth areas (gradient) and noise, so the
+      # JPEGs are roughly photo-sized rather than trivially small:
+      red = Image.effect_mandelbrot((width, height),
+                                    (-2.0 + i * 0.1, -1.5, 1.0, 1.5), 64)
+      green = Image.linear_gradient('L').resize((width, height))
+      blue = Image.effect_noise((width, height), 48)
+      image = Image.merge('RGB', (red, green, blue))
+
+      path = os.path.join(dir, f"{width}x{height}-{i}.jpg")
+      image.save(path, format='JPEG', quality=90)
+      paths.append(path)
+
+  return paths
+
+
+###################################################################
+#
+# old_thumbnails: the original ikea_compute steps, once per size
+#
+def old_thumbnails(data, tmp, sizes):
+  from PIL import Image
+
+  local_jpg = os.path.join(tmp, "data.jpg")
+  with open(local_jpg, "wb") as outfile:
+    outfile.write(data)
+
+  pngs = []
+  for size in sizes:
+    image = Image.open(local_jpg)
+    image.thumbnail((size, size))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    pngs.append(buffer.getvalue())
+
+  return pngs
+
+
+###################################################################
+#
+# run: inside the child process for one variant
+#
+def run(variant, paths):
+  sys.path.insert(0, ROOT)
+  import thumbnails
+
+  images = []
+  for path in paths:
+    with open(path, "rb") as infile:
+      images.append(infile.read())
+
+  name, sizes = variant.split(" ")[:2]
+  sizes = [int(size) for size in sizes.split("+")]
+  palette = not variant.endswith(" rgb")
+
+  tmp = tempfile.mkdtemp()
+  baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  outputs = 0
+  start = time.perf_counter()
+
+  for data in images:
+    if name == "old":
+      pngs = old_thumbnails(data, tmp, sizes)
+    else:
+      pngs = thumbnails.make_thumbnails(data, sizes, palette).values()
+    outputs += sum(len(png) for png in pngs)
+
+  elapsed = time.perf_counter() - start
+
+  # ru_maxrss is in KiB on Linux
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  return {
+      "per_sec": len(images) / elapsed,
+      "peak_mib": peak / 1024,
+      "growth_mib": (peak - baseline) / 1024,
+      "avg_bytes": outputs / len(images)
+  }
+
+
+if __name__ == "__main__":
+  if len(sys.argv) == 4 and sys.argv[1] == "--child":
+    paths = json.loads(sys.argv[3])
+    sys.stdout.write(json.dumps(run(sys.argv[2], paths)))
+    sys.exit(0)
+
+  if len(sys.argv) == 4 and sys.argv[1] == "--corpus":
+    sys.stdout.write(json.dumps(make_corpus(sys.argv[2], int(sys.argv[3]))))
+    sys.exit(0)
+
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+  with tempfile.TemporaryDirectory() as dir:
+    # in a child process too: ru_maxrss survives exec, so a large
+    # peak here would show up in every variant
+    proc = subprocess.run(
+        [sys.executable, __file__, "--corpus", dir,
+         str(n)],
+        capture_output=True,
+        text=True,
+        check=True)
+    paths = json.loads(proc.stdout)
+    total = sum(os.path.getsize(path) for path in paths)
+    print(f"corpus: {len(paths)} JPEGs, {total / len(paths) / 1024:.0f} KiB avg")
+
+    print(f"{'variant':<16}{'images/s':>10}{'peak RSS MiB':>14}"
+          f"{'growth MiB':>12}{'out bytes':>11}")
+
+    for variant in VARIANTS:
+      proc = subprocess.run(
+          [sys.executable, __file__, "--child", variant,
+           json.dumps(paths)],
+          capture_output=True,
+          text=True)
+
+      if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines() or ["exit code " + str(proc.returncode)]
+        print(f"{variant:<16}  failed: {lines[-1]}")
+        continue
+
+      result = json.loads(proc.stdout)
+      print(f"{variant:<16}{result['per_sec']:>10.1f}{result['peak_mib']:>14.1f}"
+            f"{result['growth_mib']:>12.1f}{result['avg_bytes']:>11.0f}")
@@ -0,0 +1,211 @@
+#
+# bootstrap.py
+#
+# Per-container setup shared by the lambda functions. The config file
+# is parsed once, and the boto3 session, S3 client/resource and
+# database connection pool are created on first use and then cached
+# at module scope, so warm invocations skip all of it. boto3 is only
+# imported when a code path actually needs S3.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import os
+import threading
+
+from configparser import ConfigParser
+
+CONFIG_FILE = 'ikeaapp-config.ini'
+S3_PROFILE = 's3readwrite'
+
+_lock = threading.Lock()
+_configur = None
+_session = None
+_s3_client = None
+_s3_resource = None
+
+
+###################################################################
+#
+# get_config:
+#
+# Parses the config file the first time it's called.
+#
+def get_config():
+  """
+  Returns the parsed config file (parsed once per container)
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  a ConfigParser object
+  """
+  global _configur
+
+  if _configur is None:
+    with _lock:
+      if _configur is None:
+        os.environ['AWS_SHARED_CREDENTIALS_FILE'] = CONFIG_FILE
+        configur = ConfigParser()
+        configur.read(CONFIG_FILE)
+        _configur = configur
+
+  return _configur
+
+
+###################################################################
+#
+# get_rds_params:
+#
+def get_rds_params():
+  """
+  Returns the RDS connection parameters from the config file
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  (endpoint, portnum, username, pwd, dbname) tuple
+  """
+  configur = get_config()
+
+  rds_endpoint = configur.get('rds', 'endpoint')
+  rds_portnum = int(configur.get('rds', 'port_number'))
+  rds_username = configur.get('rds', 'user_name')
+  rds_pwd = configur.get('rds', 'user_pwd')
+  rds_dbname = configur.get('rds', 'db_name')
+
+  return (rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+
+###################################################################
+#
+# get_db_pool:
+#
+def get_db_pool():
+  """
+  Returns the process-wide database connection pool
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  a datatier.ConnectionPool
+  """
+  # deferred import: handlers that only use S3 don't need pymysql
+  import datatier
+
+  return datatier.get_pool(*get_rds_params())
+
+
+###################################################################
+#
+# get_bucketname:
+#
+def get_bucketname():
+  """
+  Returns the name of the S3 bucket from the config file
+  """
+  return get_config().get('s3', 'bucket_name')
+
+
+###################################################################
+#
+# get_cache_ttl:
+#
+def get_cache_ttl():
+  """
+  Returns the # of seconds catalog lookups may be served from
+  datatier's query cache, or None if caching is turned off
+  (product_ttl = 0 in the config file)
+  """
+  ttl = get_config().getint('cache', 'product_ttl', fallback=0)
+
+  return ttl if ttl > 0 else None
+
+
+###################################################################
+#
+# get_s3_client:
+#
+# The boto3 session and client are created on first use; clients
+# are thread-safe, so one is shared by the whole process.
+#
+def get_s3_client():
+  """
+  Returns the cached boto3 S3 client
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  a boto3 S3 client
+  """
+  global _s3_client
+
+  if _s3_client is None:
+    session = _get_session()
+    with _lock:
+      if _s3_client is None:
+        _s3_client = session.client('s3')
+
+  return _s3_client
+
+
+###################################################################
+#
+# get_s3_bucket:
+#
+def get_s3_bucket():
+  """
+  Returns the boto3 Bucket resource for the configured bucket
+
+  The underlying resource is cached; resources are not thread-safe,
+  so worker threads should use get_s3_client() instead.
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  a boto3 Bucket resource
+  """
+  global _s3_resource
+
+  if _s3_resource is None:
+    session = _get_session()
+    with _lock:
+      if _s3_resource is None:
+        _s3_resource = session.resource('s3')
+
+  return _s3_resource.Bucket(get_bucketname())
+
+
+def _get_session():
+  global _session
+
+  if _session is None:
+    get_config()  # makes sure AWS_SHARED_CREDENTIALS_FILE is set
+
+    # deferred import: boto3 is slow to import and not every
+    # handler (or code path) needs it
+    import boto3
+
+    with _lock:
+      if _session is None:
+        _session = boto3.session.Session(profile_name=S3_PROFILE)
+
+  return _session
@@ -0,0 +1,281 @@
+#
+# cartarchive.py
+#
+# Keeps a ready-made zip of each shopping cart's thumbnails in S3, so
+# that /download doesn't have to rebuild it on every call. The zip is
+# kept up to date incrementally: ikea_compute adds (or replaces) one
+# member when it writes a thumbnail, and ikea_remove drops one when an
+# item leaves the cart. Its S3 ETag doubles as the HTTP ETag that
+# ikea_download hands to the client.
+#
+# Every user's cart thumbnails are in a folder of their own inside
+# the cart folder, ikeaapp/cart_ikeaapp/<user id>/, so listing one
+# cart only touches that cart's keys; the zips are kept in
+# ikeaapp/archives_ikeaapp/<user id>.zip.
+#
+# Updates are read-modify-write with a conditional put (If-Match on
+# the ETag that was read), retried if someone else got there first;
+# an archive that can't be updated is deleted, so it's rebuilt
+# rather than served out of date.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import io
+import zipfile
+
+CART_PREFIX = 'ikeaapp/cart_ikeaapp/'
+
+# kept outside the cart folder, so they're never listed as thumbnails:
+ARCHIVE_PREFIX = 'ikeaapp/archives_ikeaapp/'
+
+
+###################################################################
+#
+# cart_prefix:
+#
+# The folder holding one user's cart thumbnails, e.g. "alice" ->
+# "ikeaapp/cart_ikeaapp/alice/".
+#
+def cart_prefix(user_id):
+  return CART_PREFIX + user_id + "/"
+
+
+###################################################################
+#
+# cart_user:
+#
+# The user id of a cart thumbnail's key, e.g.
+# "ikeaapp/cart_ikeaapp/alice/80001.PNG" -> "alice".
+#
+def cart_user(key):
+  return key[len(CART_PREFIX):].split("/", 1)[0]
+
+
+###################################################################
+#
+# archive_key:
+#
+def archive_key(user_id):
+  return ARCHIVE_PREFIX + user_id + ".zip"
+
+
+###################################################################
+#
+# member_name:
+#
+# Name of a thumbnail inside the zip: its key relative to the
+# user's cart folder, e.g. "ikeaapp/cart_ikeaapp/alice/80001.PNG" ->
+# "80001.PNG".
+#
+def member_name(key):
+  return key.rsplit("/", 1)[-1]
+
+
+###################################################################
+#
+# error_code:
+#
+# The S3 error code ("NoSuchKey", "PreconditionFailed", "304", ...)
+# of a botocore ClientError, or None for any other exception.
+#
+def error_code(err):
+  response = getattr(err, 'response', None)
+  if not isinstance(response, dict):
+    return None
+  return response.get('Error', {}).get('Code')
+
+
+###################################################################
+#
+# get_archive:
+#
+def get_archive(s3_client, bucketname, user_id, if_none_match=None):
+  """
+  Reads the cached archive of a user's cart
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  user_id : whose cart,
+  if_none_match : ETag the caller already has, or None
+
+  Returns
+  -------
+  (data, etag): data is the zip's bytes, or None if the archive
+  still has ETag if_none_match; (None, None) if there is no archive
+  """
+  kwargs = {'Bucket': bucketname, 'Key': archive_key(user_id)}
+  if if_none_match:
+    kwargs['IfNoneMatch'] = if_none_match
+
+  try:
+    response = s3_client.get_object(**kwargs)
+  except Exception as err:
+    code = error_code(err)
+    if code in ('304', 'NotModified'):
+      return (None, if_none_match)
+    if code in ('NoSuchKey', '404'):
+      return (None, None)
+    raise
+
+  return (response['Body'].read(), response['ETag'])
+
+
+###################################################################
+#
+# head_archive:
+#
+# The ETag of a user's cached archive, without reading it (None if
+# there is no archive).
+#
+def head_archive(s3_client, bucketname, user_id):
+  try:
+    response = s3_client.head_object(Bucket=bucketname,
+                                     Key=archive_key(user_id))
+  except Exception as err:
+    if error_code(err) in ('NoSuchKey', '404', 'NotFound'):
+      return None
+    raise
+
+  return response['ETag']
+
+
+###################################################################
+#
+# put_archive:
+#
+def put_archive(s3_client, bucketname, user_id, data, if_match=None):
+  """
+  Writes the archive of a user's cart, only if it wasn't changed
+  (if_match is an ETag) or created (if_match is None) in the meantime
+
+  Returns
+  -------
+  the new ETag, or None if the conditional write lost a race
+  """
+  kwargs = {
+      'Bucket': bucketname,
+      'Key': archive_key(user_id),
+      'Body': data,
+      'ContentType': 'application/zip'
+  }
+  if if_match is None:
+    kwargs['IfNoneMatch'] = '*'
+  else:
+    kwargs['IfMatch'] = if_match
+
+  try:
+    response = s3_client.put_object(**kwargs)
+  except Exception as err:
+    if error_code(err) in ('PreconditionFailed', 'ConditionalRequestConflict',
+                           '412', '409'):
+      return None
+    raise
+
+  return response['ETag']
+
+
+###################################################################
+#
+# delete_archive:
+#
+def delete_archive(s3_client, bucketname, user_id):
+  s3_client.delete_object(Bucket=bucketname, Key=archive_key(user_id))
+
+
+###################################################################
+#
+# discard_archive:
+#
+# Best-effort delete_archive, for when the archive may be out of date
+# but can't be fixed: the next /download rebuilds it from the cart
+# folder. Returns True if the archive is gone.
+#
+def discard_archive(s3_client, bucketname, user_id):
+  try:
+    delete_archive(s3_client, bucketname, user_id)
+    return True
+  except Exception as err:
+    print("cartarchive: failed to discard archive of", user_id + ":",
+          str(err))
+    return False
+
+
+###################################################################
+#
+# update_archive:
+#
+def update_archive(s3_client, bucketname, user_id, add=None, remove=None,
+                   retries=5):
+  """
+  Adds, replaces and/or drops members of the cached archive of a
+  user's cart
+
+  If there is no archive yet there is nothing to update; the next
+  /download builds it from the user's cart folder. The same goes if
+  the update fails (S3 errors, or too many concurrent updates): the
+  archive is then deleted rather than left out of date.
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  user_id : whose cart,
+  add : dict of member name -> bytes to add or replace,
+  remove : list of member names to drop,
+  retries : # of times to retry when a concurrent update wins
+
+  Returns
+  -------
+  the archive's new ETag, or None if there is no archive (anymore);
+  raises only if the archive couldn't be updated or deleted
+  """
+  add = add or {}
+  drop = set(remove or []) | set(add)
+
+  try:
+    for attempt in range(retries):
+      data, etag = get_archive(s3_client, bucketname, user_id)
+      if etag is None:
+        return None
+
+      #
+      # zip members can't be replaced in place, so copy the members
+      # we keep into a new zip (thumbnails are stored uncompressed, so
+      # this is just a memory copy) and append the new ones:
+      #
+      buffer = io.BytesIO()
+      with zipfile.ZipFile(io.BytesIO(data)) as old, \
+           zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as new:
+        for info in old.infolist():
+          if info.filename not in drop:
+            new.writestr(info, old.read(info))
+        for name in sorted(add):
+          new.writestr(name, add[name])
+
+      new_etag = put_archive(s3_client, bucketname, user_id,
+                             buffer.getvalue(), etag)
+      if new_etag is not None:
+        return new_etag
+
+      print("cartarchive: concurrent update, retrying")
+
+    err = Exception("cartarchive: gave up updating archive after " +
+                    str(retries) + " attempts")
+  except Exception as e:
+    err = e
+
+  #
+  # an archive left as it is would keep being served (with a valid
+  # ETag) without the change, so get rid of it:
+  #
+  print("cartarchive: update failed, discarding archive:", str(err))
+  if discard_archive(s3_client, bucketname, user_id):
+    return None
+
+  raise err
@@ -0,0 +1,109 @@
+#
+# carts.py
+#
+# Helpers shared by the lambda functions that work on a shopping
+# cart: request headers, whose cart a request is for, which item and
+# how many of it.
+#
+# Every shopper (or client session) has a cart of their own, named
+# by a user id the client sends in the X-User-Id header. The id
+# becomes part of the cart's rows in the database and of its keys in
+# S3, so it is restricted to characters that are safe in both.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import re
+
+USER_HEADER = 'X-User-Id'
+
+MAX_QUANTITY = 999
+
+_user_id = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+###################################################################
+#
+# get_header:
+#
+def get_header(event, name):
+  """
+  Returns the value of a request header, or None if it wasn't sent
+
+  Parameters
+  ----------
+  event : the lambda event,
+  name : the header name (API Gateway doesn't normalize the case of
+         header names, so any case is matched)
+  """
+  headers = event.get('headers') or {}
+  for key, value in headers.items():
+    if key.lower() == name.lower():
+      return value
+  return None
+
+
+###################################################################
+#
+# get_user_id:
+#
+def get_user_id(event):
+  """
+  Returns the user id of the cart a request is for
+
+  Parameters
+  ----------
+  event : the lambda event
+
+  Returns
+  -------
+  the user id (1 to 64 letters, digits, '_' or '-')
+  """
+  user_id = get_header(event, USER_HEADER)
+
+  if user_id is None:
+    raise Exception("request has no " + USER_HEADER + " header")
+
+  if not _user_id.fullmatch(user_id):
+    raise Exception(USER_HEADER + " must be 1 to 64 letters, digits, "
+                    "'_' or '-'")
+
+  return user_id
+
+
+###################################################################
+#
+# get_product_id:
+#
+# Validates the "productid" parameter of a request, so that "80001",
+# " 80001" and 80001 all name the same S3 keys and cart row.
+#
+def get_product_id(value):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    raise Exception("productid must be an integer")
+
+
+###################################################################
+#
+# get_quantity:
+#
+# Validates the "quantity" parameter of a request (default 1).
+#
+def get_quantity(value):
+  if value is None:
+    return 1
+
+  try:
+    quantity = int(value)
+  except (TypeError, ValueError):
+    raise Exception("quantity must be an integer")
+
+  if quantity < 1 or quantity > MAX_QUANTITY:
+    raise Exception("quantity must be between 1 and " + str(MAX_QUANTITY))
+
+  return quantity
@@ -0,0 +1,169 @@
+#
+# cartsprite.py
+#
+# A shopping cart as a single sprite sheet: one atlas PNG holding
+# every cart thumbnail, plus an index of product id -> (x, y, w, h)
+# in the atlas. It's an alternative /download format to the zip of
+# PNGs, which for a large cart is mostly per-file overhead.
+#
+# The atlas is built from the cached cart zip (see cartarchive.py),
+# which already holds every thumbnail in the cart folder, and cached
+# in S3 tagged with the ETag of the zip it was built from. The zip
+# changes whenever the cart does, so a cached sprite is valid as long
+# as its tag matches the zip's current ETag.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import io
+import math
+import pathlib
+import zipfile
+import thumbnails
+
+from cartarchive import ARCHIVE_PREFIX, error_code
+
+ARCHIVE_ETAG = 'archive-etag'
+
+
+###################################################################
+#
+# sprite_key:
+#
+# Kept next to the user's cart zip, outside the cart folder, so it's
+# never listed as a thumbnail.
+#
+def sprite_key(user_id):
+  return ARCHIVE_PREFIX + user_id + ".sprite.json"
+
+
+###################################################################
+#
+# sprite_etag:
+#
+# The HTTP ETag of the sprite built from the zip with the given ETag
+# (different from the zip's own, so the two formats are never
+# mistaken for each other by a cache).
+#
+def sprite_etag(archive_etag):
+  return '"sprite-' + archive_etag.strip('"') + '"'
+
+
+###################################################################
+#
+# build_sprite:
+#
+def build_sprite(buffer, palette=False):
+  """
+  Packs the thumbnails of a cart zip into one atlas image
+
+  Thumbnails are placed left to right on rows ("shelves") in the
+  zip's order; the atlas is about as wide as it is tall.
+
+  Parameters
+  ----------
+  buffer : io.BytesIO holding the cart zip,
+  palette : True to reduce the atlas to a 256 color palette (smaller,
+            but every product shares the one palette)
+
+  Returns
+  -------
+  (png, index): bytes of the atlas PNG, and a dict of product id ->
+  [x, y, w, h]
+  """
+  # deferred import: Pillow comes from a lambda layer, and is slow
+  # to import
+  from PIL import Image
+
+  images = []
+  with zipfile.ZipFile(buffer) as archive:
+    for name in archive.namelist():
+      image = Image.open(io.BytesIO(archive.read(name)))
+      images.append((pathlib.Path(name).stem, image))
+
+  if len(images) == 0:
+    raise Exception("no thumbnails to pack")
+
+  # thumbnails made from JPEGs have no alpha channel, and RGB is
+  # quicker to encode than RGBA:
+  mode = 'RGB'
+  for productid, image in images:
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+      mode = 'RGBA'
+
+  #
+  # shelf packing: rows of at most width pixels, each as tall as its
+  # tallest thumbnail:
+  #
+  area = sum(image.width * image.height for productid, image in images)
+  width = max(max(image.width for productid, image in images),
+              math.ceil(math.sqrt(area)))
+
+  index = {}
+  x = y = shelf = 0
+
+  for productid, image in images:
+    if x + image.width > width:
+      x = 0
+      y += shelf
+      shelf = 0
+    index[productid] = [x, y, image.width, image.height]
+    x += image.width
+    shelf = max(shelf, image.height)
+
+  height = y + shelf
+
+  atlas = Image.new(mode, (width, height), (255, 255, 255, 0)[:len(mode)])
+  for productid, image in images:
+    x, y, w, h = index[productid]
+    atlas.paste(image.convert(mode), (x, y))
+
+  # one large image, where optimize=True costs more than it saves:
+  return (thumbnails.encode_png(atlas, palette, optimize=False), index)
+
+
+###################################################################
+#
+# get_sprite:
+#
+def get_sprite(s3_client, bucketname, user_id, archive_etag):
+  """
+  Reads the cached sprite of a user's cart, if it was built from the
+  zip with the given ETag
+
+  Returns
+  -------
+  the cached response body (a JSON string), or None
+  """
+  try:
+    response = s3_client.get_object(Bucket=bucketname,
+                                    Key=sprite_key(user_id))
+  except Exception as err:
+    if error_code(err) in ('NoSuchKey', '404'):
+      return None
+    raise
+
+  tag = response.get('Metadata', {}).get(ARCHIVE_ETAG)
+  if tag != archive_etag.strip('"'):
+    return None
+
+  return response['Body'].read().decode()
+
+
+###################################################################
+#
+# put_sprite:
+#
+def put_sprite(s3_client, bucketname, user_id, body, archive_etag):
+  """
+  Caches the sprite response body of a user's cart, tagged with the
+  ETag of the zip it was built from
+  """
+  s3_client.put_object(Bucket=bucketname,
+                       Key=sprite_key(user_id),
+                       Body=body.encode(),
+                       ContentType='application/json',
+                       Metadata={ARCHIVE_ETAG: archive_etag.strip('"')})
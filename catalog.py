@@ -0,0 +1,92 @@
+#
+# catalog.py
+#
+# The version of the product catalog: a counter in the single row of
+# the catalog_version table, which initialize_db.py bumps whenever an
+# import or sync changes the products table. Anything cached from
+# products (query results, the search index, keyword match sets) is
+# only good for the version it was read at, so it can be kept for
+# hours and dropped as soon as the version moves on.
+#
+# Reading the version is a primary key lookup, and is itself cached
+# for a few seconds (version_ttl in the [cache] section of the config
+# file), so most invocations don't pay for it at all.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import threading
+import bootstrap
+import datatier
+
+version_sql = "SELECT version FROM catalog_version WHERE id = 1;"
+
+bump_sql = "UPDATE catalog_version SET version = version + 1 WHERE id = 1;"
+
+# tables whose cached query results depend on the catalog:
+CATALOG_TABLES = ["products"]
+
+_lock = threading.Lock()
+_version = None
+
+
+###################################################################
+#
+# check_version:
+#
+def check_version(dbConn):
+  """
+  Returns the current catalog version, first dropping the cached
+  results of catalog queries (datatier.query_cache) if the version
+  changed since this container last looked
+
+  Parameters
+  ----------
+  dbConn : the database connection
+
+  Returns
+  -------
+  the catalog version (integer; 0 if the table is empty)
+  """
+  global _version
+
+  ttl = bootstrap.get_config().getint('cache', 'version_ttl', fallback=5)
+
+  row = datatier.retrieve_one_row(dbConn, version_sql,
+                                  cache_ttl=ttl if ttl > 0 else None)
+  version = row[0] if row != () else 0
+
+  with _lock:
+    if _version is not None and version != _version:
+      dropped = datatier.query_cache.invalidate(CATALOG_TABLES)
+      print("catalog version", _version, "->", version, "dropped",
+            dropped, "cached results")
+    _version = version
+
+  return version
+
+
+###################################################################
+#
+# bump_version:
+#
+def bump_version(dbConn):
+  """
+  Moves the catalog version on by one, telling every cache that the
+  products table changed
+
+  Parameters
+  ----------
+  dbConn : the database connection
+
+  Returns
+  -------
+  the new version, or None if there is no catalog_version row
+  """
+  if datatier.perform_action(dbConn, bump_sql) == 0:
+    return None
+
+  return datatier.retrieve_one_row(dbConn, version_sql)[0]
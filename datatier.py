@@ -8,7 +8,11 @@
 #   Northwestern University
 #
 
-import pymysql
+import re
+import threading
+import time
+
+from collections import OrderedDict
 
 
 ###################################################################
@@ -35,6 +39,10 @@ def get_dbConn(endpoint, portnum, username, pwd, dbname):
   -------
   a connection object
   """
+  # deferred import: the query helpers only need a connection
+  # object, so nothing else in this module depends on pymysql
+  import pymysql
+
   try:
     dbConn = pymysql.connect(host=endpoint,
                              port=portnum,
@@ -50,6 +58,351 @@ def get_dbConn(endpoint, portnum, username, pwd, dbname):
     raise
 
 
+###################################################################
+#
+# ConnectionPool:
+#
+# Keeps database connections open at module scope so that warm
+# Lambda invocations can reuse them instead of paying for a new
+# TCP + TLS + login handshake on every request.
+#
+class ConnectionPool:
+  """
+  A bounded pool of connections to one MySQL database
+
+  Connections are pinged before they are handed out, and
+  transparently reopened if the server closed them while idle. At
+  most max_size connections are open at once; acquire() waits for
+  one to be released when the pool is exhausted.
+  """
+
+  def __init__(self, endpoint, portnum, username, pwd, dbname,
+               max_size=4):
+    """
+    Parameters
+    ----------
+    endpoint : machine name or IP address of server (string),
+    portnum : server port # (integer),
+    username : user name for login (string),
+    pwd : user password for login (string),
+    dbname : database name (string),
+    max_size : maximum # of open connections (integer)
+    """
+    self.endpoint = endpoint
+    self.portnum = portnum
+    self.username = username
+    self.pwd = pwd
+    self.dbname = dbname
+    self.max_size = max_size
+
+    self._idle = []
+    self._num_open = 0
+    self._cond = threading.Condition()
+
+  def _open(self):
+    """
+    Opens a new connection, giving back its slot if that fails
+    """
+    try:
+      return get_dbConn(self.endpoint, self.portnum, self.username,
+                        self.pwd, self.dbname)
+    except Exception:
+      with self._cond:
+        self._num_open -= 1
+        self._cond.notify()
+      raise
+
+  def acquire(self, timeout=None):
+    """
+    Returns an open connection from the pool
+
+    Parameters
+    ----------
+    timeout : seconds to wait if the pool is exhausted (None waits
+              forever)
+
+    Returns
+    -------
+    a connection object, to be handed back with release()
+    """
+    with self._cond:
+      while len(self._idle) == 0 and self._num_open >= self.max_size:
+        if not self._cond.wait(timeout):
+          raise Exception("datatier: all " + str(self.max_size) +
+                          " database connections are in use")
+
+      if len(self._idle) == 0:
+        # room for one more connection:
+        self._num_open += 1
+        dbConn = None
+      else:
+        dbConn = self._idle.pop()
+
+    if dbConn is None:
+      return self._open()
+
+    #
+    # the connection may have been closed by the server while the
+    # container was frozen; ping (reconnecting if need be), and if
+    # even that fails, replace it with a brand new connection:
+    #
+    try:
+      dbConn.ping(reconnect=True)
+      return dbConn
+    except Exception as err:
+      print("datatier.ConnectionPool: reconnecting after ping failed:")
+      print(str(err))
+      try:
+        dbConn.close()
+      except Exception:
+        pass
+      return self._open()
+
+  def release(self, dbConn):
+    """
+    Hands a connection obtained from acquire() back to the pool
+
+    Any open transaction is rolled back first, so the next user of
+    the connection doesn't see a stale read snapshot.
+    """
+    try:
+      dbConn.rollback()
+    except Exception:
+      # broken connection, drop it rather than pooling it:
+      try:
+        dbConn.close()
+      except Exception:
+        pass
+      with self._cond:
+        self._num_open -= 1
+        self._cond.notify()
+      return
+
+    with self._cond:
+      self._idle.append(dbConn)
+      self._cond.notify()
+
+
+#
+# one pool per database, shared by every invocation in this process:
+#
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+###################################################################
+#
+# get_pool:
+#
+# Returns the process-wide connection pool for a database,
+# creating it on first use.
+#
+def get_pool(endpoint, portnum, username, pwd, dbname, max_size=4):
+  """
+  Returns the ConnectionPool for the given database
+
+  Parameters
+  ----------
+  endpoint : machine name or IP address of server (string),
+  portnum : server port # (integer),
+  username : user name for login (string),
+  pwd : user password for login (string),
+  dbname : database name (string),
+  max_size : maximum # of open connections, used when the pool is
+             first created (integer)
+
+  Returns
+  -------
+  a ConnectionPool object
+  """
+  key = (endpoint, portnum, username, pwd, dbname)
+
+  with _pools_lock:
+    pool = _pools.get(key)
+    if pool is None:
+      pool = ConnectionPool(endpoint, portnum, username, pwd, dbname,
+                            max_size)
+      _pools[key] = pool
+
+  return pool
+
+
+###################################################################
+#
+# QueryCache:
+#
+# Keeps the results of SELECT queries at module scope, so that warm
+# lambda containers can answer repeated lookups of rows that rarely
+# change (e.g. the product catalog) without a database round trip.
+# Entries are keyed by SQL text + parameters, expire after the TTL
+# they were stored with, and the least recently used entry is
+# evicted once the cache is full.
+#
+# Every entry remembers the tables its query reads (the names after
+# FROM / JOIN), so a write to a table can invalidate exactly the
+# entries that may have changed.
+#
+_table_names = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+class QueryCache:
+  """
+  A bounded, thread-safe LRU cache of query results with per-entry
+  expiry, and hit / miss counters
+
+  The cache holds at most max_size results and, if max_rows is
+  given, at most max_rows rows across all of them, so a few huge
+  results can't take up the memory of many small ones.
+  """
+
+  def __init__(self, max_size=1024, max_rows=None):
+    """
+    Parameters
+    ----------
+    max_size : maximum # of cached results (integer),
+    max_rows : maximum # of rows in all cached results together
+               (integer, or None for no limit)
+    """
+    self.max_size = max_size
+    self.max_rows = max_rows
+    self.hits = 0
+    self.misses = 0
+
+    # key -> (expires, tables, result, rows), least recently used first:
+    self._entries = OrderedDict()
+    self._rows = 0
+    self._lock = threading.Lock()
+
+  def _drop(self, key):
+    self._rows -= self._entries.pop(key)[3]
+
+  def get(self, key):
+    """
+    Looks up a cached result
+
+    Returns
+    -------
+    (True, result) if key is cached and hasn't expired, otherwise
+    (False, None)
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+
+      if entry is not None and entry[0] > time.monotonic():
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return (True, entry[2])
+
+      if entry is not None:
+        self._drop(key)
+      self.misses += 1
+      return (False, None)
+
+  def put(self, key, result, ttl, rows=1):
+    """
+    Caches the result of the query key[0], which has the given # of
+    rows, for ttl seconds; a result with more than max_rows rows is
+    not cached at all
+
+    Returns
+    -------
+    True if the result was cached
+    """
+    if self.max_rows is not None and rows > self.max_rows:
+      return False
+
+    tables = frozenset(name.lower() for name in _table_names.findall(key[0]))
+
+    with self._lock:
+      if key in self._entries:
+        self._drop(key)
+
+      self._entries[key] = (time.monotonic() + ttl, tables, result, rows)
+      self._rows += rows
+
+      while len(self._entries) > self.max_size or (
+          self.max_rows is not None and self._rows > self.max_rows):
+        self._drop(next(iter(self._entries)))
+
+    return True
+
+  def invalidate(self, tables=None):
+    """
+    Drops the cached results of queries that read any of the given
+    tables, or every result if tables is None
+
+    Returns
+    -------
+    # of results dropped
+    """
+    with self._lock:
+      if tables is None:
+        dropped = len(self._entries)
+        self._entries.clear()
+        self._rows = 0
+        return dropped
+
+      tables = set(table.lower() for table in tables)
+      keys = [
+          key for key, entry in self._entries.items()
+          if not tables.isdisjoint(entry[1])
+      ]
+      for key in keys:
+        self._drop(key)
+      return len(keys)
+
+  def hit_ratio(self):
+    """
+    Returns the fraction of lookups answered from the cache (0.0
+    before the first lookup)
+    """
+    with self._lock:
+      lookups = self.hits + self.misses
+      return self.hits / lookups if lookups > 0 else 0.0
+
+  def stats(self):
+    """
+    Returns a dict of the entry and row counts and hit / miss counters
+    """
+    with self._lock:
+      return {
+          "entries": len(self._entries),
+          "rows": self._rows,
+          "hits": self.hits,
+          "misses": self.misses
+      }
+
+
+#
+# one cache shared by every invocation in this process; only queries
+# run with a cache_ttl are ever stored in it:
+#
+query_cache = QueryCache()
+
+
+#
+# _cached:
+#
+# Returns the cached result of a query, or runs fetch() and caches
+# what it returns; results are shared between callers, so they are
+# stored as tuples.
+#
+def _cached(kind, sql, parameters, cache_ttl, fetch):
+  key = (sql, kind, tuple(parameters))
+
+  found, result = query_cache.get(key)
+  if found:
+    return result
+
+  result = fetch()
+  if kind == "all":
+    result = tuple(result)
+    query_cache.put(key, result, cache_ttl, len(result))
+  else:
+    query_cache.put(key, result, cache_ttl)
+  return result
+
+
 ##################################################################
 #
 # retrieve_one_row:
@@ -61,7 +414,7 @@ def get_dbConn(endpoint, portnum, username, pwd, dbname):
 # can be parameterized using %s, in which case pass the
 # values as a list [value1, value2, ...]
 #
-def retrieve_one_row(dbConn, sql, parameters=[]):
+def retrieve_one_row(dbConn, sql, parameters=[], cache_ttl=None):
   """
   Executes an sql SELECT query against the database connection
   and returns the first row as a tuple
@@ -71,12 +424,18 @@ def retrieve_one_row(dbConn, sql, parameters=[]):
   dbConn : the database connection, 
   sql : the SQL SELECT query (can be parameterized with %s),
   parameters: optional list of values if parameterized
+  cache_ttl: optional # of seconds the result may be served
+             from datatier.query_cache (None: not cached)
 
   Returns
   _______
   First row as a tuple, or () if SELECT retrieves no data
   """
 
+  if cache_ttl is not None:
+    return _cached("one", sql, parameters, cache_ttl,
+                   lambda: retrieve_one_row(dbConn, sql, parameters))
+
   dbCursor = dbConn.cursor()
 
   try:
@@ -107,7 +466,7 @@ def retrieve_one_row(dbConn, sql, parameters=[]):
 # The query can be parameterized using %s, in which case
 # pass the values as a list [value1, value2, ...]
 #
-def retrieve_all_rows(dbConn, sql, parameters=[]):
+def retrieve_all_rows(dbConn, sql, parameters=[], cache_ttl=None):
   """
   Executes an sql SELECT query against the database connection
   and returns all rows as a list of tuples
@@ -117,6 +476,8 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
   dbConn : the database connection, 
   sql : the SQL SELECT query (can be parameterized with %s),
   parameters: optional list of values if parameterized
+  cache_ttl: optional # of seconds the result may be served
+             from datatier.query_cache (None: not cached)
 
   Returns
   _______
@@ -124,6 +485,10 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
   data
   """
 
+  if cache_ttl is not None:
+    return _cached("all", sql, parameters, cache_ttl,
+                   lambda: retrieve_all_rows(dbConn, sql, parameters))
+
   dbCursor = dbConn.cursor()
 
   try:
@@ -155,7 +520,7 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
 # using %s, in which case pass the values as a list
 # [value1, value2, ...]
 #
-def perform_action(dbConn, sql, parameters=[]):
+def perform_action(dbConn, sql, parameters=[], invalidate=None):
   """
   Executes an sql ACTION query against the database connection
   and returns number of rows modified
@@ -165,6 +530,8 @@ def perform_action(dbConn, sql, parameters=[]):
   dbConn : the database connection, 
   sql : the SQL SELECT query (can be parameterized with %s),
   parameters: optional list of values if parameterized
+  invalidate: optional list of table names whose cached query
+              results are dropped once the action commits
 
   Returns
   _______
@@ -179,6 +546,8 @@ def perform_action(dbConn, sql, parameters=[]):
     # and return the # of rows modified by the query:
     dbCursor.execute(sql, parameters)
     dbConn.commit()
+    if invalidate is not None:
+      query_cache.invalidate(invalidate)
     return dbCursor.rowcount
 
   except Exception as err:
@@ -190,3 +559,106 @@ def perform_action(dbConn, sql, parameters=[]):
 
   finally:
     dbCursor.close()
+
+
+###############################################################
+#
+# perform_batch:
+#
+# Given a database connection, an SQL action query and a list
+# of parameter lists, executes the query once per parameter
+# list inside a single transaction and returns the total number
+# of rows modified. For "insert ... values (%s, ...)" queries,
+# pymysql sends the whole batch as one multi-row insert.
+#
+def perform_batch(dbConn, sql, rows):
+  """
+  Executes an sql ACTION query for each parameter list in rows,
+  all in one transaction, and returns number of rows modified
+
+  Parameters
+  __________
+  dbConn : the database connection,
+  sql : the SQL ACTION query (parameterized with %s),
+  rows: list of parameter lists, one per execution
+
+  Returns
+  _______
+  number of rows modified (0 is not an error but implies
+  the query made no modifications)
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    # execute the whole batch, and commit only if all of it
+    # succeeded:
+    dbConn.begin()
+    dbCursor.executemany(sql, rows)
+    dbConn.commit()
+    return dbCursor.rowcount
+
+  except Exception as err:
+    # failed, rollback the entire batch and log error:
+    dbConn.rollback()
+    print("datatier.perform_batch() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    dbCursor.close()
+
+
+###############################################################
+#
+# perform_transaction:
+#
+# Given a database connection and a list of (sql, parameters)
+# ACTION queries, executes them in order inside a single
+# transaction. Every query is expected to modify at least one
+# row; if one doesn't (e.g. deleting a row that is already
+# gone), the whole transaction is rolled back and None is
+# returned, so related tables are never updated halfway.
+#
+def perform_transaction(dbConn, actions):
+  """
+  Executes several sql ACTION queries as one transaction, which
+  is rolled back unless every query modifies at least one row
+
+  Parameters
+  __________
+  dbConn : the database connection,
+  actions : list of (sql, parameters) pairs, executed in order
+
+  Returns
+  _______
+  list of the number of rows modified by each query, or None
+  if a query modified no rows and the transaction was rolled
+  back
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    dbConn.begin()
+
+    rowcounts = []
+    for sql, parameters in actions:
+      dbCursor.execute(sql, parameters)
+      if dbCursor.rowcount < 1:
+        dbConn.rollback()
+        return None
+      rowcounts.append(dbCursor.rowcount)
+
+    dbConn.commit()
+    return rowcounts
+
+  except Exception as err:
+    # failed, rollback the entire transaction and log error:
+    dbConn.rollback()
+    print("datatier.perform_transaction() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    dbCursor.close()
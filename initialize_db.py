@@ -3,44 +3,149 @@
 # interaction. IKEA would be the client wanting to modify RDS 
 # by adding its products.
 #
+# The catalog file (a JSON array of products) is read as a stream
+# and inserted in batches, each batch a single multi-row INSERT
+# IGNORE inside its own transaction, so memory stays flat no matter
+# how big the catalog is. With --workers N, the products are split
+# across N threads, each with its own database connection.
+#
+# With --sync, the file is instead compared against what's already
+# in the table: every product row stores a fingerprint (a hash of
+# its catalog record), and only products that are new, changed or
+# gone from the file are inserted, updated or retired (deleted).
+#
+# Whenever a load or sync changes the table, the catalog version
+# (see catalog.py) is bumped, so the lambda functions know to drop
+# anything they cached from the products table.
+#
+# Usage:
+#
+#   python initialize_db.py [--file ikea_sample_file.json]
+#                           [--batch-size 500] [--workers 1] [--sync]
+#
 # Authors:
 #   BHAVI BARNWAL, KAREN LEE
 #   Northwestern University
 #   Spring 2024
 #
 
+import argparse
+import catalog
 import datatier  # MySQL database access
+import hashlib
 import json
+import queue
 import sys
+import threading
+import time
+import zlib
 
 from configparser import ConfigParser
 
-configur = ConfigParser()
-configur.read('ikeaapp-config.ini')
-endpoint = configur.get('rds', 'endpoint')
-portnum = int(configur.get('rds', 'port_number'))
-username = configur.get('rds', 'user_name')
-pwd = configur.get('rds', 'user_pwd')
-dbname = configur.get('rds', 'db_name')
+sql = """INSERT IGNORE INTO products 
+    (product_title, product_url, sku, mpn, currency, product_price, product_condition, 
+    available, seller, seller_url, brand, fingerprint) 
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);"""
 
-dbConn = datatier.get_dbConn(endpoint, portnum, username, pwd, dbname)
+update_sql = """UPDATE products SET
+    product_title = %s, product_url = %s, sku = %s, mpn = %s, currency = %s,
+    product_price = %s, product_condition = %s, available = %s, seller = %s,
+    seller_url = %s, brand = %s, fingerprint = %s
+    WHERE product_id = %s;"""
 
-if dbConn is None:
-  print('**ERROR: unable to connect to database, exiting')
-  sys.exit(0)
+retire_sql = "DELETE FROM products WHERE product_id = %s;"
 
-with open('ikea_sample_file.json', 'r') as file:
-    products = json.load(file)
 
-sql = """INSERT IGNORE INTO products 
-    (product_title, product_url, sku, mpn, currency, product_price, product_condition, 
-    available, seller, seller_url, brand) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);"""
+###################################################################
+#
+# read_products:
+#
+# Yields the products in a JSON array file one at a time, reading
+# the file in fixed-size chunks instead of loading it whole.
+#
+def read_products(filename, chunk_size=1 << 16):
+    """
+    Streams the elements of a top-level JSON array
 
-for product in products:
-    try:
-        print("Inserting product:", product['product_title'])
-        datatier.perform_action(dbConn, sql, [
+    Parameters
+    ----------
+    filename : path of a file holding a JSON array,
+    chunk_size : # of characters to read at a time
+
+    Returns
+    -------
+    generator of the array's elements (dicts for a catalog file)
+    """
+    decoder = json.JSONDecoder()
+
+    with open(filename, 'r') as file:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def skip_whitespace():
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                # buffer used up, drop it and read the next chunk:
+                buf = file.read(chunk_size)
+                pos = 0
+                eof = buf == ""
+
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] != '[':
+            raise ValueError("expecting a JSON array in " + filename)
+        pos += 1
+
+        skip_whitespace()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        while True:
+            skip_whitespace()
+
+            #
+            # decode the next element; if it runs past the end of the
+            # buffer (or might, e.g. a number), read more and retry:
+            #
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = file.read(chunk_size)
+                eof = chunk == ""
+                buf = buf[pos:] + chunk
+                pos = 0
+
+            yield value
+            pos = end
+
+            skip_whitespace()
+            if pos >= len(buf):
+                raise ValueError("unexpected end of file in " + filename)
+            if buf[pos] == ']':
+                return
+            if buf[pos] != ',':
+                raise ValueError("expecting ',' or ']' in " + filename)
+            pos += 1
+
+
+###################################################################
+#
+# product_values:
+#
+# Maps a product from the catalog file to the parameters of the
+# INSERT statement: its column values followed by its fingerprint.
+#
+def product_values(product):
+    values = [
         product['product_title'],
         product['product_url'],
         product['sku'],
@@ -51,12 +156,486 @@ for product in products:
         product['availability'],
         product['seller'],
         product['seller_url'],
-        product['brand']])
+        product['brand']]
+
+    return values + [fingerprint(values)]
+
+
+###################################################################
+#
+# fingerprint:
+#
+# Hash of a product's column values, stored with the row so a sync
+# can tell whether the catalog record changed.
+#
+def fingerprint(values):
+    data = json.dumps(values, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+###################################################################
+#
+# is_lock_conflict:
+#
+# True if a MySQL error is a deadlock (1213) or lock wait timeout
+# (1205), i.e. something worth retrying.
+#
+def is_lock_conflict(err):
+    return len(err.args) > 0 and err.args[0] in (1205, 1213)
+
+
+###################################################################
+#
+# write_batch:
+#
+# Writes a batch of products in one transaction. If the batch
+# fails, it is retried one row at a time so only the bad rows are
+# lost (and reported).
+#
+def write_batch(dbConn, action, batch, failed):
+    """
+    Runs an action query for a batch of products, returning the #
+    of rows modified
+
+    Parameters
+    ----------
+    dbConn : the database connection,
+    action : the SQL action query (sql, update_sql, ...),
+    batch : list of (product, values) pairs,
+    failed : list that (title, error) pairs are appended to for
+             every product that could not be written
+
+    Returns
+    -------
+    number of rows modified (ignored duplicates are not counted)
+    """
+    rows = [values for product, values in batch]
+
+    #
+    # concurrent workers can deadlock on the unique index now and
+    # then; that's not the batch's fault, so just try it again:
+    #
+    for attempt in range(3):
+        try:
+            return datatier.perform_batch(dbConn, action, rows)
+        except Exception as e:
+            if not is_lock_conflict(e):
+                break
+
+    print("batch failed, retrying its", len(batch), "rows one at a time")
+
+    inserted = 0
+    for product, values in batch:
+        try:
+            inserted += datatier.perform_action(dbConn, action, values)
+        except Exception as e:
+            failed.append((product.get('product_title'), str(e)))
+
+    return inserted
+
+
+###################################################################
+#
+# load_catalog:
+#
+def load_catalog(dbConn, filename, batch_size):
+    """
+    Streams a catalog file into the products table
+
+    Parameters
+    ----------
+    dbConn : the database connection,
+    filename : catalog file (JSON array of products),
+    batch_size : # of products per multi-row INSERT
+
+    Returns
+    -------
+    dict with the # of products read, inserted and failed, the
+    failed (title, error) pairs, and the elapsed seconds
+    """
+    start = time.perf_counter()
+
+    read = 0
+    inserted = 0
+    failed = []
+    batch = []
+
+    for product in read_products(filename):
+        read += 1
+        try:
+            batch.append((product, product_values(product)))
+        except Exception as e:
+            failed.append((product.get('product_title'), "missing " + str(e)))
+
+        if len(batch) >= batch_size:
+            inserted += write_batch(dbConn, sql, batch, failed)
+            batch = []
+            print("products read:", read)
+
+    if len(batch) > 0:
+        inserted += write_batch(dbConn, sql, batch, failed)
+
+    return {
+        'read': read,
+        'inserted': inserted,
+        'failed': failed,
+        'seconds': time.perf_counter() - start}
+
+
+###################################################################
+#
+# sync_catalog:
+#
+def sync_catalog(dbConn, filename, batch_size):
+    """
+    Brings the products table in line with a catalog file, writing
+    only the products that changed
+
+    Products are matched on product_url. New products are inserted,
+    products whose fingerprint differs are updated, and products no
+    longer in the file are retired (deleted).
+
+    Parameters
+    ----------
+    dbConn : the database connection,
+    filename : catalog file (JSON array of products),
+    batch_size : # of products written per transaction
+
+    Returns
+    -------
+    dict with the # of products read, inserted, updated, unchanged
+    and retired, the failed (title, error) pairs, and the elapsed
+    seconds
+    """
+    start = time.perf_counter()
+
+    #
+    # one pass over the table for what's there now: product_url ->
+    # (product_id, fingerprint)
+    #
+    rows = datatier.retrieve_all_rows(
+        dbConn, "SELECT product_url, product_id, fingerprint FROM products")
+    existing = {row[0]: (row[1], row[2]) for row in rows}
+    rows = None
+    print("products in table:", len(existing))
+
+    read = 0
+    inserted = 0
+    updated = 0
+    unchanged = 0
+    failed = []
+    seen = set()
+    malformed = set()
+    inserts = []
+    updates = []
+
+    for product in read_products(filename):
+        read += 1
+        try:
+            values = product_values(product)
+        except Exception as e:
+            failed.append((product.get('product_title'), "missing " + str(e)))
+            # the product is still in the file, so it must not be
+            # retired just because this record of it is malformed:
+            if product.get('product_url') is not None:
+                malformed.add(product['product_url'])
+            continue
+
+        url = values[1]
+        if url in seen:
+            # duplicate in the file, the first one wins (INSERT IGNORE):
+            continue
+        seen.add(url)
+
+        if url not in existing:
+            inserts.append((product, values))
+        elif existing[url][1] != values[-1]:
+            updates.append((product, values + [existing[url][0]]))
+        else:
+            unchanged += 1
+
+        if len(inserts) >= batch_size:
+            inserted += write_batch(dbConn, sql, inserts, failed)
+            inserts = []
+        if len(updates) >= batch_size:
+            updated += write_batch(dbConn, update_sql, updates, failed)
+            updates = []
+
+    if len(inserts) > 0:
+        inserted += write_batch(dbConn, sql, inserts, failed)
+    if len(updates) > 0:
+        updated += write_batch(dbConn, update_sql, updates, failed)
+
+    #
+    # whatever is in the table but wasn't in the file is retired; an
+    # empty (or unreadable) file retires nothing rather than everything,
+    # and a product whose record failed is reported as failed and kept:
+    #
+    retired = 0
+    if len(seen) > 0:
+        gone = [({'product_title': url}, [product_id])
+                for url, (product_id, fp) in existing.items()
+                if url not in seen and url not in malformed]
+        for i in range(0, len(gone), batch_size):
+            retired += write_batch(dbConn, retire_sql, gone[i:i + batch_size],
+                                   failed)
+
+    return {
+        'read': read,
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': unchanged,
+        'retired': retired,
+        'failed': failed,
+        'seconds': time.perf_counter() - start}
+
+
+###################################################################
+#
+# load_worker:
+#
+# Body of one import thread: inserts the products handed to it
+# through its queue, in batches, over its own connection.
+#
+def load_worker(connect, products, batch_size, stats):
+    start = time.perf_counter()
+    batch = []
+    dbConn = None
+
+    try:
+        dbConn = connect()
+
+        while True:
+            product = products.get()
+            if product is not None:
+                stats['read'] += 1
+                try:
+                    batch.append((product, product_values(product)))
+                except Exception as e:
+                    stats['failed'].append(
+                        (product.get('product_title'), "missing " + str(e)))
+
+            if len(batch) >= batch_size or (product is None and batch):
+                stats['inserted'] += write_batch(dbConn, sql, batch,
+                                                 stats['failed'])
+                batch = []
+
+            if product is None:
+                break
+
     except Exception as e:
-        print(f"Failed to insert product: {product['product_title']}")
-        print("Error:", e)
-        
-dbConn.close()
- 
- 
- 
+        print("worker", stats['worker'], "failed:", str(e))
+        stats['error'] = str(e)
+        # report what this worker won't insert, and keep draining so
+        # the reader never blocks on this queue:
+        for product, values in batch:
+            stats['failed'].append((product.get('product_title'), str(e)))
+        product = products.get()
+        while product is not None:
+            stats['read'] += 1
+            stats['failed'].append((product.get('product_title'), str(e)))
+            product = products.get()
+
+    finally:
+        if dbConn is not None:
+            dbConn.close()
+        stats['seconds'] = time.perf_counter() - start
+
+
+###################################################################
+#
+# load_catalog_parallel:
+#
+# Streams the catalog once and partitions it across worker threads
+# by product_url. All copies of a product_url go to the same worker,
+# in file order, so the first one in the file is the one INSERT
+# IGNORE keeps, same as a serial load.
+#
+def load_catalog_parallel(connect, filename, batch_size, workers):
+    """
+    Streams a catalog file into the products table using several
+    worker threads, each with its own connection
+
+    Parameters
+    ----------
+    connect : function returning a new database connection,
+    filename : catalog file (JSON array of products),
+    batch_size : # of products per multi-row INSERT,
+    workers : # of worker threads
+
+    Returns
+    -------
+    dict with the same totals as load_catalog, plus 'workers': a
+    list of per-worker stats dicts
+    """
+    start = time.perf_counter()
+
+    queues = []
+    threads = []
+    worker_stats = []
+
+    for i in range(workers):
+        # bounded, so memory stays flat if the database is slower
+        # than the file:
+        products = queue.Queue(maxsize=2 * batch_size)
+        stats = {'worker': i, 'read': 0, 'inserted': 0, 'failed': [],
+                 'seconds': 0.0, 'error': None}
+        thread = threading.Thread(target=load_worker,
+                                  args=(connect, products, batch_size, stats))
+        thread.start()
+        queues.append(products)
+        threads.append(thread)
+        worker_stats.append(stats)
+
+    read = 0
+    failed = []
+
+    try:
+        for product in read_products(filename):
+            read += 1
+            try:
+                url = product['product_url']
+            except Exception as e:
+                failed.append((product.get('product_title'),
+                               "missing " + str(e)))
+                continue
+
+            queues[zlib.crc32(str(url).encode()) % workers].put(product)
+
+            if read % (batch_size * workers) == 0:
+                print("products read:", read)
+    finally:
+        for products in queues:
+            products.put(None)
+        for thread in threads:
+            thread.join()
+
+    for stats in worker_stats:
+        failed.extend(stats['failed'])
+
+    return {
+        'read': read,
+        'inserted': sum(stats['inserted'] for stats in worker_stats),
+        'failed': failed,
+        'seconds': time.perf_counter() - start,
+        'workers': worker_stats}
+
+
+###################################################################
+#
+# bump_catalog_version:
+#
+# Bumps the catalog version if the load or sync with the given stats
+# wrote anything; an import that changed nothing leaves the caches
+# of the lambda functions alone.
+#
+def bump_catalog_version(dbConn, stats):
+    changed = (stats['inserted'] + stats.get('updated', 0) +
+               stats.get('retired', 0))
+    if changed == 0:
+        print("catalog unchanged, version not bumped")
+        return
+
+    version = catalog.bump_version(dbConn)
+    if version is None:
+        print("**WARNING: no catalog_version row, caches were not told"
+              " about this change")
+    else:
+        print("catalog version:", version)
+
+
+###################################################################
+#
+# print_report:
+#
+def print_report(stats):
+    seconds = stats['seconds']
+    rate = stats['read'] / seconds if seconds > 0 else 0.0
+
+    print()
+    print("products read:    ", stats['read'])
+    print("products inserted:", stats['inserted'])
+    if 'updated' in stats:
+        print("products updated: ", stats['updated'])
+        print("products retired: ", stats['retired'])
+        print("unchanged:        ", stats['unchanged'])
+    else:
+        print("duplicates:       ",
+              stats['read'] - stats['inserted'] - len(stats['failed']))
+    print("products failed:  ", len(stats['failed']))
+    print(f"elapsed:           {seconds:.2f} secs ({rate:.0f} rows/sec)")
+
+    for worker in stats.get('workers', []):
+        busy = worker['seconds']
+        worker_rate = worker['read'] / busy if busy > 0 else 0.0
+        print(f"  worker {worker['worker']}: {worker['read']} read, "
+              f"{worker['inserted']} inserted, {len(worker['failed'])} failed, "
+              f"{busy:.2f} secs ({worker_rate:.0f} rows/sec)")
+        if worker['error'] is not None:
+            print(f"  worker {worker['worker']} stopped early:", worker['error'])
+
+    for title, error in stats['failed']:
+        print(f"Failed to insert product: {title}")
+        print("Error:", error)
+
+
+###################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="load the IKEA catalog into the products table")
+    parser.add_argument('--file', default='ikea_sample_file.json',
+                        help="catalog file (JSON array of products)")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="products per multi-row INSERT")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker threads, each with its own connection "
+                        "(not with --sync)")
+    parser.add_argument('--sync', action='store_true',
+                        help="only insert, update or retire products that "
+                        "changed since the last load")
+    args = parser.parse_args()
+
+    # a sync compares against the whole table in one pass, so it
+    # always runs on a single connection:
+    if args.sync and args.workers > 1:
+        parser.error("--workers can't be used with --sync")
+
+    configur = ConfigParser()
+    configur.read('ikeaapp-config.ini')
+    endpoint = configur.get('rds', 'endpoint')
+    portnum = int(configur.get('rds', 'port_number'))
+    username = configur.get('rds', 'user_name')
+    pwd = configur.get('rds', 'user_pwd')
+    dbname = configur.get('rds', 'db_name')
+
+    if args.workers > 1:
+        def connect():
+            return datatier.get_dbConn(endpoint, portnum, username, pwd,
+                                       dbname)
+
+        stats = load_catalog_parallel(connect, args.file, args.batch_size,
+                                      args.workers)
+        print_report(stats)
+
+        dbConn = connect()
+        bump_catalog_version(dbConn, stats)
+        dbConn.close()
+        sys.exit(0)
+
+    dbConn = datatier.get_dbConn(endpoint, portnum, username, pwd, dbname)
+
+    if dbConn is None:
+        print('**ERROR: unable to connect to database, exiting')
+        sys.exit(0)
+
+    if args.sync:
+        stats = sync_catalog(dbConn, args.file, args.batch_size)
+    else:
+        stats = load_catalog(dbConn, args.file, args.batch_size)
+    print_report(stats)
+    bump_catalog_version(dbConn, stats)
+
+    dbConn.close()
@@ -11,23 +11,124 @@
 # https://api.klayers.cloud/api/v2/p3.8/layers/latest/us-east-2/json
 
 # upload a .JPG or .JPEG file to bucket from client-side,
-# shrinks image into .PNG format, puts it in shopping cart folder of bucket
+# shrinks image into .PNG format, puts it in the shopping cart folder of
+# the user it was uploaded for (see thumbnails.thumbnail_key)
+#
+# if ikea_upload already made the thumbnail from the same image (see
+# thumbnails.py), there's nothing left to do
+#
+# every record of the event is processed (S3 can batch several uploads
+# into one event), and the body maps each bucket key to its outcome
 
-import boto3
-import io
-import struct
 import json
-import boto3
-import os
-import uuid
-import base64
 import pathlib
-import datatier
 import urllib.parse
-import string
-from PIL import Image
+import bootstrap
+import cartarchive
+import thumbnails
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+###################################################################
+#
+# record_key:
+#
+# The bucket key of the object an S3 event record is about; keys
+# arrive URL-encoded (e.g. spaces as '+').
+#
+def record_key(record):
+  return urllib.parse.unquote_plus(record['s3']['object']['key'],
+                                   encoding='utf-8')
+
 
-from configparser import ConfigParser
+###################################################################
+#
+# process_record:
+#
+def process_record(s3_client, bucketname, record, profiles, palette=True):
+  """
+  Makes the thumbnails for the image in one S3 event record
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client (safe to share between threads),
+  bucketname : name of the bucket,
+  record : one entry of event['Records'],
+  profiles : list of (name, size, folder), see thumbnails.get_profiles,
+  palette : True to write palette (8-bit) PNGs
+
+  Returns
+  -------
+  (bucketkey, status, pngs): status is "success", "linked" (copied
+  from an earlier thumbnail of the same image) or "skipped" (the thumbnails were
+  already up to date), pngs a dict of thumbnail key -> bytes of the
+  new thumbnails (at least the cart one), or None; exceptions are
+  left to the caller
+  """
+  #
+  # this function is event-driven by a JPG/JPEG being
+  # dropped into S3. The bucket key is sent to
+  # us and obtain as follows:
+  #
+  bucketkey = record_key(record)
+  print("bucketkey:", bucketkey)
+
+  # checks that bucket item added has suffix ".jpeg" or ".jpg"
+  extension = pathlib.Path(bucketkey).suffix
+  if extension != ".jpg" and extension != ".jpeg":
+    raise Exception("expecting S3 document to have .jpg or .jpeg extension")
+
+  #
+  # ikea_upload may have made the thumbnails already, from the same
+  # bytes; the event carries the image's ETag (its MD5), so a HEAD
+  # on each thumbnail tells us without downloading the image:
+  #
+  md5 = thumbnails.etag_md5(record['s3']['object'].get('eTag'))
+
+  if all(
+      thumbnails.is_current(s3_client, bucketname,
+                            thumbnails.thumbnail_key(bucketkey, folder), md5)
+      for name, size, folder in profiles):
+    print("**Thumbnails already up to date, skipping:", bucketkey)
+    return (bucketkey, "skipped", None)
+
+  #
+  # the same image may have been processed before (re-uploaded, or
+  # under another product id), in which case the thumbnail index
+  # names thumbnails to copy:
+  #
+  if md5 is not None:
+    pngs = thumbnails.link_thumbnails(s3_client, bucketname, bucketkey, md5,
+                                      profiles, palette)
+    if pngs is not None:
+      print("**Thumbnails copied from an earlier upload:", bucketkey)
+      return (bucketkey, "linked", pngs)
+
+  #
+  # read the image straight into memory, and make every profile's
+  # thumbnail from one decode; thumbnails are saved in .PNG format
+  # to avoid neverending recursion:
+  #
+  response = s3_client.get_object(Bucket=bucketname, Key=bucketkey)
+  data = response['Body'].read()
+
+  # a multipart upload's ETag isn't its MD5, so only now can we look
+  # in the index:
+  if md5 is None:
+    pngs = thumbnails.link_thumbnails(s3_client, bucketname, bucketkey,
+                                      thumbnails.source_md5(data), profiles,
+                                      palette)
+    if pngs is not None:
+      print("**Thumbnails copied from an earlier upload:", bucketkey)
+      return (bucketkey, "linked", pngs)
+
+  pngs = thumbnails.store_thumbnails(s3_client, bucketname, bucketkey, data,
+                                     profiles, palette)
+
+  print("bucketkey results files:", list(pngs))
+
+  return (bucketkey, "success", pngs)
 
 
 def lambda_handler(event, context):
@@ -36,92 +137,82 @@ def lambda_handler(event, context):
     print("**lambda: ikeaapp_compute**")
 
     #
-    # in case we get an exception, initial this filename
-    # so we can write an error message if need be:
+    # S3 may deliver several uploads in one event, so every record
+    # is processed, by a small pool of threads; a bad image only
+    # fails its own record:
     #
-    bucketkey_results_file = ""
+    records = event['Records']
 
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    configur = ConfigParser()
-    configur.read(config_file)
+    print("**Processing", len(records), "record(s)**")
 
     #
-    # configure for S3 access:
+    # S3 is only set up once we know there is an image to process
+    # (and then cached for warm invocations):
     #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    bucketname = configur.get('s3', 'bucket_name')
-
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
+    s3_client = bootstrap.get_s3_client()
+    bucketname = bootstrap.get_bucketname()
+    configur = bootstrap.get_config()
+    workers = configur.getint('compute', 'workers', fallback=4)
+    palette = configur.getboolean('compute', 'palette', fallback=True)
+    profiles = thumbnails.get_profiles(configur)
+
+    def process(record):
+      try:
+        return process_record(s3_client, bucketname, record, profiles,
+                              palette)
+      except Exception as e:
+        try:
+          key = record_key(record)
+        except Exception:
+          key = '?'
+        print(f"Error processing image {key}: {str(e)}")
+        return (key, f"Error processing image: {str(e)}", None)
+
+    workers = max(1, min(workers, len(records)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      processed = list(executor.map(process, records))
+
+    results = {}
+    added = {}  # user id -> {member name -> png}
+    sources = {}  # user id -> bucket keys of the images behind added
+    failed = 0
+
+    for bucketkey, status, pngs in processed:
+      results[bucketkey] = status
+      if pngs is None:
+        failed += status.startswith("Error")
+        continue
+      for key, png in pngs.items():
+        if key.startswith(cartarchive.CART_PREFIX):
+          user_id = cartarchive.cart_user(key)
+          members = added.setdefault(user_id, {})
+          members[cartarchive.member_name(key)] = png
+          sources.setdefault(user_id, []).append(bucketkey)
 
     #
-    # configure for RDS access
+    # keep the cached cart zips (if there are any) in sync, so the
+    # next /download doesn't have to rebuild them; one update per
+    # cart for the whole batch, and a cart whose update fails only
+    # fails the records of that cart:
     #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    #
-    # this function is event-driven by a JPG/JPEG being
-    # dropped into S3. The bucket key is sent to
-    # us and obtain as follows:
-    #
-    bucketkey = urllib.parse.unquote_plus(
-        event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-    print("bucketkey:", bucketkey)
-
-    # checks that bucket item added has suffix ".jpeg" or ".jpg"
-    extension = pathlib.Path(bucketkey).suffix
-    if extension != ".jpg" and extension != ".jpeg":
-      raise Exception("expecting S3 document to have .jpg or .jpeg extension")
-
-    # creates empty results file for thumbnail storage (stored in bucket/ikeaapp/cart_ikeaapp/imgname)
-    if extension == ".jpg":
-      bucketkey_results_file = str("ikeaapp/" + "cart_" + bucketkey[0:-4] +
-                                   ".PNG")
-    else:
-      bucketkey_results_file = str("ikeaapp/" + "cart_" + bucketkey[0:-5] +
-                                   ".PNG")
-
-    local_jpg = str("/tmp/data" + extension)
-    bucket.download_file(bucketkey, local_jpg)
-
-    print('local jpg before: ', local_jpg)
-
-    image = Image.open(local_jpg)
-
-    # resize image
-    image.thumbnail((50, 50))
-    print('image: ', image)
-
-    print('local jpg after: ', local_jpg)
-
-    resized_buffer = io.BytesIO()
-
-    # thumbnail saved with .PNG format to avoid neverending recursion
-    image.save(resized_buffer, format='PNG')
-    resized_buffer.seek(0)
-    print("local results file:", resized_buffer)
-
-    print("bucketkey results file:", bucketkey_results_file)
-
-    # uploads thumbnail to cart_ikeaapp bucket
-    bucket.upload_fileobj(resized_buffer,
-                          bucketkey_results_file,
-                          ExtraArgs={
-                              'ACL': 'public-read',
-                              'ContentType': 'image/PNG'
-                          })
+    for user_id, members in added.items():
+      print("**Updating cart zip of", user_id + "**")
+      try:
+        cartarchive.update_archive(s3_client, bucketname, user_id, add=members)
+      except Exception as e:
+        print(f"Error updating cart zip of {user_id}: {str(e)}")
+        for bucketkey in sources[user_id]:
+          results[bucketkey] = f"Error updating cart zip: {str(e)}"
+          failed += 1
+
+    if failed > 0:
+      print("**DONE,", failed, "of", len(records), "record(s) failed**")
+      return {'statusCode': 500, 'body': json.dumps(results)}
 
     print("**DONE, returning success**")
 
-    return {'statusCode': 200, 'body': json.dumps("success")}
+    return {'statusCode': 200, 'body': json.dumps(results)}
 
   except Exception as e:
     # if error
@@ -1,85 +1,345 @@
-import os
-import boto3
-import shutil
+#
+# ikea_download
+# Returns all the thumbnails in the user's shopping cart (see carts.py)
+# as a zip file.
+#
+# The zip is cached in S3 (see cartarchive.py) and kept up to date
+# by ikea_compute and ikea_remove, so normally it's served as is,
+# with its ETag; if the client sends a matching If-None-Match, the
+# response is a bodyless 304. Only when there is no cached zip are
+# the thumbnails fetched from S3, by a small pool of threads, into a
+# zip built straight into an in-memory buffer (no /tmp directory).
+#
+# /download?format=sprite returns the cart as one atlas PNG plus an
+# index of product id -> [x, y, w, h] instead (see cartsprite.py),
+# cached until the cart changes.
+#
+
+import io
 import json
 import base64
+import zipfile
+import bootstrap
+import cartarchive
+import carts
+import cartsprite
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cartarchive import cart_prefix, member_name
+
+
+###################################################################
+#
+# list_cart_keys:
+#
+def list_cart_keys(s3_client, bucketname, user_id):
+  """
+  Returns the keys of the thumbnails in a user's cart folder, walking
+  every page of the listing (S3 returns at most 1000 per call); only
+  that user's keys are listed, however many carts there are
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  user_id : whose cart
+
+  Returns
+  -------
+  sorted list of keys
+  """
+  prefix = cart_prefix(user_id)
+
+  keys = []
+  kwargs = {'Bucket': bucketname, 'Prefix': prefix}
+
+  while True:
+    response = s3_client.list_objects_v2(**kwargs)
+
+    for obj in response.get('Contents', []):
+      # skip the "folder" placeholder object, if there is one:
+      if obj['Key'] != prefix:
+        keys.append(obj['Key'])
+
+    if not response.get('IsTruncated'):
+      break
+    kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+  return sorted(keys)
+
+
+###################################################################
+#
+# build_cart_zip:
+#
+def build_cart_zip(s3_client, bucketname, keys, workers=8):
+  """
+  Fetches the given objects from S3 into a zip held in memory
+
+  Objects are fetched concurrently by a bounded pool of threads,
+  but added to the zip in the order of keys, so the archive is the
+  same no matter which fetch finishes first. At most 2 * workers
+  fetched objects are waiting to be written at any time.
+
+  Thumbnails are PNGs, which are already compressed, so members
+  are stored rather than deflated again.
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client (safe to share between threads),
+  bucketname : name of the bucket,
+  keys : keys of the objects to zip,
+  workers : # of concurrent fetches
+
+  Returns
+  -------
+  io.BytesIO holding the zip file
+  """
+  def fetch(key):
+    return s3_client.get_object(Bucket=bucketname, Key=key)['Body'].read()
+
+  buffer = io.BytesIO()
+
+  with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive, \
+       ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = collections.deque()
+
+    for key in keys:
+      pending.append((key, executor.submit(fetch, key)))
+      if len(pending) >= 2 * workers:
+        key, future = pending.popleft()
+        archive.writestr(member_name(key), future.result())
+
+    while len(pending) > 0:
+      key, future = pending.popleft()
+      archive.writestr(member_name(key), future.result())
+
+  return buffer
+
+
+###################################################################
+#
+# base64_json_string:
+#
+# Same result as json.dumps(base64.b64encode(data).decode()), but
+# the base64 text is written chunk by chunk into one preallocated
+# buffer, so the whole zip only ever exists in memory as the zip
+# itself, its encoding, and the final string.
+#
+def base64_json_string(buffer, chunk_size=3 * 64 * 1024):
+  """
+  Returns a JSON string literal holding the base64 encoding of a
+  buffer's contents, and closes the buffer
+
+  Parameters
+  ----------
+  buffer : io.BytesIO to encode,
+  chunk_size : # of bytes encoded at a time (a multiple of 3, so
+               the encoded chunks can simply be concatenated)
+
+  Returns
+  -------
+  string, including the surrounding double quotes
+  """
+  with buffer.getbuffer() as view:
+    size = len(view)
+    out = bytearray(4 * ((size + 2) // 3) + 2)
+    out[0] = out[-1] = ord('"')
+
+    pos = 1
+    for i in range(0, size, chunk_size):
+      encoded = base64.b64encode(view[i:i + chunk_size])
+      out[pos:pos + len(encoded)] = encoded
+      pos += len(encoded)
+
+  buffer.close()
+
+  return out.decode()
+
+
+###################################################################
+#
+# rebuild_archive:
+#
+def rebuild_archive(s3_client, bucketname, user_id, workers):
+  """
+  Zips a user's cart folder and caches the zip in S3
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  user_id : whose cart,
+  workers : # of concurrent fetches
 
-from configparser import ConfigParser
+  Returns
+  -------
+  (buffer, etag): io.BytesIO holding the zip, and the cached zip's
+  ETag (None if it couldn't be cached)
+  """
+  keys = list_cart_keys(s3_client, bucketname, user_id)
+
+  if len(keys) == 0:
+    raise Exception("shopping cart '{}' is empty".format(user_id))
+
+  print("**Zipping", len(keys), "thumbnails from S3**")
+
+  buffer = build_cart_zip(s3_client, bucketname, keys, workers)
+
+  print("ZIP MADE")
+
+  #
+  # cache it, unless another call cached one first:
+  #
+  buffer.seek(0)
+  etag = cartarchive.put_archive(s3_client, bucketname, user_id, buffer)
+
+  #
+  # ikea_compute/ikea_remove leave a missing archive alone, so a
+  # thumbnail added or removed while we were zipping would never make
+  # it into ours. If the cart changed, drop the cached copy and let
+  # the next call rebuild it:
+  #
+  if etag is not None and list_cart_keys(s3_client, bucketname,
+                                        user_id) != keys:
+    print("**Cart changed while zipping, not caching**")
+    cartarchive.delete_archive(s3_client, bucketname, user_id)
+    etag = None
+
+  return (buffer, etag)
+
+
+###################################################################
+#
+# sprite_response:
+#
+def sprite_response(s3_client, bucketname, user_id, if_none_match, workers):
+  """
+  The /download?format=sprite response: a JSON object with the atlas
+  PNG (base64 encoded) and its index
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  user_id : whose cart,
+  if_none_match : the request's If-None-Match header, or None,
+  workers : # of concurrent fetches if the cart zip has to be rebuilt
+
+  Returns
+  -------
+  the lambda response (304 if the client's copy is current)
+  """
+  #
+  # the sprite is tagged with the ETag of the cart zip it was built
+  # from, so checking it only takes a HEAD on the zip:
+  #
+  archive_etag = cartarchive.head_archive(s3_client, bucketname, user_id)
+
+  if archive_etag is not None:
+    etag = cartsprite.sprite_etag(archive_etag)
+
+    if if_none_match == etag:
+      print("**Cart unchanged, returning 304**")
+      return {'statusCode': 304, 'headers': {'ETag': etag}, 'body': ''}
+
+    body = cartsprite.get_sprite(s3_client, bucketname, user_id,
+                                 archive_etag)
+    if body is not None:
+      print("**Serving cached sprite**")
+      return {'statusCode': 200, 'headers': {'ETag': etag}, 'body': body}
+
+  #
+  # build it from the cart zip (itself rebuilt if it's not cached):
+  #
+  data, archive_etag = cartarchive.get_archive(s3_client, bucketname, user_id)
+
+  if archive_etag is None:
+    print("**No cached zip, building one**")
+    buffer, archive_etag = rebuild_archive(s3_client, bucketname, user_id,
+                                           workers)
+  else:
+    buffer = io.BytesIO(data)
+    data = None
+    with zipfile.ZipFile(buffer) as archive:
+      if len(archive.namelist()) == 0:
+        raise Exception("shopping cart '{}' is empty".format(user_id))
+
+  print("**Packing sprite**")
+
+  palette = bootstrap.get_config().getboolean('download', 'sprite_palette',
+                                              fallback=False)
+  png, index = cartsprite.build_sprite(buffer, palette)
+
+  body = json.dumps({
+      'index': index,
+      'atlas': base64.b64encode(png).decode()
+  })
+
+  response = {'statusCode': 200, 'body': body}
+
+  if archive_etag is not None:
+    cartsprite.put_sprite(s3_client, bucketname, user_id, body, archive_etag)
+    response['headers'] = {'ETag': cartsprite.sprite_etag(archive_etag)}
+
+  return response
 
 
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
     print("**lambda: ikeaapp_download")
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    configur = ConfigParser()
-    configur.read(config_file)
 
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    bucketname = configur.get('s3', 'bucket_name')
-
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
-    s3_client = boto3.client('s3')
-
-    # download all files from the specified folder in the S3 bucket
-    response = s3_client.list_objects_v2(Bucket=bucketname,
-                                         Prefix='ikeaapp/cart_ikeaapp')
-    dir = "/tmp/cart_ikeaapp"
-
-    if not os.path.exists(dir):
-      os.makedirs(dir)
-
-    print("**Downloading shopping cart from S3**")
-
-    # check if any objects were found in the folder
-    if 'Contents' in response:
-      # iterate over each object in the folder
-      for obj in response['Contents']:
-        # get the object key (file name)
-        obj_key = obj['Key']
-        # define the local file path to save the object
-        local_filename = f'/tmp/{obj_key[8:30]}'
-        # download the object from S3 to the local file path
-        bucket.download_file(obj_key, local_filename)
-
-    print("DOWNLOAD DONE")
-
-    # zip the downloaded files
-    zip_filepath = '/tmp/cart_ikeaapp.zip'
-
-    if os.path.exists(dir) and os.listdir(dir):
-      # zip the downloaded files
-      zip_filepath = '/tmp/cart_ikeaapp.zip'
-      shutil.make_archive(zip_filepath[:-4], 'zip', dir)
-      print("ZIP MADE")
-    else:
-      # if the directory doesn't exist or is empty, raise an error
-      raise Exception(
-          "directory '{}' either doesn't exist or is empty".format(dir))
+    user_id = carts.get_user_id(event)
+    print("user id:", user_id)
 
-    print("**Results:")
+    params = event.get('queryStringParameters') or {}
+    format = params.get('format', 'zip')
+
+    if format != 'zip' and format != 'sprite':
+      raise Exception("unknown format '{}', expecting zip or sprite".format(
+          format))
 
     #
-    # open the file and read as raw bytes:
+    # S3 access is set up once per container:
     #
-    infile = open(zip_filepath, "rb")
-    bytes = infile.read()
-    infile.close()
+    bucketname = bootstrap.get_bucketname()
+    s3_client = bootstrap.get_s3_client()
+
+    if_none_match = carts.get_header(event, 'If-None-Match')
+    workers = bootstrap.get_config().getint('download', 'fetch_workers',
+                                            fallback=8)
+
+    if format == 'sprite':
+      response = sprite_response(s3_client, bucketname, user_id,
+                                 if_none_match, workers)
+      print("**DONE, returning results**")
+      return response
+
+    data, etag = cartarchive.get_archive(s3_client, bucketname, user_id,
+                                         if_none_match)
+
+    if data is None and etag is not None:
+      print("**Cart unchanged, returning 304**")
+      return {'statusCode': 304, 'headers': {'ETag': etag}, 'body': ''}
+
+    if etag is None:
+      print("**No cached zip, building one**")
+      buffer, etag = rebuild_archive(s3_client, bucketname, user_id, workers)
+    else:
+      print("**Serving cached zip**")
+      buffer = io.BytesIO(data)
+      data = None
+      with zipfile.ZipFile(buffer) as archive:
+        if len(archive.namelist()) == 0:
+          raise Exception("shopping cart '{}' is empty".format(user_id))
 
     #
-    # now encode the data as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for download:
+    # now encode the zip as base64, serialized as a JSON string:
     #
-    data = base64.b64encode(bytes)
-    datastr = data.decode()
+    body = base64_json_string(buffer)
 
     print("**DONE, returning results**")
 
@@ -87,7 +347,11 @@ def lambda_handler(event, context):
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    return {'statusCode': 200, 'body': json.dumps(datastr)}
+    response = {'statusCode': 200, 'body': body}
+    if etag is not None:
+      response['headers'] = {'ETag': etag}
+
+    return response
 
   except Exception as err:
     # if error
@@ -2,53 +2,119 @@
 # ikea_get_product_url
 # client enters the product ID, and the server returns a link to the product
 #
+# With "product_ids" (a list) instead of "product_id", the urls of all of
+# them are looked up with one query, and the response is
+# {"urls": {product id: url, ...}, "missing": [product ids not found]}.
+#
 
 import json
-import os
+import bootstrap
+import catalog
 import datatier
+import serialize
 
-from configparser import ConfigParser
+MAX_IDS = 1000
 
 
-def lambda_handler(event, context):
+###################################################################
+#
+# get_product_ids:
+#
+# Validates the "product_ids" parameter: a non-empty list of integer
+# ids (duplicates dropped, order kept).
+#
+def get_product_ids(value):
+  if not isinstance(value, list) or len(value) == 0:
+    raise Exception("product_ids must be a non-empty list")
+  if len(value) > MAX_IDS:
+    raise Exception("at most " + str(MAX_IDS) + " product_ids per request")
+
   try:
-    print("**STARTING**")
-    print("**lambda: ikeaapp-get-url**")
+    product_ids = [int(product_id) for product_id in value]
+  except (TypeError, ValueError):
+    raise Exception("product_ids must be integers")
 
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+  return list(dict.fromkeys(product_ids))
+
+
+###################################################################
+#
+# lookup_urls:
+#
+def lookup_urls(dbConn, product_ids):
+  """
+  Looks up the urls of several products with one query (an IN list
+  on the primary key)
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  product_ids : list of integer product ids
+
+  Returns
+  -------
+  (urls, missing): dict of product id (as a string) -> url, and
+  the list of ids that aren't in the products table, in the order
+  they were given
+  """
+  sql = """
+    SELECT product_id, product_url FROM products
+     WHERE product_id IN ({});
+  """.format(", ".join(["%s"] * len(product_ids)))
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, product_ids)
+
+  found = {row[0]: row[1] for row in rows}
+
+  urls = {}
+  missing = []
+  for product_id in product_ids:
+    if product_id in found:
+      # JSON object keys are strings
+      urls[str(product_id)] = found[product_id]
+    else:
+      missing.append(product_id)
+
+  return (urls, missing)
 
-    configur = ConfigParser()
-    configur.read(config_file)
 
-    # configure for RDS access
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
+def lambda_handler(event, context):
+  dbConn = None
+
+  try:
+    print("**STARTING**")
+    print("**lambda: ikeaapp-get-url**")
 
     if "body" not in event:
       raise Exception("event has no body")
 
     body = json.loads(event["body"])  # parse the json
 
-    # check for parameters
-    if "product_id" not in body:
+    # check for parameters: one product_id, or a list of product_ids
+    if "product_ids" in body:
+      product_ids = get_product_ids(body["product_ids"])
+    elif "product_id" in body:
+      product_ids = None
+      product_id = body["product_id"]
+    else:
       raise Exception("event has a body but no product_id")
 
-    product_id = body["product_id"]
-
     #
     # open connection to the database:
     #
     print("**Opening connection**")
 
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
-                                 rds_pwd, rds_dbname)
+    pool = bootstrap.get_db_pool()
+    dbConn = pool.acquire()
+
+    if product_ids is not None:
+      print("**Looking up", len(product_ids), "product ids**")
+
+      urls, missing = lookup_urls(dbConn, product_ids)
+
+      response = {"urls": urls, "missing": missing}
+
+      return {'statusCode': 200, 'body': serialize.dumps(response)}
 
     # initialize product_url
     product_url = ""
@@ -56,10 +122,21 @@ def lambda_handler(event, context):
     # sql to get url from product ID
     sql = "SELECT product_url FROM products WHERE product_id = %s"
 
-    row = datatier.retrieve_all_rows(dbConn, sql, [product_id])
+    # urls rarely change, so warm containers may answer this from
+    # the query cache, which is emptied when the catalog version
+    # moves on:
+    cache_ttl = bootstrap.get_cache_ttl()
+    if cache_ttl is not None:
+      catalog.check_version(dbConn)
+
+    row = datatier.retrieve_one_row(dbConn, sql, [product_id],
+                                    cache_ttl=cache_ttl)
+    print("query cache:", datatier.query_cache.stats())
 
-    # assign product_url to what we got back
-    product_url = str(row[0])
+    # assign product_url to what we got back ("" if there is
+    # no such product)
+    if row != ():
+      product_url = row[0]
 
     return {'statusCode': 200, 'body': json.dumps(product_url)}
 
@@ -69,3 +146,8 @@ def lambda_handler(event, context):
     print(str(err))
 
     return {'statusCode': 400, 'body': json.dumps(str(err))}
+
+  finally:
+    # hand the connection back to the pool for the next invocation:
+    if dbConn is not None:
+      pool.release(dbConn)
@@ -2,61 +2,198 @@
 # ikea_list
 # Returns the contents of the client's shopping list and the subtotal.
 #
+# The cart is the one of the user named by the X-User-Id header (see
+# carts.py). Its rows are one range of the cart table's primary key
+# (user_id, product_id), so a page costs the same however many other
+# carts there are. Each row is [product_id, product_name, price,
+# quantity].
+#
+# With a limit and/or cursor in the query string, only one page of
+# the cart is returned, together with the number of items and the
+# exact subtotal of the whole cart, read in the same query from the
+# user's cart_summary row that ikea_upload and ikea_remove keep up to
+# date:
+# {"items": [...], "item_count": n, "subtotal": "...", "version": v,
+# "next_cursor": ...}. Without them, every row is returned as a list,
+# as before.
+#
+# With shape=columnar, the rows are returned as {"columns": [...],
+# "rows": [...]} (in place of "items" in a page).
+#
+# The summary's version changes with every change to the cart, so it
+# is part of the response's ETag, together with whatever picks the
+# representation (the page's limit and cursor, and the shape); a
+# matching If-None-Match gets a 304 after a single-row lookup.
+#
 import json
-import boto3
-import os
+import bootstrap
+import carts
 import datatier
-from configparser import ConfigParser
+import paging
+import serialize
+
 from decimal import Decimal
 
 
+###################################################################
+#
+# list_sql:
+#
+# The user's cart totals (their cart_summary row) are LEFT JOINed to
+# the page of their cart rows, so every row carries them, and an empty
+# page is still one row (with NULL cart columns); a user who never
+# added anything has no summary row, and gets no rows at all.
+# Parameters: the cursor's product id twice (NULL for the first
+# page), the user id and the limit.
+#
+list_sql = """
+    SELECT c.product_id, c.product_name, c.price, c.quantity,
+           t.item_count, t.subtotal, t.version
+      FROM cart_summary AS t
+      LEFT JOIN cart AS c
+        ON c.user_id = t.user_id AND (%s IS NULL OR c.product_id > %s)
+     WHERE t.user_id = %s
+     ORDER BY c.product_id
+     LIMIT %s;
+"""
+
+version_sql = "SELECT version FROM cart_summary WHERE user_id = %s;"
+
+columns = ["product_id", "product_name", "price", "quantity"]
+
+
+###################################################################
+#
+# list_etag:
+#
+# The ETag of one representation of a version of the user's cart:
+# every page, page size and shape has a tag of its own, so a
+# conditional request never gets a 304 for a different body. (A
+# cursor is URL-safe base64, so it can go in the tag as is.)
+#
+def list_etag(user_id, version, paged=False, limit=None, cursor=None,
+              shape="rows"):
+    tag = "cart-" + user_id + "-" + str(version)
+
+    if paged:
+        tag += "-page-" + str(limit or "") + "-" + (cursor or "")
+
+    if shape != "rows":
+        tag += "-" + shape
+
+    return '"' + tag + '"'
+
+
 def lambda_handler(event, context):
+    dbConn = None
+
     try:
         print("**STARTING**")
         print("**lambda: ikeaapp_list**")
 
-        # setup AWS based on config file:
-        config_file = 'ikeaapp-config.ini'
-        os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+        #
+        # paging is optional: without a limit, every item is returned
+        #
+        user_id = carts.get_user_id(event)
+        print("user id:", user_id)
+
+        params = event.get("queryStringParameters") or {}
+
+        paged = "limit" in params or "cursor" in params
+
+        limit = None
+        after = None
+        if "limit" in params:
+            limit = paging.get_limit(params["limit"])
+        if params.get("cursor"):
+            after = paging.decode_cursor(params["cursor"])[0]
+
+        shape = serialize.get_shape(params.get("shape"))
 
-        configur = ConfigParser()
-        configur.read(config_file)
+        # one extra row tells us if there is a next page:
+        fetch = limit + 1 if limit is not None else 9223372036854775807
 
-        # configure for RDS access
-        rds_endpoint = configur.get('rds', 'endpoint')
-        rds_portnum = int(configur.get('rds', 'port_number'))
-        rds_username = configur.get('rds', 'user_name')
-        rds_pwd = configur.get('rds', 'user_pwd')
-        rds_dbname = configur.get('rds', 'db_name')
+        if_none_match = carts.get_header(event, "If-None-Match")
 
         # open connection to the database:
         print("**Opening connection**")
-        dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
-                                     rds_pwd, rds_dbname)
+        pool = bootstrap.get_db_pool()
+        dbConn = pool.acquire()
 
-        # retrieve all the products in shopping cart:
+        #
+        # the client already has this version of the cart:
+        #
+        if if_none_match is not None:
+            row = datatier.retrieve_one_row(dbConn, version_sql, [user_id])
+            version = row[0] if row != () else 0
+            etag = list_etag(user_id, version, paged, limit,
+                             params.get("cursor"), shape)
+            if etag == if_none_match:
+                print("**Cart unchanged, returning 304**")
+                return {
+                    'statusCode': 304,
+                    'headers': {'ETag': if_none_match},
+                    'body': ''
+                }
+
+        # retrieve the products in shopping cart, and the totals:
         print("**Retrieving data**")
-        sql = "SELECT * FROM cart"
-        rows = datatier.retrieve_all_rows(dbConn, sql)
+        rows = datatier.retrieve_all_rows(dbConn, list_sql,
+                                          [after, after, user_id, fetch])
 
-        # convert all decimals to floats for compatibility with JSON
-        new_rows = []
-        for row in rows:
-            new_row = list(row)
-            for i, value in enumerate(new_row):
-                if isinstance(value, Decimal):
-                    new_row[i] = float(value)
-            new_rows.append(new_row)
+        if len(rows) == 0:
+            # no summary row: nothing was ever added to this cart
+            item_count, subtotal, version = 0, Decimal("0.00"), 0
+        else:
+            item_count, subtotal, version = rows[0][4:7]
+
+        rows = [row[0:4] for row in rows if row[0] is not None]
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = paging.encode_cursor([rows[-1][0]])
 
-        for row in new_rows:
+        for row in rows:
             print(row)
 
+        print("item count:", item_count, "subtotal:", subtotal)
+
+        if paged:
+            # prices as strings, so the client gets them exactly:
+            items = [[row[0], row[1], str(row[2]), row[3]] for row in rows]
+            response = {
+                "item_count": item_count,
+                "subtotal": str(subtotal),
+                "version": version,
+                "next_cursor": next_cursor
+            }
+            if shape == "columnar":
+                response.update(serialize.table(columns, items, shape))
+            else:
+                response["items"] = items
+        else:
+            # the rows as they are; serialize encodes the Decimal
+            # prices as numbers
+            response = serialize.table(columns, rows, shape)
+
         # respond in an HTTP-like way, i.e., with a status code and body in JSON format:
         print("**DONE, returning rows**")
-        return {'statusCode': 200, 'body': json.dumps(new_rows)}
+        etag = list_etag(user_id, version, paged, limit, params.get("cursor"),
+                         shape)
+        return {
+            'statusCode': 200,
+            'headers': {'ETag': etag},
+            'body': serialize.dumps(response)
+        }
 
     except Exception as err:
         # if error
         print("**ERROR**")
         print(str(err))
         return {'statusCode': 400, 'body': json.dumps(str(err))}
+
+    finally:
+        # hand the connection back to the pool for the next invocation:
+        if dbConn is not None:
+            pool.release(dbConn)
@@ -12,30 +12,409 @@
 
 import json
 import os
+import bootstrap
+import catalog
 import datatier
+import paging
+import searchindex
+import serialize
 
-from configparser import ConfigParser
+#
+# the inverted index used by the "index" search mode; it is built on
+# the first search of a container and reused by warm invocations
+# until the catalog version changes:
+#
+product_index = None
+
+#
+# the per-keyword match sets used by the "cached" search mode, also
+# kept for the life of the container (created on first use, sized
+# by the config file in sets and in rows, since a short keyword can
+# match most of the catalog); they are keyed by keyword and catalog
+# version, so sets read before a catalog change are never used
+# again and just age out:
+#
+keyword_cache = None
+
+keyword_sql = """
+    SELECT product_id, product_url, product_price FROM products
+     WHERE LOWER(product_title) LIKE %s;
+"""
+
+
+###################################################################
+#
+# rank_key:
+#
+# Sort key for a scored product: highest score first, then the
+# first keyword the product matched, then product_id. This is the
+# order the original per-keyword loop produced.
+#
+def rank_key(result):
+  product_id, product_url, score, first_match = result
+  return (-score, first_match, product_id)
+
+
+###################################################################
+#
+# search_loop:
+#
+# Runs one LIKE query per keyword and tallies the number of
+# matching keywords per product in Python.
+#
+def search_loop(dbConn, keywords, budget, limit=None, after=None):
+  """
+  Scores products by issuing one SELECT per keyword
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  keywords : list of lowercase search words,
+  budget : maximum product price (float),
+  limit : maximum number of results (None for all),
+  after : rank_key of the last result already returned, or None
+
+  Returns
+  -------
+  list of (product_id, product_url, score, first_match) tuples,
+  best match first
+  """
+  sql = "SELECT * FROM products WHERE product_price <= %s AND LOWER(product_title) LIKE %s"
+
+  # ans dictionary stores IDs of products (key) and a dictionary of product_url, number of matches with search and first keyword matched (value)
+  ans = {}
+
+  # iterates over all search words to update match score
+  for i, keyword in enumerate(keywords):
+    rows = datatier.retrieve_all_rows(dbConn, sql,
+                                      [budget, "%" + keyword + "%"])
+    # iterates over all products to see what matches with search word and updates ans dict
+    for row in rows:
+      product_id = row[0]
+      product_url = row[2]
+      if product_id in ans:
+        ans[product_id]['score'] += 1
+      else:
+        ans[product_id] = {'url': product_url, 'score': 1, 'first': i}
+
+  results = ((product_id, desc['url'], desc['score'], desc['first'])
+             for product_id, desc in ans.items())
+
+  return paging.top_k(results, limit, rank_key, after)
+
+
+###################################################################
+#
+# keyword_matches:
+#
+def keyword_matches(dbConn, cache, keyword, ttl, version):
+  """
+  Returns every product whose title contains keyword, from the cache
+  if it's there, otherwise with one LIKE query (and then cached)
+
+  The match set doesn't depend on the budget, so one cached set
+  serves every search that uses the keyword.
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  cache : a datatier.QueryCache,
+  keyword : normalized search word,
+  ttl : # of seconds the match set is kept,
+  version : the current catalog version
+
+  Returns
+  -------
+  tuple of (product_id, product_url, price) tuples
+  """
+  key = (keyword_sql, keyword, version)
+
+  found, rows = cache.get(key)
+  if not found:
+    rows = tuple(
+        datatier.retrieve_all_rows(dbConn, keyword_sql,
+                                   ["%" + keyword + "%"]))
+    # (a set bigger than the whole cache is simply not kept)
+    cache.put(key, rows, ttl, len(rows))
+
+  return rows
+
+
+###################################################################
+#
+# search_cached:
+#
+# Same ranking as search_loop, but assembled from cached per-keyword
+# match sets, with the budget applied in memory; only keywords that
+# aren't cached yet are queried.
+#
+def search_cached(dbConn, cache, keywords, budget, ttl, version,
+                  limit=None, after=None):
+  """
+  Scores products using per-keyword match sets
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  cache : a datatier.QueryCache,
+  keywords : list of lowercase search words,
+  budget : maximum product price (float),
+  ttl : # of seconds a keyword's match set is kept,
+  version : the current catalog version,
+  limit : maximum number of results (None for all),
+  after : rank_key of the last result already returned, or None
+
+  Returns
+  -------
+  list of (product_id, product_url, score, first_match) tuples,
+  best match first
+  """
+  ans = {}
+
+  for i, keyword in enumerate(keywords):
+    # MySQL compares titles ignoring case and accents, so "parup"
+    # and "pärup" share one match set:
+    rows = keyword_matches(dbConn, cache, searchindex.normalize(keyword),
+                           ttl, version)
+    for product_id, product_url, price in rows:
+      # pymysql returns DECIMAL prices as Decimal, which compares
+      # exactly with the float budget (19.99 > 19.99 would be True):
+      if float(price) > budget:
+        continue
+      if product_id in ans:
+        ans[product_id]['score'] += 1
+      else:
+        ans[product_id] = {'url': product_url, 'score': 1, 'first': i}
+
+  results = ((product_id, desc['url'], desc['score'], desc['first'])
+             for product_id, desc in ans.items())
+
+  return paging.top_k(results, limit, rank_key, after)
+
+
+###################################################################
+#
+# get_keyword_cache:
+#
+def get_keyword_cache(configur):
+  """
+  Returns the process-resident keyword cache, creating it (with room
+  for keyword_cache_size match sets of keyword_cache_rows products
+  in all) if needed
+  """
+  global keyword_cache
+
+  if keyword_cache is None:
+    size = configur.getint('recommend', 'keyword_cache_size', fallback=256)
+    rows = configur.getint('recommend', 'keyword_cache_rows', fallback=20000)
+    keyword_cache = datatier.QueryCache(size, rows)
+
+  return keyword_cache
+
+
+###################################################################
+#
+# build_search_sql:
+#
+# Builds the single statement used by search_sql for n keywords.
+#
+def build_search_sql(n, paged=False):
+  """
+  Builds a SELECT that scores, filters and orders products for
+  n keywords in one round trip
+
+  The score is the number of keywords the title matches. Ties are
+  broken the same way search_loop breaks them (see rank_key).
+
+  Parameters
+  ----------
+  n : number of keywords (integer > 0),
+  paged : if True, the statement also takes a cursor and a limit
+
+  Returns
+  -------
+  the SQL string, selecting product_id, product_url and score (and
+  first_match, if paged); parameters are the n patterns twice, the
+  budget, and the n patterns again, followed (if paged) by the
+  cursor's score twice, first_match twice, product_id and the limit
+  """
+  like = "LOWER(product_title) LIKE %s"
+
+  score = " + ".join(["(" + like + ")"] * n)
+  matches_any = " OR ".join([like] * n)
+  first_match = "CASE " + " ".join(
+      "WHEN " + like + " THEN " + str(i) for i in range(n)) + " END"
+
+  #
+  # first_match only comes back when paging, since that's the only
+  # time the caller needs it (for the cursor); otherwise it is just
+  # part of the ORDER BY:
+  #
+  columns = "product_id, product_url, score"
+  if paged:
+    columns += ", first_match"
+
+  sql = ("SELECT " + columns + " FROM"
+         " (SELECT product_id, product_url, " + score + " AS score, " +
+         first_match + " AS first_match"
+         " FROM products"
+         " WHERE product_price <= %s AND (" + matches_any + ")) AS matches")
+
+  if paged:
+    sql += (" WHERE score < %s OR (score = %s AND (first_match > %s OR"
+            " (first_match = %s AND product_id > %s)))")
+
+  sql += " ORDER BY score DESC, first_match, product_id"
+
+  if paged:
+    sql += " LIMIT %s"
+
+  return sql
+
+
+###################################################################
+#
+# search_sql:
+#
+# Same ranking as search_loop, but computed by the database in a
+# single statement that only returns id, url and score.
+#
+def search_sql(dbConn, keywords, budget, limit=None, after=None):
+  """
+  Scores products with a single SELECT
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  keywords : list of lowercase search words,
+  budget : maximum product price (float),
+  limit : maximum number of results (None for all),
+  after : rank_key of the last result already returned, or None
+
+  Returns
+  -------
+  list of (product_id, product_url, score, first_match) tuples,
+  best match first; first_match is None unless limit or after is
+  given
+  """
+  if len(keywords) == 0:
+    return []
+
+  patterns = ["%" + keyword + "%" for keyword in keywords]
+
+  paged = limit is not None or after is not None
+  sql = build_search_sql(len(keywords), paged)
+  parameters = patterns + patterns + [budget] + patterns
+
+  if paged:
+    if after is None:
+      # before the first result:
+      score, first_match, product_id = len(keywords) + 1, 0, 0
+    else:
+      score, first_match, product_id = -after[0], after[1], after[2]
+    parameters += [score, score, first_match, first_match, product_id]
+    # MySQL has no "no limit", so use a LIMIT no table will reach:
+    parameters.append(limit if limit is not None else 9223372036854775807)
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, parameters)
+
+  if not paged:
+    return [(row[0], row[1], int(row[2]), None) for row in rows]
+
+  return [(row[0], row[1], int(row[2]), int(row[3])) for row in rows]
+
+
+###################################################################
+#
+# search_index:
+#
+# Same ranking as search_loop, answered from the in-memory index.
+#
+def search_index(index, keywords, budget, limit=None, after=None):
+  """
+  Scores products using the inverted index
+
+  Parameters
+  ----------
+  index : a searchindex.ProductIndex,
+  keywords : list of lowercase search words,
+  budget : maximum product price (float),
+  limit : maximum number of results (None for all),
+  after : rank_key of the last result already returned, or None
+
+  Returns
+  -------
+  list of (product_id, product_url, score, first_match) tuples,
+  best match first
+  """
+  results = index.score(keywords, budget)
+
+  return paging.top_k(results, limit, rank_key, after)
+
+
+###################################################################
+#
+# get_product_index:
+#
+# Returns the container's inverted index, building it on first use
+# from the prebuilt index file (if configured, and built at the
+# current catalog version) or from one bulk read of the products
+# table. Once the catalog version moves on, the index is rebuilt
+# from the table (the file is out of date too).
+#
+def get_product_index(dbConn, configur, version):
+  """
+  Returns the process-resident ProductIndex, building it if needed
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  configur : the parsed config file,
+  version : the current catalog version
+
+  Returns
+  -------
+  a searchindex.ProductIndex
+  """
+  global product_index
+
+  stale = product_index is not None and product_index.version != version
+
+  if product_index is None or stale:
+    index_file = configur.get('recommend', 'index_file', fallback='')
+
+    if stale:
+      print("**Catalog version changed, rebuilding search index**")
+      product_index = None
+    elif index_file != "" and os.path.exists(index_file):
+      print("**Loading search index from", index_file + "**")
+      product_index = searchindex.ProductIndex.load(index_file)
+      if product_index.version != version:
+        print("index file is for catalog version", product_index.version,
+              "not", version)
+        product_index = None
+
+    if product_index is None:
+      print("**Building search index from products table**")
+      product_index = searchindex.build_from_db(dbConn, version)
+
+    print("indexed products:", len(product_index), "catalog version:",
+          version)
+
+  return product_index
 
 
 def lambda_handler(event, context):
+  dbConn = None
+
   try:
     print("**STARTING**")
     print("**lambda: ikea_recommend**")
 
     #
-    # setup AWS based on config file:
+    # config is parsed once per container:
     #
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-
-    configur = ConfigParser()
-    configur.read(config_file)
-
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
+    configur = bootstrap.get_config()
 
     # checks for parameters
     if "body" not in event:
@@ -57,38 +436,83 @@ def lambda_handler(event, context):
     #
     print("**Opening connection**")
 
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
-                                 rds_pwd, rds_dbname)
-    sql = "SELECT * FROM products WHERE product_price <= %s AND LOWER(product_title) LIKE %s"
+    pool = bootstrap.get_db_pool()
+    dbConn = pool.acquire()
 
-    # ans dictionary stores IDs of products (key) and a dictionary of product_url and number of matches with search (value)
-    ans = {}
     raw_keywords = search.split()
     keywords = [word.lower() for word in raw_keywords]
 
-    # iterates over all search words to update match score
-    for keyword in keywords:
-      rows = datatier.retrieve_all_rows(dbConn, sql,
-                                        [budget, "%" + keyword + "%"])
-      # iterates over all products to see what matches with search word and updates ans dict
-      for row in rows:
-        product_id = row[0]
-        product_url = row[2]
-        if product_id in ans:
-          ans[product_id]['score'] += 1
-        else:
-          ans[product_id] = {'url': product_url, 'score': 1}
-
-    # sort the results by relevance (score)
-    sort = sorted(ans.items(), key=lambda item: item[1]['score'], reverse=True)
-
-    # formats response into dictionary form
-    response = [{
-        "product_id": product_id,
-        "product_url": desc['url']
-    } for product_id, desc in sort]
-
-    return {'statusCode': 200, 'body': json.dumps(response)}
+    #
+    # paging is optional: without a limit, every match is returned
+    # as a plain list like before:
+    #
+    paged = "limit" in body or "cursor" in body
+
+    limit = None
+    after = None
+    if "limit" in body:
+      limit = paging.get_limit(body["limit"])
+    if body.get("cursor"):
+      after = paging.decode_cursor(body["cursor"])
+
+    shape = serialize.get_shape(body.get("shape"))
+
+    # ask for one extra result so we know whether there is a next page:
+    fetch = limit + 1 if limit is not None else None
+
+    #
+    # "loop" runs one LIKE query per keyword and scores in Python,
+    # "sql" has the database score, filter and sort in one statement,
+    # "index" answers from the in-memory inverted index, "cached"
+    # scores in Python from per-keyword match sets cached across
+    # invocations:
+    #
+    mode = body.get("mode",
+                    configur.get('recommend', 'search_mode', fallback='loop'))
+    print("search mode:", mode)
+
+    if mode == "loop":
+      results = search_loop(dbConn, keywords, budget, fetch, after)
+    elif mode == "sql":
+      results = search_sql(dbConn, keywords, budget, fetch, after)
+    elif mode == "index":
+      version = catalog.check_version(dbConn)
+      index = get_product_index(dbConn, configur, version)
+      results = search_index(index, keywords, budget, fetch, after)
+    elif mode == "cached":
+      cache = get_keyword_cache(configur)
+      ttl = configur.getint('recommend', 'keyword_ttl', fallback=3600)
+      version = catalog.check_version(dbConn)
+      results = search_cached(dbConn, cache, keywords, budget, ttl, version,
+                              fetch, after)
+      print("keyword cache:", cache.stats(),
+            "hit ratio: {:.2f}".format(cache.hit_ratio()))
+    else:
+      raise Exception("unknown search mode '" + str(mode) + "'")
+
+    next_cursor = None
+    if limit is not None and len(results) > limit:
+      results = results[:limit]
+      next_cursor = paging.encode_cursor(rank_key(results[-1]))
+
+    # formats response into dictionary form, or (shape=columnar)
+    # {"columns": [...], "rows": [...]}
+    if shape == "columnar":
+      response = serialize.table(
+          ["product_id", "product_url", "score"],
+          [[product_id, product_url, score]
+           for product_id, product_url, score, first_match in results], shape)
+    else:
+      response = [{
+          "product_id": product_id,
+          "product_url": product_url,
+          "score": score
+      } for product_id, product_url, score, first_match in results]
+
+    if paged:
+      response = {"products": response, "next_cursor": next_cursor}
+
+    return {'statusCode': 200, 'body': serialize.dumps(response)}
 
   except Exception as err:
     # if error
@@ -96,3 +520,8 @@ def lambda_handler(event, context):
     print(str(err))
 
     return {'statusCode': 400, 'body': json.dumps(str(err))}
+
+  finally:
+    # hand the connection back to the pool for the next invocation:
+    if dbConn is not None:
+      pool.release(dbConn)
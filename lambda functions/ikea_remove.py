@@ -1,50 +1,52 @@
 #
 # remove
 # Client inputs a product ID, and that item is deleted from their
-# shopping cart.
+# shopping cart (the cart of the user named by the X-User-Id header,
+# see carts.py). With "quantity", only that many are taken out; the
+# item leaves the cart once none are left.
 #
 
 import json
-import boto3
-import os
+import bootstrap
+import cartarchive
+import carts
 import datatier
+import thumbnails
 
-from configparser import ConfigParser
+#
+# the cart row is changed only if its quantity is still the one we
+# read, so a concurrent upload or remove of the same item can't make
+# the running totals drift; if it lost the race, we read it again
+#
+delete_sql = """
+        DELETE FROM cart
+         WHERE user_id = %s AND product_id = %s AND quantity = %s
+"""
 
+decrement_sql = """
+        UPDATE cart
+           SET quantity = quantity - %s
+         WHERE user_id = %s AND product_id = %s AND quantity = %s
+"""
 
-def lambda_handler(event, context):
-  try:
-    print("**STARTING**")
-    print("**lambda: ikea_remove**")
+# and to take them out of the cart's running totals
+summary_sql = """
+        UPDATE cart_summary
+           SET item_count = item_count - %s,
+               subtotal = subtotal - %s,
+               version = version + 1
+         WHERE user_id = %s
+"""
 
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+RETRIES = 3
 
-    configur = ConfigParser()
-    configur.read(config_file)
 
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    #
-    bucketname = configur.get('s3', 'bucket_name')
-    #
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
+def lambda_handler(event, context):
+  dbConn = None
 
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
+  try:
+    print("**STARTING**")
+    print("**lambda: ikea_remove**")
 
     if "body" not in event:
       raise Exception("event has no body")
@@ -55,48 +57,92 @@ def lambda_handler(event, context):
     if "productid" not in body:
       raise Exception("event has a body but no productid")
 
-    product_id = body['productid']
+    product_id = carts.get_product_id(body['productid'])
+    quantity = None
+    if "quantity" in body:
+      quantity = carts.get_quantity(body["quantity"])
+
+    user_id = carts.get_user_id(event)
+
+    print("user id:", user_id, "productid:", product_id)
 
     print("**Opening connection**")
 
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
-                                 rds_pwd, rds_dbname)
+    pool = bootstrap.get_db_pool()
+    dbConn = pool.acquire()
 
-    #
-    # first we need to make sure the productid is valid:
-    #
-    print("**Checking if productid is valid**")
+    for attempt in range(RETRIES):
+      #
+      # first we need to make sure the productid is in the cart:
+      #
+      print("**Checking if productid is valid**")
 
-    sql = "SELECT * FROM cart WHERE product_id = %s;"
+      sql = """
+        SELECT price, quantity FROM cart
+         WHERE user_id = %s AND product_id = %s;
+      """
 
-    row = datatier.retrieve_one_row(dbConn, sql, [product_id])
+      row = datatier.retrieve_one_row(dbConn, sql, [user_id, product_id])
 
-    if row == ():  # no such product
-      print("**No such product in cart, returning...**")
-      return {
-          'statusCode': 400,
-          'body': json.dumps("no such product in cart...")
-      }
+      if row == ():  # no such product
+        print("**No such product in cart, returning...**")
+        return {
+            'statusCode': 400,
+            'body': json.dumps("no such product in cart...")
+        }
+
+      price, in_cart = row
+      removed = in_cart if quantity is None else min(quantity, in_cart)
+
+      print("**Removing", removed, "of", in_cart, "from cart in database**")
+
+      if removed == in_cart:
+        sql, parameters = delete_sql, [user_id, product_id, in_cart]
+      else:
+        sql, parameters = decrement_sql, [removed, user_id, product_id, in_cart]
 
-    print("**Removing cart row to database**")
+      #
+      # execute both in one transaction; if the row changed (or is
+      # gone) in the meantime, nothing is changed:
+      #
+      rowcounts = datatier.perform_transaction(dbConn, [
+          (sql, parameters),
+          (summary_sql, [removed, removed * price, user_id])
+      ])
 
-    # sql to delete row from cart table
-    sql = """
-            DELETE FROM cart WHERE product_id = %s
-    """
+      if rowcounts is not None:
+        break
 
-    # execute the sql above
-    datatier.perform_action(dbConn, sql, [product_id])
+      print("**Cart row changed concurrently, retrying**")
+    else:
+      raise Exception("cart changed while removing, please try again")
+
+    if removed < in_cart:
+      return {
+          'statusCode':
+          200,
+          'body':
+          json.dumps(f'{removed} of product {product_id} removed from the '
+                     f'shopping cart, {in_cart - removed} left')
+      }
 
     #
     # now that DB is updated, let's remove image from S3:
     #
     print("**Removing image from S3**")
-    # remove PNG from s3 bucket
-    key = "ikeaapp/cart_ikeaapp/" + str(product_id) + ".PNG"
+    # remove PNG from the user's cart folder
+    key = thumbnails.thumbnail_key(thumbnails.image_key(user_id, product_id))
 
     try:
+      bucket = bootstrap.get_s3_bucket()
       bucket.delete_objects(Delete={'Objects': [{'Key': key}]})
+
+      # and drop it from the cached cart zip, if there is one:
+      cartarchive.update_archive(bootstrap.get_s3_client(),
+                                 bootstrap.get_bucketname(),
+                                 user_id,
+                                 remove=[cartarchive.member_name(key)])
+
       return {
           'statusCode':
           200,
@@ -115,3 +161,8 @@ def lambda_handler(event, context):
     print(str(err))
 
     return {'statusCode': 400, 'body': json.dumps(str(err))}
+
+  finally:
+    # hand the connection back to the pool for the next invocation:
+    if dbConn is not None:
+      pool.release(dbConn)
@@ -5,57 +5,47 @@
 # to S3 bucket under the desired product ID -> ikea_compute then turns this image into
 # a PNG thumbnail stored in the shopping cart folder in the bucket
 #
+# The product goes into the cart of the user named by the X-User-Id header (see
+# carts.py), "quantity" times (default 1); adding a product that is already in the
+# cart adds to its quantity.
+#
+# If the request carries the image (base64 encoded), it is uploaded to S3 from here.
+# Otherwise the response includes a presigned URL, and the client PUTs the raw image
+# straight to S3, without it going through API Gateway and Lambda.
+#
+# With "thumbnail": true in the request (or inline_thumbnail in the upload section
+# of the config file), the thumbnail is also made here, from the bytes we already
+# hold, and written before the original; ikea_compute then finds it up to date and
+# skips the work.
+#
 
 import json
-import boto3
-import os
-import uuid
 import base64
 import pathlib
+import bootstrap
+import catalog
+import cartarchive
+import carts
 import datatier
-
-from configparser import ConfigParser
+import serialize
+import thumbnails
 
 
 def lambda_handler(event, context):
+  dbConn = None
+
   try:
     print("**STARTING**")
     print("**lambda: ikeaapp_upload**")
 
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'ikeaapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-
-    configur = ConfigParser()
-    configur.read(config_file)
-
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-
-    bucketname = configur.get('s3', 'bucket_name')
-
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
-
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-
     #
     # the user has sent us three parameters:
     #  1. product id
     #  2. filename of their file
-    #  3. raw file data in base64 encoded string
+    #  3. raw file data in base64 encoded string (optional,
+    #     without it we return a presigned upload URL)
+    #
+    # and optionally "quantity" and "thumbnail": true/false
     #
     # The parameters are coming through web server
     # (or API Gateway) in the body of the request
@@ -73,27 +63,33 @@ def lambda_handler(event, context):
       raise Exception("event has a body but no productid")
     if "filename" not in body:
       raise Exception("event has a body but no filename")
-    if "data" not in body:
-      raise Exception("event has a body but no data")
 
-    productid = body["productid"]
+    productid = carts.get_product_id(body["productid"])
     filename = body["filename"]
-    datastr = body["data"]
+    datastr = body.get("data")
+    quantity = carts.get_quantity(body.get("quantity"))
+
+    user_id = carts.get_user_id(event)
+
+    configur = bootstrap.get_config()
+    inline_thumbnail = body.get(
+        "thumbnail",
+        configur.getboolean('upload', 'inline_thumbnail', fallback=False))
 
     #
     # key to store original file as when downloaded
     #
-    key = "ikeaapp/" + str(productid) + ".jpg"
+    key = thumbnails.image_key(user_id, productid)
 
-    print("productid:", productid)
+    print("user id:", user_id, "productid:", productid)
 
     #
     # open connection to the database:
     #
     print("**Opening connection**")
 
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
-                                 rds_pwd, rds_dbname)
+    pool = bootstrap.get_db_pool()
+    dbConn = pool.acquire()
 
     #
     # make sure the productid is valid:
@@ -102,7 +98,16 @@ def lambda_handler(event, context):
 
     sql = "SELECT * FROM products WHERE product_id = %s;"
 
-    row = datatier.retrieve_one_row(dbConn, sql, [productid])
+    # the catalog rarely changes, so warm containers may answer this
+    # from the query cache, which is emptied when the catalog version
+    # moves on:
+    cache_ttl = bootstrap.get_cache_ttl()
+    if cache_ttl is not None:
+      catalog.check_version(dbConn)
+
+    row = datatier.retrieve_one_row(dbConn, sql, [productid],
+                                    cache_ttl=cache_ttl)
+    print("query cache:", datatier.query_cache.stats())
 
     if row == ():  # no such product
       print("**No such product, returning...**")
@@ -113,6 +118,94 @@ def lambda_handler(event, context):
     price = row[6]
     producturl = row[2]
 
+    #
+    # generate unique filename in preparation for the S3 upload:
+    #
+    print("**Uploading local file to S3**")
+
+    basename = pathlib.Path(filename).stem
+    extension = pathlib.Path(filename).suffix
+
+    # filename for upload must be jpg/jpeg
+    if extension != ".jpg" and extension != ".jpeg":
+      raise Exception("expecting filename to have .jpg or .jpeg extension")
+
+    print("S3 bucketkey:", key)
+
+    #
+    # no image in the request, so the client will upload it straight
+    # to S3 with a presigned PUT; the URL is made before the cart is
+    # touched, so a failure here leaves the cart as it was and the
+    # client can simply try again:
+    #
+    if datastr is None:
+      print("**Generating presigned upload URL**")
+
+      expires = configur.getint('upload', 'presigned_expires', fallback=300)
+
+      s3_client = bootstrap.get_s3_client()
+      upload_url = s3_client.generate_presigned_url(
+          'put_object',
+          Params={
+              'Bucket': bootstrap.get_bucketname(),
+              'Key': key,
+              'ACL': 'public-read',
+              'ContentType': 'image/jpg'
+          },
+          ExpiresIn=expires)
+
+    #
+    # adds product id of product image that client is
+    # uploading to the user's shopping cart, or adds to its
+    # quantity if it's already there
+    # (and updates the cart's running totals in the same transaction,
+    # at the price the item went into the cart at)
+    #
+    print("**Adding cart row to database**")
+
+    sql = """
+      INSERT INTO cart(user_id, product_id, product_name, price, quantity)
+                  VALUES(%s, %s, %s, %s, %s)
+      ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity);
+    """
+
+    summary_sql = """
+      INSERT INTO cart_summary(user_id, item_count, subtotal, version)
+           SELECT user_id, %s, %s * price, 1
+             FROM cart
+            WHERE user_id = %s AND product_id = %s
+      ON DUPLICATE KEY UPDATE
+           item_count = cart_summary.item_count + VALUES(item_count),
+           subtotal = cart_summary.subtotal + VALUES(subtotal),
+           version = cart_summary.version + 1;
+    """
+
+    rowcounts = datatier.perform_transaction(dbConn, [
+        (sql, [user_id, productid, productname, price, quantity]),
+        (summary_sql, [quantity, quantity, user_id, productid])
+    ])
+
+    if rowcounts is None:
+      # rolled back, so there is no cart row for the image to go with:
+      raise Exception("failed to add product to cart")
+
+    if datastr is None:
+      #
+      # the client has to send the same headers that were signed:
+      #
+      response = {
+          'product_url': producturl,
+          'upload_url': upload_url,
+          'upload_headers': {
+              'x-amz-acl': 'public-read',
+              'Content-Type': 'image/jpg'
+          }
+      }
+
+      print("**DONE, returning presigned URL**")
+
+      return {'statusCode': 200, 'body': serialize.dumps(response)}
+
     #
     # at this point the product exists, so safe to upload to S3:
     #
@@ -136,31 +229,39 @@ def lambda_handler(event, context):
     outfile.close()
 
     #
-    # generate unique filename in preparation for the S3 upload:
+    # make the thumbnail now, and write it before the original, so
+    # that by the time ikea_compute runs it's already there. This is
+    # only a head start: the item is already in the cart, so whatever
+    # goes wrong here (an image Pillow can't decode, no Pillow layer,
+    # the cart zip update failing), the original is still uploaded
+    # and ikea_compute makes the thumbnail as usual:
     #
-    print("**Uploading local file to S3**")
+    if inline_thumbnail:
+      try:
+        print("**Making thumbnail inline**")
 
-    basename = pathlib.Path(filename).stem
-    extension = pathlib.Path(filename).suffix
+        s3_client = bootstrap.get_s3_client()
+        bucketname = bootstrap.get_bucketname()
 
-    # filename for upload must be jpg/jpeg
-    if extension != ".jpg" and extension != ".jpeg":
-      raise Exception("expecting filename to have .jpg or .jpeg extension")
+        profiles = thumbnails.get_profiles(configur)
+        palette = configur.getboolean('compute', 'palette', fallback=True)
 
-    print("S3 bucketkey:", key)
+        # a photo we've seen before is copied instead:
+        pngs = thumbnails.link_thumbnails(s3_client, bucketname, key,
+                                          thumbnails.source_md5(bytes),
+                                          profiles, palette)
+        if pngs is None:
+          pngs = thumbnails.store_thumbnails(s3_client, bucketname, key,
+                                             bytes, profiles, palette)
 
-    #
-    # adds product id of product image that client is
-    # uploading to shopping cart
-    #
-    print("**Adding cart row to database**")
+        cart_key = thumbnails.thumbnail_key(key)
 
-    sql = """
-      INSERT INTO cart(product_id, product_name, price)
-                  VALUES(%s, %s, %s);
-    """
-
-    datatier.perform_action(dbConn, sql, [productid, productname, price])
+        cartarchive.update_archive(
+            s3_client, bucketname, user_id,
+            add={cartarchive.member_name(cart_key): pngs[cart_key]})
+      except Exception as err:
+        print("**Inline thumbnail failed, leaving it to ikea_compute**")
+        print(str(err))
 
     #
     # now that DB is updated, let's upload image to S3:
@@ -170,6 +271,7 @@ def lambda_handler(event, context):
     #
     # uploads image
     #
+    bucket = bootstrap.get_s3_bucket()
     bucket.upload_file(local_filename,
                        key,
                        ExtraArgs={
@@ -183,7 +285,7 @@ def lambda_handler(event, context):
     #
     print("**DONE, returning jobid**")
 
-    return {'statusCode': 200, 'body': json.dumps(producturl)}
+    return {'statusCode': 200, 'body': serialize.dumps(producturl)}
 
   except Exception as err:
     # if error
@@ -191,3 +293,8 @@ def lambda_handler(event, context):
     print(str(err))
 
     return {'statusCode': 400, 'body': json.dumps(str(err))}
+
+  finally:
+    # hand the connection back to the pool for the next invocation:
+    if dbConn is not None:
+      pool.release(dbConn)
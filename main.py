@@ -32,6 +32,7 @@ class Product:
     self.product_id = row[0]
     self.product_title = row[1]
     self.product_price = row[2]
+    self.quantity = row[3]
 
 
 ############################################################
@@ -59,7 +60,8 @@ def prompt():
   print("   4 => list out shopping cart")
   print("   5 => remove item from cart")
   print("   6 => download shopping list")
-  # print("   7 => clear cart")
+  print("   7 => download shopping list as one sprite image")
+  # print("   8 => clear cart")
 
   cmd = input()
 
@@ -97,101 +99,69 @@ def recommend(baseurl):
     search = input("Enter your search: ")
     budget = input("Enter your budget: ")
 
-    #
-    # build message:
-    #
-    data = {"search": str(search), "budget": budget}
-
     #
     # call the web service:
     #
     api = '/recommend'
     url = baseurl + api
 
-    res = requests.post(url, json=data)
-
     #
-    # let's look at what we got back:
+    # fetch 5 recommended products at a time; the server hands back
+    # a cursor for the next page as long as there are more results:
     #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
-      return
+    cursor = None
+    count = 0
 
-    #
-    # success, extract product url:
-    #
-    body = res.json()
+    while True:
+      #
+      # build message:
+      #
+      data = {"search": str(search), "budget": budget, "limit": 5}
+      if cursor is not None:
+        data["cursor"] = cursor
 
-    #
-    # let's map each row into an Product object:
-    #
-    recs = []
-    for row in body:
-      rec = [row["product_id"], row["product_url"]]
-      recs.append(rec)
+      res = requests.post(url, json=data)
 
-    #
-    # Now we can think OOP:
-    #
-    if len(recs) == 0:
-      print("no matching product found...")
-      return
+      #
+      # let's look at what we got back:
+      #
+      if res.status_code != 200:
+        # failed:
+        print("Failed with status code:", res.status_code)
+        print("url: " + url)
+        if res.status_code == 400:
+          # we'll have an error message
+          body = res.json()
+          print("Error message:", body)
+        return
 
-    #
-    # print out when less than 5 recommended products
-    #
-    if len(recs) < 5:
-      for rec in recs:
-        print("Product ID:  ", rec[0])
-        print("       URL:  ", rec[1])
-      print("\nno more recommended products...")
-      return
+      #
+      # success, extract product ids and urls:
+      #
+      body = res.json()
 
-    #
-    # print out the first 5 recommended products
-    #
-    for i in range(5):
-      print("Product ID:  ", recs[i][0])
-      print("       URL:  ", recs[i][1])
+      for row in body["products"]:
+        print("Product ID:  ", row["product_id"])
+        print("       URL:  ", row["product_url"])
+        count += 1
 
-    #
-    # initialize boolean and counters
-    #
-    bool = "y"
-    # represents page counter
-    a = 1
-    # represents products counter
-    counter = 5
+      if count == 0:
+        print("no matching product found...")
+        return
 
-    #
-    # print out the rest of the recommended products 5 at a time
-    #
-    while bool == "y":
-      while counter < 5 * a:
-        # break if no more recommended products left
-        if counter > len(recs) - 1:
-          print("\nno more recommended products...")
-          bool = "n"
-          break
-        print("Product ID:  ", recs[counter][0])
-        print("       URL:  ", recs[counter][1])
-        # increment product counter
-        counter += 1
-      # increment page counter
-      a += 1
-      if bool == "y":
-        bool = input("\nWould you like to see more results? (y/n) ")
-        # check that user enters y or n
-        if bool != "y" and bool != "n":
-          print("must answer with y or n!")
-          bool = input("\nWould you like to see more results? (y/n) ")
-    return
+      cursor = body["next_cursor"]
+
+      if cursor is None:
+        print("\nno more recommended products...")
+        return
+
+      answer = input("\nWould you like to see more results? (y/n) ")
+      # check that user enters y or n
+      if answer != "y" and answer != "n":
+        print("must answer with y or n!")
+        answer = input("\nWould you like to see more results? (y/n) ")
+      if answer != "y":
+        return
 
   except Exception as e:
     logging.error("recommend() failed:")
@@ -219,14 +189,18 @@ def get_product_url(baseurl):
   #
   # get user input:
   #
-  print("Enter product id>")
-  productid = input()
+  print("Enter product id(s)>")
+  productids = input().replace(",", " ").split()
 
   try:
     #
-    # build message:
+    # build message; several ids are looked up in one request:
     #
-    data = {"product_id": productid}
+    if len(productids) == 1:
+      productid = productids[0]
+      data = {"product_id": productid}
+    else:
+      data = {"product_ids": productids}
 
     #
     # call the web service:
@@ -254,6 +228,15 @@ def get_product_url(baseurl):
     # get product_url from server side:
     #
     body = res.json()
+
+    if len(productids) != 1:
+      for productid, product_url in body["urls"].items():
+        print("Product ID: ", productid)
+        print("Product URL: ", product_url)
+      for productid in body["missing"]:
+        print("no product with product ID: ", productid)
+      return
+
     product_url = body
 
     #
@@ -281,7 +264,7 @@ def get_product_url(baseurl):
 #
 # upload
 #
-def upload(baseurl):
+def upload(baseurl, user_id, presigned=True):
   """
   Prompts the user for a local filename and product id, 
   and uploads that asset (jpg) to S3 for processing.
@@ -289,6 +272,10 @@ def upload(baseurl):
   Parameters
   ----------
   baseurl: baseurl for web service
+  user_id: whose cart the product goes into
+  presigned: True to PUT the image straight to S3 through a
+             presigned URL, False to send it (base64 encoded) in
+             the request
 
   Returns
   -------
@@ -308,39 +295,48 @@ def upload(baseurl):
   print("Enter product id>")
   productid = input()
 
+  print("Enter quantity (ENTER for 1)>")
+  quantity = input()
+
+  headers = {"X-User-Id": user_id}
+
+  api = '/upload'
+  url = baseurl + api
+
   try:
-    #
-    # build the data packet:
-    #
     infile = open(local_filename, "rb")
     bytes = infile.read()
     infile.close()
 
     #
-    # now encode the png as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for upload to server:
-    #
-    data = base64.b64encode(bytes)
-    datastr = data.decode()
-
-    #
-    # build message:
+    # build message; without the image data, the server hands back
+    # a presigned URL so the image can go straight to S3 instead of
+    # through API Gateway and Lambda:
     #
     data = {
         "productid": productid,
-        "filename": str(local_filename),
-        "data": str(datastr)
+        "filename": str(local_filename)
     }
+    if quantity != "":
+      data["quantity"] = quantity
+
+    if not presigned:
+      #
+      # encode the jpg as base64. Note b64encode returns
+      # a bytes object, not a string. So then we have to convert
+      # (decode) the bytes -> string, and then we can serialize
+      # the string as JSON for upload to server:
+      #
+      data["data"] = base64.b64encode(bytes).decode()
+
     print("data: ", data["productid"])
 
     #
-    # call the web service:
+    # call the web service, once: the server adds the item to the
+    # cart before answering, so sending the request again would
+    # count it twice
     #
-    api = '/upload'
-    url = baseurl + api
-    res = requests.post(url, json=data)
+    res = requests.post(url, json=data, headers=headers)
     print("res: ", res)
 
     #
@@ -356,16 +352,31 @@ def upload(baseurl):
         print("Error message:", body)
       return
 
+    body = res.json()
+
+    if not presigned:
+      # success, the body is the product's url:
+      return
+
     #
-    # success, extract producturl:
+    # PUT the raw bytes, with the headers the URL was signed with:
     #
-    body = res.json()
-    producturl = body
+    put = requests.put(body["upload_url"],
+                       data=bytes,
+                       headers=body["upload_headers"])
+
+    if put.status_code != 200:
+      # failed:
+      print("Failed with status code:", put.status_code)
+      print("url: " + body["upload_url"])
+      print("Error message:", put.text)
+      return
+
     return
 
   except Exception as e:
     logging.error("upload() failed:")
-    logging.error("url: " + producturl)
+    logging.error("url: " + url)
     logging.error(e)
     return
 
@@ -374,7 +385,7 @@ def upload(baseurl):
   #
   # list
   #
-def list(baseurl):
+def list(baseurl, user_id):
   """
     Prints out the information for each product
     in the shopping cart
@@ -382,6 +393,7 @@ def list(baseurl):
     Parameters
     ----------
     baseurl: baseurl for web service
+    user_id: whose cart to list
 
     Returns
     -------
@@ -395,59 +407,63 @@ def list(baseurl):
     api = '/list'
     url = baseurl + api
 
-    res = requests.get(url)
-
     #
-    # let's look at what we got back:
+    # the cart comes a page at a time, with the item count and
+    # subtotal (computed by the server) on every page:
     #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
-      return
+    params = {"limit": 50}
 
-    #
-    # deserialize and extract users:
-    #
-    body = res.json()
+    while True:
+      res = requests.get(url, params=params, headers={"X-User-Id": user_id})
 
-    #
-    # let's map each row into a Product object:
-    #
-    products = []
-    for row in body:
-      product = Product(row)
-      products.append(product)
+      #
+      # let's look at what we got back:
+      #
+      if res.status_code != 200:
+        # failed:
+        print("Failed with status code:", res.status_code)
+        print("url: " + url)
+        if res.status_code == 400:
+          # we'll have an error message
+          body = res.json()
+          print("Error message:", body)
+        return
 
-    #
-    # Now we can think OOP:
-    #
-    if len(products) == 0:
-      print("no products...")
-      return
+      #
+      # deserialize and extract users:
+      #
+      body = res.json()
 
-    #
-    # initialize total price and total items
-    #
-    total_price = 0
-    items = 0
+      #
+      # let's map each row into a Product object:
+      #
+      products = []
+      for row in body["items"]:
+        product = Product(row)
+        products.append(product)
+
+      #
+      # Now we can think OOP:
+      #
+      if body["item_count"] == 0:
+        print("no products...")
+        return
+
+      #
+      # print out the product info for products in cart
+      #
+      for product in products:
+        print(product.product_id)
+        print(" ", product.product_title)
+        print(" ", product.product_price, "x", product.quantity)
+
+      if body["next_cursor"] is None:
+        break
+
+      params["cursor"] = body["next_cursor"]
 
-    #
-    # print out the product info for products in cart
-    #
-    for product in products:
-      print(product.product_id)
-      print(" ", product.product_title)
-      print(" ", product.product_price)
-      # increment total price and total items
-      total_price += product.product_price
-      items += 1
     # print at the bottom of shopping cart list
-    print(f"SUBTOTAL ({ items } items): ${ total_price }")
+    print(f"SUBTOTAL ({ body['item_count'] } items): ${ body['subtotal'] }")
     return
 
   except Exception as e:
@@ -461,13 +477,14 @@ def list(baseurl):
 #
 # remove
 #
-def remove(baseurl):
+def remove(baseurl, user_id):
   """
   Removes 
 
   Parameters
   ----------
   baseurl: baseurl for web service
+  user_id: whose cart to remove the product from
 
   Returns
   -------
@@ -481,17 +498,22 @@ def remove(baseurl):
     print("Enter product id>")
     product_id = input()
 
+    print("Enter quantity to remove (ENTER for all)>")
+    quantity = input()
+
     #
     # build message:
     #
     data = {"productid": product_id}
+    if quantity != "":
+      data["quantity"] = quantity
 
     #
     # call the web service:
     #
     api = '/remove'
     url = baseurl + api
-    res = requests.post(url, json=data)
+    res = requests.post(url, json=data, headers={"X-User-Id": user_id})
 
     #
     # let's look at what we got back:
@@ -525,13 +547,14 @@ def remove(baseurl):
 #
 # download
 #
-def download(baseurl):
+def download(baseurl, user_id):
   """
   Downloads all thumbnails in shopping cart as zip folder.
 
   Parameters
   ----------
   baseurl: baseurl for web service
+  user_id: whose cart to download
 
   Returns
   -------
@@ -545,11 +568,28 @@ def download(baseurl):
     api = '/download'
     url = baseurl + api
 
-    res = requests.get(url)
+    #
+    # if we still have the zip from last time, send its ETag so
+    # the server can skip the transfer when the cart hasn't changed:
+    #
+    zip_filename = "shopping_cart.zip"
+    etag_filename = zip_filename + ".etag"
+
+    headers = {"X-User-Id": user_id}
+    if pathlib.Path(zip_filename).is_file() and pathlib.Path(
+        etag_filename).is_file():
+      with open(etag_filename, "r") as f:
+        headers["If-None-Match"] = f.read().strip()
+
+    res = requests.get(url, headers=headers)
 
     #
     # let's look at what we got back:
     #
+    if res.status_code == 304:
+      print("shopping cart unchanged, '" + zip_filename + "' is up to date")
+      return
+
     if res.status_code != 200:
       print("Failed with status code:", res.status_code)
       print("url: " + url)
@@ -572,9 +612,17 @@ def download(baseurl):
     bytes = base64.b64decode(base64_bytes)
 
     # writes bytes to files in destination folder "shopping_cart.zip" stored in current working directory
-    with open("shopping_cart.zip", "wb") as f:
+    with open(zip_filename, "wb") as f:
       f.write(bytes)
 
+    # remember the version we have, for next time:
+    etag = res.headers.get("ETag")
+    if etag is not None:
+      with open(etag_filename, "w") as f:
+        f.write(etag)
+    elif pathlib.Path(etag_filename).is_file():
+      os.remove(etag_filename)
+
     return
 
   except Exception as e:
@@ -584,6 +632,93 @@ def download(baseurl):
     return
 
 
+############################################################
+#
+# download_sprite
+#
+def download_sprite(baseurl, user_id):
+  """
+  Downloads all thumbnails in shopping cart as one sprite image
+  (shopping_cart_sprite.png), plus the position of each product's
+  thumbnail in it (shopping_cart_sprite.json).
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+  user_id: whose cart to download
+
+  Returns
+  -------
+  nothing
+  """
+
+  try:
+    #
+    # call the web service:
+    #
+    api = '/download'
+    url = baseurl + api
+
+    png_filename = "shopping_cart_sprite.png"
+    index_filename = "shopping_cart_sprite.json"
+    etag_filename = png_filename + ".etag"
+
+    headers = {"X-User-Id": user_id}
+    if pathlib.Path(png_filename).is_file() and pathlib.Path(
+        index_filename).is_file() and pathlib.Path(etag_filename).is_file():
+      with open(etag_filename, "r") as f:
+        headers["If-None-Match"] = f.read().strip()
+
+    res = requests.get(url, params={"format": "sprite"}, headers=headers)
+
+    #
+    # let's look at what we got back:
+    #
+    if res.status_code == 304:
+      print("shopping cart unchanged, '" + png_filename + "' is up to date")
+      return
+
+    if res.status_code != 200:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      if res.status_code == 400:
+        # we'll have an error message
+        body = res.json()
+        print("Error message:", body)
+      #
+      return
+
+    #
+    # if we get here, status code was 200: the atlas image,
+    # base64 encoded, and an index of product id -> [x, y, w, h]
+    #
+    body = res.json()
+
+    with open(png_filename, "wb") as f:
+      f.write(base64.b64decode(body["atlas"].encode()))
+
+    with open(index_filename, "w") as f:
+      json.dump(body["index"], f, indent=2)
+
+    print(len(body["index"]), "thumbnails written to '" + png_filename + "'")
+
+    # remember the version we have, for next time:
+    etag = res.headers.get("ETag")
+    if etag is not None:
+      with open(etag_filename, "w") as f:
+        f.write(etag)
+    elif pathlib.Path(etag_filename).is_file():
+      os.remove(etag_filename)
+
+    return
+
+  except Exception as e:
+    logging.error("download_sprite() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return
+
+
 ############################################################
 # main
 #
@@ -642,6 +777,31 @@ try:
   if lastchar == "/":
     baseurl = baseurl[:-1]
 
+  #
+  # whose cart: the user id in the config file, or else one made up
+  # for this machine and remembered in a file, so the cart is still
+  # there next session:
+  #
+  user_id = configur.get('client', 'user_id', fallback='').strip()
+
+  if user_id == "":
+    user_id_filename = "ikeaapp-user-id.txt"
+    if pathlib.Path(user_id_filename).is_file():
+      with open(user_id_filename, "r") as f:
+        user_id = f.read().strip()
+    else:
+      user_id = uuid.uuid4().hex
+      with open(user_id_filename, "w") as f:
+        f.write(user_id)
+
+  print("Shopping cart of user:", user_id)
+
+  #
+  # images go straight to S3 through presigned URLs, unless the
+  # config file says to send them through the web service:
+  #
+  presigned = configur.get('client', 'upload', fallback='presigned') != 'base64'
+
   #
   # main processing loop:
   #
@@ -654,13 +814,15 @@ try:
     elif cmd == 2:
       get_product_url(baseurl)
     elif cmd == 3:
-      upload(baseurl)
+      upload(baseurl, user_id, presigned)
     elif cmd == 4:
-      list(baseurl)
+      list(baseurl, user_id)
     elif cmd == 5:
-      remove(baseurl)
+      remove(baseurl, user_id)
     elif cmd == 6:
-      download(baseurl)
+      download(baseurl, user_id)
+    elif cmd == 7:
+      download_sprite(baseurl, user_id)
     else:
       print("** Unknown command, try again...")
     #
@@ -0,0 +1,127 @@
+#
+# paging.py
+#
+# Helpers shared by the lambda functions that return results a page
+# at a time: opaque cursors and bounded-heap top-K selection.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import base64
+import heapq
+import json
+
+
+###################################################################
+#
+# get_limit:
+#
+# Validates the "limit" parameter of a paged request.
+#
+def get_limit(value, max_limit=100):
+  """
+  Converts a page size sent by the client into an integer
+
+  Parameters
+  ----------
+  value : the limit from the request body,
+  max_limit : largest page size allowed
+
+  Returns
+  -------
+  page size (integer between 1 and max_limit)
+  """
+  try:
+    limit = int(value)
+  except (TypeError, ValueError):
+    raise Exception("limit must be an integer")
+
+  if limit < 1 or limit > max_limit:
+    raise Exception("limit must be between 1 and " + str(max_limit))
+
+  return limit
+
+
+###################################################################
+#
+# encode_cursor:
+#
+# Turns the sort key of the last item on a page into an opaque
+# string the client sends back to get the next page.
+#
+def encode_cursor(key):
+  """
+  Encodes a sort key as an opaque cursor string
+
+  Parameters
+  ----------
+  key : list/tuple of JSON-serializable values
+
+  Returns
+  -------
+  cursor string
+  """
+  data = json.dumps(list(key), separators=(",", ":")).encode()
+  return base64.urlsafe_b64encode(data).decode()
+
+
+###################################################################
+#
+# decode_cursor:
+#
+def decode_cursor(cursor):
+  """
+  Decodes a cursor produced by encode_cursor
+
+  Parameters
+  ----------
+  cursor : cursor string sent by the client
+
+  Returns
+  -------
+  the sort key as a tuple
+  """
+  try:
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+  except Exception:
+    raise Exception("invalid cursor")
+
+  if not isinstance(key, list):
+    raise Exception("invalid cursor")
+
+  return tuple(key)
+
+
+###################################################################
+#
+# top_k:
+#
+# Selects the k smallest items (by key) that come after a cursor,
+# using a bounded heap rather than sorting every item.
+#
+def top_k(items, k, key, after=None):
+  """
+  Returns the first k items in key order, skipping items whose key
+  is <= after
+
+  Parameters
+  ----------
+  items : iterable of items,
+  k : number of items wanted (None means all of them),
+  key : function mapping an item to its sort key (a tuple),
+  after : sort key of the last item already returned, or None
+
+  Returns
+  -------
+  list of at most k items, sorted by key
+  """
+  if after is not None:
+    items = (item for item in items if key(item) > after)
+
+  if k is None:
+    return sorted(items, key=key)
+
+  return heapq.nsmallest(k, items, key=key)
@@ -0,0 +1,276 @@
+#
+# searchindex.py
+#
+# In-memory inverted index over products.product_title, so that
+# ikea_recommend can answer keyword searches without running a
+# query per keyword. The index is built once (from a bulk read of
+# the products table, or from a prebuilt index file) and then kept
+# at module scope for the life of the Lambda container.
+#
+# Usage to prebuild an index file from the database:
+#
+#   python searchindex.py products.index
+#
+# The file records the catalog version it was built at (see
+# catalog.py), so a file that an import has since made out of date is
+# not used.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import array
+import datatier
+import heapq
+import pickle
+import unicodedata
+
+
+###################################################################
+#
+# normalize:
+#
+# Lowercases text and strips accents, which is how MySQL's default
+# case- and accent-insensitive collation compares product titles
+# (i.e. "parup" matches "PÄRUP").
+#
+def normalize(text):
+  """
+  Returns text lowercased and with accents removed
+
+  Parameters
+  ----------
+  text : string to normalize
+
+  Returns
+  -------
+  normalized string
+  """
+  decomposed = unicodedata.normalize('NFKD', text.lower())
+  return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+###################################################################
+#
+# ProductIndex
+#
+class ProductIndex:
+  """
+  Inverted index mapping each title token to a sorted posting list
+  of product ids, with a parallel array of product prices
+
+  Matching keeps the semantics of LOWER(product_title) LIKE %kw%:
+  a keyword never contains whitespace, so it is a substring of a
+  title exactly when it is a substring of one of the title's
+  tokens. A keyword is therefore matched against the vocabulary
+  (which is much smaller than the table) and the posting lists of
+  every token that contains it are merged.
+  """
+
+  def __init__(self, rows, version=None):
+    """
+    Builds the index
+
+    Parameters
+    ----------
+    rows : iterable of (product_id, product_title, product_url,
+           product_price) tuples,
+    version : the catalog version the rows were read at (None if
+              not known)
+    """
+    self.version = version
+    self.urls = {}
+    self.postings = {}
+
+    ids_by_token = {}
+    prices_by_token = {}
+
+    # visit products in id order so every posting list comes out sorted:
+    for row in sorted(rows, key=lambda row: row[0]):
+      product_id = int(row[0])
+      product_price = float(row[3])
+      self.urls[product_id] = row[2]
+
+      for token in set(normalize(row[1]).split()):
+        if token not in ids_by_token:
+          ids_by_token[token] = array.array('q')
+          prices_by_token[token] = array.array('d')
+        ids_by_token[token].append(product_id)
+        prices_by_token[token].append(product_price)
+
+    for token, ids in ids_by_token.items():
+      self.postings[token] = (ids, prices_by_token[token])
+
+    self._expansions = {}
+
+  def __len__(self):
+    return len(self.urls)
+
+  def _tokens_containing(self, keyword):
+    """
+    Returns the vocabulary tokens that contain keyword, memoized
+    since search traffic reuses the same handful of words
+    """
+    tokens = self._expansions.get(keyword)
+
+    if tokens is None:
+      tokens = [token for token in self.postings if keyword in token]
+      if len(self._expansions) >= 4096:
+        self._expansions.clear()
+      self._expansions[keyword] = tokens
+
+    return tokens
+
+  def match(self, keyword):
+    """
+    Returns the products whose title contains keyword
+
+    Parameters
+    ----------
+    keyword : a single search word (no whitespace)
+
+    Returns
+    -------
+    list of (product_id, product_price) tuples in product_id order
+    """
+    keyword = normalize(keyword)
+    tokens = self._tokens_containing(keyword)
+
+    if len(tokens) == 1:
+      ids, prices = self.postings[tokens[0]]
+      return list(zip(ids, prices))
+
+    #
+    # several tokens contain the keyword (e.g. "chair" and
+    # "armchair"), so k-way merge their posting lists and drop
+    # products that appear under more than one of them:
+    #
+    merged = heapq.merge(*[zip(*self.postings[token]) for token in tokens])
+
+    matches = []
+    last_id = None
+    for product_id, product_price in merged:
+      if product_id != last_id:
+        matches.append((product_id, product_price))
+        last_id = product_id
+
+    return matches
+
+  def score(self, keywords, budget):
+    """
+    Scores products against a list of keywords
+
+    Parameters
+    ----------
+    keywords : list of lowercase search words,
+    budget : maximum product price (float)
+
+    Returns
+    -------
+    list of (product_id, product_url, score, first_match) tuples in
+    no particular order, where first_match is the index of the
+    first keyword the product matched
+    """
+    # product_id -> [score, index of first keyword matched]
+    scores = {}
+
+    for i, keyword in enumerate(keywords):
+      for product_id, product_price in self.match(keyword):
+        if product_price > budget:
+          continue
+        entry = scores.get(product_id)
+        if entry is None:
+          scores[product_id] = [1, i]
+        else:
+          entry[0] += 1
+
+    return [(product_id, self.urls[product_id], entry[0], entry[1])
+            for product_id, entry in scores.items()]
+
+  def save(self, filename):
+    """
+    Writes the index, and its catalog version, to a file that load()
+    can read back
+    """
+    with open(filename, "wb") as outfile:
+      pickle.dump((self.version, self.urls, self.postings), outfile,
+                  protocol=pickle.HIGHEST_PROTOCOL)
+
+  @classmethod
+  def load(cls, filename):
+    """
+    Reads an index previously written by save()
+    """
+    with open(filename, "rb") as infile:
+      version, urls, postings = pickle.load(infile)
+
+    index = cls([], version)
+    index.urls = urls
+    index.postings = postings
+    return index
+
+
+###################################################################
+#
+# build_from_db:
+#
+# Builds the index from one bulk read of the products table.
+#
+def build_from_db(dbConn, version=None):
+  """
+  Builds a ProductIndex from a single SELECT over products
+
+  Parameters
+  ----------
+  dbConn : the database connection,
+  version : the catalog version, read before calling this (so that
+            a change during the read makes the index look stale,
+            never fresh)
+
+  Returns
+  -------
+  a ProductIndex
+  """
+  sql = "SELECT product_id, product_title, product_url, product_price FROM products"
+
+  rows = datatier.retrieve_all_rows(dbConn, sql)
+
+  return ProductIndex(rows, version)
+
+
+###################################################################
+#
+# main: prebuild an index file from the database
+#
+if __name__ == "__main__":
+  import catalog
+  import sys
+
+  from configparser import ConfigParser
+
+  if len(sys.argv) != 2:
+    print("usage: python searchindex.py <index file>")
+    sys.exit(0)
+
+  configur = ConfigParser()
+  configur.read('ikeaapp-config.ini')
+  endpoint = configur.get('rds', 'endpoint')
+  portnum = int(configur.get('rds', 'port_number'))
+  username = configur.get('rds', 'user_name')
+  pwd = configur.get('rds', 'user_pwd')
+  dbname = configur.get('rds', 'db_name')
+
+  dbConn = datatier.get_dbConn(endpoint, portnum, username, pwd, dbname)
+
+  version = datatier.retrieve_one_row(dbConn, catalog.version_sql)
+  version = version[0] if version != () else 0
+
+  index = build_from_db(dbConn, version)
+  index.save(sys.argv[1])
+
+  print("indexed", len(index), "products into", sys.argv[1],
+        "at catalog version", version)
+
+  dbConn.close()
@@ -0,0 +1,116 @@
+#
+# serialize.py
+#
+# JSON encoding of lambda responses. Database rows are encoded as they
+# come back from pymysql (tuples, with DECIMAL columns as Decimal), so
+# handlers don't have to copy every row and convert every cell before
+# calling json.dumps. Uses orjson when it is installed (e.g. as a
+# lambda layer), the standard json module otherwise.
+#
+# A list of rows can be returned in one of two shapes:
+#
+#   "rows"      [[80001, "chair", 49.99], ...]  (the original shape)
+#   "columnar"  {"columns": ["product_id", "product_name", "price"],
+#                "rows": [[80001, "chair", 49.99], ...]}
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import datetime
+import json
+
+from decimal import Decimal
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+SHAPES = ("rows", "columnar")
+
+
+###################################################################
+#
+# _default:
+#
+# Called by the encoder for values JSON has no type for. A DECIMAL
+# column has at most 15 significant digits here (DECIMAL(12, 2) at
+# most), which a float holds exactly enough that it prints back as
+# the same number, so Decimals are encoded as JSON numbers.
+#
+def _default(value):
+  if isinstance(value, Decimal):
+    return float(value)
+  if isinstance(value, (datetime.date, datetime.datetime)):
+    return value.isoformat()
+  raise TypeError("Object of type " + type(value).__name__ +
+                  " is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(default=_default,
+                            ensure_ascii=False,
+                            separators=(",", ":"))
+
+
+###################################################################
+#
+# dumps:
+#
+def dumps(obj):
+  """
+  Encodes a response body as JSON
+
+  Parameters
+  ----------
+  obj : dicts, lists, tuples, strings, numbers, Decimals, dates
+
+  Returns
+  -------
+  JSON string
+  """
+  if orjson is not None:
+    return orjson.dumps(obj, default=_default).decode()
+
+  return _encoder.encode(obj)
+
+
+###################################################################
+#
+# get_shape:
+#
+# Validates the "shape" parameter of a request (default "rows").
+#
+def get_shape(value):
+  if value is None:
+    return "rows"
+  if value not in SHAPES:
+    raise Exception("shape must be one of: " + ", ".join(SHAPES))
+  return value
+
+
+###################################################################
+#
+# table:
+#
+def table(columns, rows, shape="rows"):
+  """
+  Puts a list of rows into the requested response shape, without
+  copying the rows
+
+  Parameters
+  ----------
+  columns : list of column names,
+  rows : list of rows (tuples or lists), one value per column,
+  shape : "rows" or "columnar"
+
+  Returns
+  -------
+  rows itself, or {"columns": columns, "rows": rows}
+  """
+  if shape == "columnar":
+    return {"columns": columns, "rows": rows}
+
+  return rows
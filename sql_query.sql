@@ -4,6 +4,8 @@ USE ikeaapp;
 
 DROP TABLE IF EXISTS products;
 DROP TABLE IF EXISTS cart;
+DROP TABLE IF EXISTS cart_summary;
+DROP TABLE IF EXISTS catalog_version;
 
 -- products table to store all products in IKEA inventory
 CREATE TABLE products
@@ -20,19 +22,44 @@ CREATE TABLE products
     seller               VARCHAR(64) NOT NULL,
     seller_url           VARCHAR(255),
     brand                VARCHAR(64) NOT NULL,
+    fingerprint          CHAR(64),             -- hash of the catalog record, see initialize_db.py --sync
     PRIMARY KEY (product_id),
     UNIQUE (product_url)
 );
 
 ALTER TABLE products AUTO_INCREMENT = 80001;  -- starting value
 
--- shopping cart table to store client's chosen products
+-- shopping cart table to store each client's chosen products; one row
+-- per product in a user's cart, so a cart is one range of the primary key
 CREATE TABLE cart (
-    product_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id VARCHAR(64) NOT NULL,
+    product_id INT NOT NULL,
     product_name VARCHAR(255) NOT NULL,
-    price DECIMAL(10, 2) NOT NULL
+    price DECIMAL(10, 2) NOT NULL,
+    quantity INT NOT NULL DEFAULT 1,
+    PRIMARY KEY (user_id, product_id)
 );
 
+-- running totals of each user's cart, updated in the same transaction as
+-- every change to their cart rows (created with the first item); version
+-- goes up by one on every change
+CREATE TABLE cart_summary (
+    user_id VARCHAR(64) PRIMARY KEY,
+    item_count INT NOT NULL,
+    subtotal DECIMAL(12, 2) NOT NULL,
+    version BIGINT NOT NULL
+);
+
+-- version of the products table (single row, id = 1), bumped by
+-- initialize_db.py after every import or sync that changes it; the
+-- lambda functions drop whatever they cached from products when it moves
+CREATE TABLE catalog_version (
+    id TINYINT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+INSERT INTO catalog_version(id, version) VALUES(1, 0);
+
 FLUSH PRIVILEGES;
 
 --
@@ -0,0 +1,18 @@
+#
+# conftest.py
+#
+# The lambda functions import the shared modules at the top level of
+# the repository, and each other by name, so put both directories on
+# the path for the tests (and the benchmarks, for the S3 stand-in).
+#
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path[:0] = [
+    ROOT,
+    os.path.join(ROOT, "lambda functions"),
+    os.path.join(ROOT, "benchmarks")
+]
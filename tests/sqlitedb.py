@@ -0,0 +1,81 @@
+#
+# sqlitedb.py
+#
+# Lets the tests run datatier's MySQL-style (%s) parameterized
+# queries against an in-memory SQLite database.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import sqlite3
+
+from decimal import Decimal
+
+# like pymysql, hand DECIMAL columns back as Decimal (needs
+# SQLiteConnection(decimal=True)):
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode()))
+
+
+class SQLiteCursor:
+
+  def __init__(self, dbConn):
+    self.cursor = dbConn.cursor()
+
+  def execute(self, sql, parameters=[]):
+    self.cursor.execute(sql.replace("%s", "?"), parameters)
+
+  def fetchone(self):
+    return self.cursor.fetchone()
+
+  def fetchall(self):
+    return self.cursor.fetchall()
+
+  def close(self):
+    self.cursor.close()
+
+
+class SQLiteConnection:
+  """
+  The parts of a pymysql connection that datatier's queries use
+  """
+
+  def __init__(self, decimal=False):
+    self.dbConn = sqlite3.connect(
+        ":memory:", detect_types=sqlite3.PARSE_DECLTYPES if decimal else 0)
+
+  def cursor(self):
+    return SQLiteCursor(self.dbConn)
+
+  def execute(self, sql, parameters=[]):
+    return self.dbConn.execute(sql, parameters)
+
+
+class Pool:
+  """
+  Stands in for datatier.ConnectionPool, always handing out the
+  same connection
+  """
+
+  def __init__(self, dbConn):
+    self.dbConn = dbConn
+
+  def acquire(self):
+    return self.dbConn
+
+  def release(self, dbConn):
+    pass
+
+
+PRODUCTS_TABLE = """
+    CREATE TABLE products (
+      product_id    INTEGER PRIMARY KEY,
+      product_title TEXT,
+      product_url   TEXT,
+      sku           TEXT,
+      mpn           TEXT,
+      currency      TEXT,
+      product_price REAL
+    )"""
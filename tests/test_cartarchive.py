@@ -0,0 +1,86 @@
+#
+# test_cartarchive.py
+#
+# Checks that a cached cart zip which can't be updated is deleted
+# rather than left in S3 out of date.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import io
+import zipfile
+
+import pytest
+
+import cartarchive
+import fakes3
+
+USER = "alice"
+
+
+def make_zip(members):
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, 'w') as archive:
+    for name, data in members.items():
+      archive.writestr(name, data)
+  return buffer.getvalue()
+
+
+@pytest.fixture
+def s3():
+  return fakes3.FakeS3Client({
+      cartarchive.archive_key(USER): make_zip({"80001.PNG": b"png"})
+  })
+
+
+def members(s3):
+  data = s3.objects[cartarchive.archive_key(USER)]
+  return zipfile.ZipFile(io.BytesIO(data)).namelist()
+
+
+def test_update(s3):
+  etag = cartarchive.update_archive(s3, "bucket", USER,
+                                    add={"80002.PNG": b"png"},
+                                    remove=["80001.PNG"])
+
+  assert etag is not None
+  assert members(s3) == ["80002.PNG"]
+
+
+def test_archive_discarded_when_updates_keep_losing(s3, monkeypatch):
+
+  def put_object(**kwargs):
+    raise fakes3.FakeClientError("PreconditionFailed")
+
+  monkeypatch.setattr(s3, "put_object", put_object)
+
+  assert cartarchive.update_archive(s3, "bucket", USER,
+                                    remove=["80001.PNG"]) is None
+  assert cartarchive.archive_key(USER) not in s3.objects
+
+
+def test_archive_discarded_on_s3_error(s3, monkeypatch):
+
+  def put_object(**kwargs):
+    raise fakes3.FakeClientError("InternalError")
+
+  monkeypatch.setattr(s3, "put_object", put_object)
+
+  assert cartarchive.update_archive(s3, "bucket", USER,
+                                    add={"80002.PNG": b"png"}) is None
+  assert cartarchive.archive_key(USER) not in s3.objects
+
+
+def test_raises_when_archive_cannot_be_discarded(s3, monkeypatch):
+
+  def fail(**kwargs):
+    raise fakes3.FakeClientError("InternalError")
+
+  monkeypatch.setattr(s3, "put_object", fail)
+  monkeypatch.setattr(s3, "delete_object", fail)
+
+  with pytest.raises(Exception):
+    cartarchive.update_archive(s3, "bucket", USER, remove=["80001.PNG"])
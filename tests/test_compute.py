@@ -0,0 +1,101 @@
+#
+# test_compute.py
+#
+# Checks how ikea_compute reports a batch of S3 records: failures
+# are reported under the same (unquoted) bucket key as successes,
+# and a cart zip that can't be updated only fails that cart's
+# records.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import json
+
+from configparser import ConfigParser
+
+import pytest
+
+import bootstrap
+import cartarchive
+import fakes3
+import ikea_compute
+import thumbnails
+
+
+def record(key):
+  return {"s3": {"object": {"key": key, "eTag": "0" * 32}}}
+
+
+@pytest.fixture(autouse=True)
+def aws(monkeypatch):
+  configur = ConfigParser()
+  configur.read_string("[compute]\nworkers = 2\nprofiles = cart:50\n")
+
+  s3_client = fakes3.FakeS3Client()
+
+  monkeypatch.setattr(bootstrap, "get_config", lambda: configur)
+  monkeypatch.setattr(bootstrap, "get_s3_client", lambda: s3_client)
+  monkeypatch.setattr(bootstrap, "get_bucketname", lambda: "bucket")
+
+  #
+  # pretend every image was processed (or failed), so this doesn't
+  # need Pillow:
+  #
+  def process_record(s3_client, bucketname, record, profiles, palette=True):
+    bucketkey = ikea_compute.record_key(record)
+    if "broken" in bucketkey:
+      raise Exception("cannot identify image file")
+    return (bucketkey, "success", {
+        thumbnails.thumbnail_key(bucketkey): b"png"
+    })
+
+  monkeypatch.setattr(ikea_compute, "process_record", process_record)
+
+  return s3_client
+
+
+def compute(keys):
+  response = ikea_compute.lambda_handler(
+      {"Records": [record(key) for key in keys]}, None)
+  return response['statusCode'], json.loads(response['body'])
+
+
+def test_failures_reported_under_unquoted_key():
+  status, results = compute([
+      "ikeaapp/images_ikeaapp/alice/80001.jpg",
+      "ikeaapp/images_ikeaapp/alice/broken+photo.jpg"
+  ])
+
+  assert status == 500
+  assert results["ikeaapp/images_ikeaapp/alice/80001.jpg"] == "success"
+  assert results["ikeaapp/images_ikeaapp/alice/broken photo.jpg"].startswith(
+      "Error processing image")
+  assert "ikeaapp/images_ikeaapp/alice/broken+photo.jpg" not in results
+
+
+def test_cart_zip_failure_only_fails_that_cart(monkeypatch):
+  updated = []
+
+  def update_archive(s3_client, bucketname, user_id, add=None, remove=None,
+                     retries=5):
+    if user_id == "alice":
+      raise Exception("gave up after 5 tries")
+    updated.append(user_id)
+
+  monkeypatch.setattr(cartarchive, "update_archive", update_archive)
+
+  status, results = compute([
+      "ikeaapp/images_ikeaapp/alice/80001.jpg",
+      "ikeaapp/images_ikeaapp/bob/80002.jpg",
+      "ikeaapp/images_ikeaapp/carol/80003.jpg"
+  ])
+
+  assert status == 500
+  assert updated == ["bob", "carol"]
+  assert results["ikeaapp/images_ikeaapp/alice/80001.jpg"].startswith(
+      "Error updating cart zip")
+  assert results["ikeaapp/images_ikeaapp/bob/80002.jpg"] == "success"
+  assert results["ikeaapp/images_ikeaapp/carol/80003.jpg"] == "success"
@@ -0,0 +1,54 @@
+#
+# test_datatier.py
+#
+# Checks the bounds of datatier.QueryCache.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import datatier
+
+SQL = "SELECT product_id FROM products WHERE product_title LIKE %s"
+
+
+def rows(n):
+  return tuple((i,) for i in range(n))
+
+
+def test_evicts_least_recently_used_to_stay_under_max_rows():
+  cache = datatier.QueryCache(max_size=10, max_rows=100)
+
+  cache.put((SQL, "a"), rows(40), 60, 40)
+  cache.put((SQL, "b"), rows(40), 60, 40)
+  cache.get((SQL, "a"))
+  cache.put((SQL, "c"), rows(40), 60, 40)
+
+  assert cache.get((SQL, "a"))[0]
+  assert not cache.get((SQL, "b"))[0]
+  assert cache.get((SQL, "c"))[0]
+  assert cache.stats()["rows"] == 80
+
+
+def test_result_larger_than_max_rows_not_cached():
+  cache = datatier.QueryCache(max_size=10, max_rows=100)
+
+  cache.put((SQL, "a"), rows(40), 60, 40)
+
+  assert not cache.put((SQL, "e"), rows(101), 60, 101)
+  assert not cache.get((SQL, "e"))[0]
+  assert cache.get((SQL, "a"))[0]
+
+
+def test_rows_follow_replacement_and_invalidation():
+  cache = datatier.QueryCache(max_size=10, max_rows=100)
+
+  cache.put((SQL, "a"), rows(40), 60, 40)
+  cache.put((SQL, "a"), rows(10), 60, 10)
+  assert cache.stats()["rows"] == 10
+
+  cache.put(("SELECT version FROM catalog_version", ), (1, ), 60)
+  assert cache.invalidate(["products"]) == 1
+  assert cache.stats()["rows"] == 1
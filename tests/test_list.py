@@ -0,0 +1,116 @@
+#
+# test_list.py
+#
+# Checks ikea_list's conditional requests: every page and shape of
+# a cart has an ETag of its own, so If-None-Match only gets a 304 for
+# the exact representation the client already has.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import json
+
+import pytest
+
+import bootstrap
+import ikea_list
+
+from sqlitedb import Pool, SQLiteConnection
+
+USER = "alice"
+
+
+@pytest.fixture(autouse=True)
+def dbConn(monkeypatch):
+  dbConn = SQLiteConnection()
+  dbConn.execute("""
+      CREATE TABLE cart (
+        user_id      TEXT,
+        product_id   INTEGER,
+        product_name TEXT,
+        price        REAL,
+        quantity     INTEGER,
+        PRIMARY KEY (user_id, product_id)
+      )""")
+  dbConn.execute("""
+      CREATE TABLE cart_summary (
+        user_id    TEXT PRIMARY KEY,
+        item_count INTEGER,
+        subtotal   REAL,
+        version    INTEGER
+      )""")
+
+  for i in range(5):
+    dbConn.execute("INSERT INTO cart VALUES (?, ?, ?, 10.0, 1)",
+                   (USER, 80001 + i, "product " + str(i)))
+  dbConn.execute("INSERT INTO cart_summary VALUES (?, 5, 50.0, 5)", (USER,))
+
+  monkeypatch.setattr(bootstrap, "get_db_pool", lambda: Pool(dbConn))
+
+  return dbConn
+
+
+def list_cart(params=None, if_none_match=None):
+  headers = {"X-User-Id": USER}
+  if if_none_match is not None:
+    headers["If-None-Match"] = if_none_match
+
+  return ikea_list.lambda_handler(
+      {
+          "headers": headers,
+          "queryStringParameters": params
+      }, None)
+
+
+def test_unchanged_cart_gets_304():
+  response = list_cart()
+  assert response['statusCode'] == 200
+
+  etag = response['headers']['ETag']
+  response = list_cart(if_none_match=etag)
+
+  assert response['statusCode'] == 304
+  assert response['headers']['ETag'] == etag
+
+
+def test_each_page_has_its_own_etag():
+  first = list_cart({"limit": "2"})
+  cursor = json.loads(first['body'])["next_cursor"]
+
+  second = list_cart({"limit": "2", "cursor": cursor},
+                     if_none_match=first['headers']['ETag'])
+
+  assert second['statusCode'] == 200
+  assert second['headers']['ETag'] != first['headers']['ETag']
+  assert [item[0] for item in json.loads(second['body'])["items"]] == [
+      80003, 80004
+  ]
+
+  again = list_cart({"limit": "2", "cursor": cursor},
+                    if_none_match=second['headers']['ETag'])
+
+  assert again['statusCode'] == 304
+
+
+def test_page_size_and_shape_change_the_etag():
+  etags = set()
+
+  for params in [None, {"limit": "2"}, {"limit": "3"}, {"shape": "columnar"},
+                 {"limit": "2", "shape": "columnar"}]:
+    etags.add(list_cart(params)['headers']['ETag'])
+
+  assert len(etags) == 5
+
+  unpaged = list_cart()['headers']['ETag']
+  assert list_cart({"limit": "2"}, if_none_match=unpaged)['statusCode'] == 200
+
+
+def test_cart_change_changes_the_etag(dbConn):
+  etag = list_cart()['headers']['ETag']
+
+  dbConn.execute("UPDATE cart_summary SET version = version + 1")
+
+  assert list_cart(if_none_match=etag)['statusCode'] == 200
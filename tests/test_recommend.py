@@ -0,0 +1,188 @@
+#
+# test_recommend.py
+#
+# Checks that ikea_recommend's single-statement search (search_sql)
+# ranks products exactly like the original per-keyword loop
+# (search_loop), using SQLite as a stand-in for MySQL.
+#
+# Usage:
+#
+#   python -m pytest -q tests
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import random
+
+from configparser import ConfigParser
+
+import pytest
+
+import datatier
+import ikea_recommend
+import paging
+import searchindex
+
+from sqlitedb import PRODUCTS_TABLE, SQLiteConnection
+
+WORDS = ("black white office chair desk table armchair lamp oak birch "
+         "shelf sofa").split()
+
+SEARCHES = ["chair", "black office chair", "chair chair desk", "zzz",
+            "", "ak ir", "white lamp shelf sofa oak", "a"]
+
+BUDGETS = [50, 250.5, 1000]
+
+
+@pytest.fixture(scope="module")
+def dbConn():
+  dbConn = SQLiteConnection()
+
+  dbConn.execute(PRODUCTS_TABLE)
+
+  # titles mix upper and lower case, and repeat words, so that
+  # scores tie often:
+  generator = random.Random(1)
+  for i in range(400):
+    title = " ".join(
+        generator.choice(WORDS).capitalize()
+        if generator.random() < 0.3 else generator.choice(WORDS)
+        for _ in range(generator.randint(1, 5)))
+    price = round(generator.uniform(1, 500), 2)
+    dbConn.execute(
+        "INSERT INTO products VALUES (?, ?, ?, '', '', 'USD', ?)",
+        (80001 + i, title, "https://www.ikea.com/p/" + str(i), price))
+
+  return dbConn
+
+
+def without_first_match(results):
+  return [result[:3] for result in results]
+
+
+def read_pages(search, limit, after=None):
+  """
+  Collects every result of search, limit at a time, following the
+  cursor from one page to the next
+  """
+  results = []
+
+  while True:
+    page = search(limit, after)
+    results += page
+    if len(page) < limit:
+      return results
+    after = paging.decode_cursor(
+        paging.encode_cursor(ikea_recommend.rank_key(page[-1])))
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+@pytest.mark.parametrize("budget", BUDGETS)
+def test_sql_matches_loop(dbConn, search, budget):
+  keywords = search.lower().split()
+
+  expected = ikea_recommend.search_loop(dbConn, keywords, budget)
+  results = ikea_recommend.search_sql(dbConn, keywords, budget)
+
+  assert without_first_match(results) == without_first_match(expected)
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+@pytest.mark.parametrize("budget", BUDGETS)
+def test_sql_pages_match_loop(dbConn, search, budget):
+  keywords = search.lower().split()
+
+  expected = ikea_recommend.search_loop(dbConn, keywords, budget)
+
+  for limit in [7, 50]:
+    loop_pages = read_pages(
+        lambda limit, after: ikea_recommend.search_loop(
+            dbConn, keywords, budget, limit, after), limit)
+    sql_pages = read_pages(
+        lambda limit, after: ikea_recommend.search_sql(
+            dbConn, keywords, budget, limit, after), limit)
+
+    assert loop_pages == expected
+    assert sql_pages == expected
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+def test_sql_after_without_limit(dbConn, search):
+  keywords = search.lower().split()
+
+  expected = ikea_recommend.search_loop(dbConn, keywords, 1000)
+
+  for i in sorted({0, len(expected) // 2, len(expected) - 1}):
+    if i < 0 or i >= len(expected):
+      continue
+    after = ikea_recommend.rank_key(expected[i])
+    assert ikea_recommend.search_sql(dbConn, keywords, 1000,
+                                     after=after) == expected[i + 1:]
+    assert ikea_recommend.search_loop(dbConn, keywords, 1000,
+                                      after=after) == expected[i + 1:]
+
+
+def test_sql_returns_three_columns_when_not_paging(dbConn):
+  results = ikea_recommend.search_sql(dbConn, ["chair"], 1000)
+
+  assert len(results) > 0
+  assert all(first_match is None for _, _, _, first_match in results)
+
+
+def test_index_file_only_used_at_its_catalog_version(dbConn, tmp_path,
+                                                     monkeypatch):
+  index_file = str(tmp_path / "products.index")
+  searchindex.ProductIndex([(1, "black chair", "https://www.ikea.com/p/1",
+                             10.0)], 3).save(index_file)
+
+  configur = ConfigParser()
+  configur.read_string("[recommend]\nindex_file = " + index_file + "\n")
+
+  monkeypatch.setattr(ikea_recommend, "product_index", None)
+  index = ikea_recommend.get_product_index(dbConn, configur, 3)
+  assert len(index) == 1
+
+  # an import since then: the file is out of date, so use the table
+  monkeypatch.setattr(ikea_recommend, "product_index", None)
+  index = ikea_recommend.get_product_index(dbConn, configur, 4)
+  assert len(index) == 400
+  assert index.version == 4
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+def test_cached_matches_loop_with_small_cache(dbConn, search):
+  keywords = search.lower().split()
+
+  # room for a few keywords' worth of products, so "a" is never
+  # kept and the rest evict each other:
+  cache = datatier.QueryCache(max_size=256, max_rows=150)
+
+  for budget in BUDGETS:
+    expected = ikea_recommend.search_loop(dbConn, keywords, budget)
+    results = ikea_recommend.search_cached(dbConn, cache, keywords, budget,
+                                           3600, 1)
+    assert results == expected
+    assert cache.stats()["rows"] <= 150
+
+
+def test_cached_matches_loop_with_decimal_prices():
+  # product_price is DECIMAL in MySQL, and pymysql hands it back as a
+  # Decimal, which the REAL prices above don't show:
+  dbConn = SQLiteConnection(decimal=True)
+  dbConn.execute(PRODUCTS_TABLE.replace("REAL", "DECIMAL(10, 2)"))
+
+  for i, price in enumerate(["19.99", "0.30", "250.50", "1000.00"]):
+    dbConn.execute(
+        "INSERT INTO products VALUES (?, 'black chair', ?, '', '', 'USD', ?)",
+        (80001 + i, "https://www.ikea.com/p/" + str(i), price))
+
+  cache = datatier.QueryCache(max_size=256)
+
+  for budget in [0.3, 19.99, 250.5, 1000]:
+    expected = ikea_recommend.search_loop(dbConn, ["chair"], budget)
+    results = ikea_recommend.search_cached(dbConn, cache, ["chair"], budget,
+                                           3600, 1)
+    assert results == expected
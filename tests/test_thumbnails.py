@@ -0,0 +1,88 @@
+#
+# test_thumbnails.py
+#
+# Checks the thumbnail index against the in-memory S3 stand-in
+# (benchmarks/fakes3.py): each thumbnail is written once, a repeated
+# image is copied from the thumbnail the index names, and an entry
+# whose thumbnail is gone is not used.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import pytest
+
+import fakes3
+import thumbnails
+
+IMAGE = b"\xff\xd8\xff\xe0 not really a jpg"
+
+PROFILES = [
+    thumbnails.CART_PROFILE, ('preview', 200, 'ikeaapp/preview_ikeaapp/')
+]
+
+FIRST = "ikeaapp/images_ikeaapp/alice/80001.jpg"
+SECOND = "ikeaapp/images_ikeaapp/bob/80002.jpg"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+  # fixed bytes per size, so this doesn't need Pillow:
+  monkeypatch.setattr(
+      thumbnails, "make_thumbnails", lambda data, sizes, palette=True:
+      {size: b"png " + str(size).encode() for size in sizes})
+
+  return fakes3.FakeS3Client()
+
+
+def test_thumbnails_written_once(s3_client):
+  thumbnails.store_thumbnails(s3_client, "bucket", FIRST, IMAGE, PROFILES)
+
+  pngs = [key for key, data in s3_client.objects.items() if data]
+  assert sorted(pngs) == sorted(
+      thumbnails.thumbnail_key(FIRST, folder) for _, _, folder in PROFILES)
+
+  md5 = thumbnails.source_md5(IMAGE)
+  for name, size, folder in PROFILES:
+    assert s3_client.objects[thumbnails.hash_key(md5, size)] == b''
+
+
+def test_repeated_image_copied(s3_client):
+  thumbnails.store_thumbnails(s3_client, "bucket", FIRST, IMAGE, PROFILES)
+
+  md5 = thumbnails.source_md5(IMAGE)
+  pngs = thumbnails.link_thumbnails(s3_client, "bucket", SECOND, md5, PROFILES)
+
+  cart_key = thumbnails.thumbnail_key(SECOND)
+  assert pngs == {cart_key: b"png 50"}
+  assert s3_client.objects[cart_key] == b"png 50"
+  assert thumbnails.is_current(s3_client, "bucket", cart_key, md5)
+  assert s3_client.objects[thumbnails.thumbnail_key(
+      SECOND, 'ikeaapp/preview_ikeaapp/')] == b"png 200"
+
+
+def test_entry_for_removed_thumbnail_not_used(s3_client):
+  thumbnails.store_thumbnails(s3_client, "bucket", FIRST, IMAGE, PROFILES)
+  s3_client.delete_object(Bucket="bucket",
+                          Key=thumbnails.thumbnail_key(FIRST))
+
+  md5 = thumbnails.source_md5(IMAGE)
+  assert thumbnails.link_thumbnails(s3_client, "bucket", SECOND, md5,
+                                    PROFILES) is None
+
+  # made again, the entry now names the new thumbnail:
+  thumbnails.store_thumbnails(s3_client, "bucket", SECOND, IMAGE, PROFILES)
+  assert thumbnails.link_thumbnails(s3_client, "bucket", FIRST, md5,
+                                    PROFILES) is not None
+
+
+def test_entry_for_replaced_thumbnail_not_used(s3_client):
+  thumbnails.store_thumbnails(s3_client, "bucket", FIRST, IMAGE, PROFILES)
+  thumbnails.store_thumbnails(s3_client, "bucket", FIRST, b"another photo",
+                              PROFILES)
+
+  assert thumbnails.link_thumbnails(s3_client, "bucket", SECOND,
+                                    thumbnails.source_md5(IMAGE),
+                                    PROFILES) is None
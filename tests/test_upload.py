@@ -0,0 +1,159 @@
+#
+# test_upload.py
+#
+# Checks ikea_upload's presigned upload path against the in-memory
+# S3 stand-in (benchmarks/fakes3.py): the URL it hands out takes the
+# client's PUT to the image's key, and the cart is only touched once
+# the URL has been made.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import base64
+import json
+
+from configparser import ConfigParser
+from types import SimpleNamespace
+
+import pytest
+
+import bootstrap
+import datatier
+import fakes3
+import ikea_upload
+import thumbnails
+
+from sqlitedb import PRODUCTS_TABLE, Pool, SQLiteConnection
+
+USER = "alice"
+PRODUCT_ID = 80001
+IMAGE = b"\xff\xd8\xff\xe0 not really a jpg"
+
+
+@pytest.fixture
+def aws(monkeypatch):
+  dbConn = SQLiteConnection()
+  dbConn.execute(PRODUCTS_TABLE)
+  dbConn.execute(
+      "INSERT INTO products VALUES (?, 'EKTORP Sofa', ?, '', '', 'USD', ?)",
+      (PRODUCT_ID, "https://www.ikea.com/p/ektorp", 499.0))
+
+  configur = ConfigParser()
+  configur.read_string("[upload]\npresigned_expires = 60\n"
+                       "[cache]\nproduct_ttl = 0\n")
+
+  s3_client = fakes3.FakeS3Client()
+
+  monkeypatch.setattr(bootstrap, "get_config", lambda: configur)
+  monkeypatch.setattr(bootstrap, "get_db_pool", lambda: Pool(dbConn))
+  monkeypatch.setattr(bootstrap, "get_s3_client", lambda: s3_client)
+  monkeypatch.setattr(bootstrap, "get_bucketname", lambda: "bucket")
+  monkeypatch.setattr(bootstrap, "get_s3_bucket",
+                      lambda: fakes3.FakeBucket(s3_client, "bucket"))
+
+  # the cart writes are MySQL-only (ON DUPLICATE KEY), so just
+  # record them:
+  transactions = []
+
+  def perform_transaction(dbConn, actions):
+    transactions.append(actions)
+    return [1] * len(actions)
+
+  monkeypatch.setattr(datatier, "perform_transaction", perform_transaction)
+
+  return SimpleNamespace(s3=s3_client, transactions=transactions)
+
+
+def upload(productid=PRODUCT_ID, **params):
+  event = {
+      "headers": {
+          "x-user-id": USER
+      },
+      "body":
+      json.dumps(dict(params, productid=productid, filename="sofa.jpg"))
+  }
+  response = ikea_upload.lambda_handler(event, None)
+  return response['statusCode'], json.loads(response['body'])
+
+
+def test_presigned_put_lands_at_image_key(aws):
+  status, body = upload()
+
+  assert status == 200
+  assert body["product_url"] == "https://www.ikea.com/p/ektorp"
+  assert len(aws.transactions) == 1
+
+  assert aws.s3.put_presigned(body["upload_url"], IMAGE,
+                              body["upload_headers"]) == 200
+  assert aws.s3.objects[thumbnails.image_key(USER, PRODUCT_ID)] == IMAGE
+
+
+def test_presigned_put_needs_the_signed_headers(aws):
+  status, body = upload()
+
+  headers = dict(body["upload_headers"], **{"Content-Type": "image/png"})
+
+  assert aws.s3.put_presigned(body["upload_url"], IMAGE, headers) == 403
+  assert thumbnails.image_key(USER, PRODUCT_ID) not in aws.s3.objects
+
+
+def test_cart_untouched_when_url_fails(aws, monkeypatch):
+
+  def generate_presigned_url(*args, **kwargs):
+    raise fakes3.FakeClientError("ExpiredToken")
+
+  monkeypatch.setattr(aws.s3, "generate_presigned_url", generate_presigned_url)
+
+  status, body = upload()
+
+  assert status == 400
+  assert aws.transactions == []
+
+
+def test_no_such_product(aws):
+  status, body = upload(productid=1)
+
+  assert status == 400
+  assert body == "no such product..."
+  assert aws.transactions == []
+
+
+def test_no_upload_url_when_cart_write_rolls_back(aws, monkeypatch):
+  monkeypatch.setattr(datatier, "perform_transaction",
+                      lambda dbConn, actions: None)
+
+  status, body = upload()
+
+  assert status == 400
+  assert body == "failed to add product to cart"
+
+
+def test_original_uploaded_when_inline_thumbnail_fails(aws):
+  # not a JPEG Pillow can decode, so the inline thumbnail fails:
+  status, body = upload(data=base64.b64encode(IMAGE).decode(), thumbnail=True)
+
+  assert status == 200
+  assert len(aws.transactions) == 1
+  assert aws.s3.objects[thumbnails.image_key(USER, PRODUCT_ID)] == IMAGE
+
+
+def test_productid_normalized_before_keys_and_sql(aws):
+  status, body = upload(productid=" 80001")
+
+  assert status == 200
+  assert aws.transactions[0][0][1][1] == PRODUCT_ID
+
+  assert aws.s3.put_presigned(body["upload_url"], IMAGE,
+                              body["upload_headers"]) == 200
+  assert aws.s3.objects[thumbnails.image_key(USER, PRODUCT_ID)] == IMAGE
+
+
+def test_productid_must_be_an_integer(aws):
+  status, body = upload(productid="80001/../bob/80002")
+
+  assert status == 400
+  assert body == "productid must be an integer"
+  assert aws.transactions == []
@@ -0,0 +1,436 @@
+#
+# thumbnails.py
+#
+# Shrinks a product image to the PNG thumbnail kept in the shopping
+# cart folder, and writes it to S3. Used by ikea_compute (when the S3
+# event for an uploaded JPG fires) and by ikea_upload (when it builds
+# the thumbnail inline from the bytes it already holds).
+#
+# One image can have several thumbnail "profiles" (the 50px cart icon,
+# plus e.g. a 200px preview kept in its own folder), all made from a
+# single decode. JPEGs are decoded in draft mode, i.e. scaled down by
+# the decoder itself to just above the largest size needed, and the
+# thumbnails are written as optimized palette PNGs.
+#
+# Each thumbnail is tagged with the MD5 of the image it was made from
+# (object metadata "source-md5"). For a single-part upload that's the
+# same as the image's S3 ETag, which comes with the S3 event, so
+# ikea_compute can tell a thumbnail is already up to date without
+# downloading anything.
+#
+# Originals are uploaded to ikeaapp/images_ikeaapp/<user id>/, and
+# their thumbnails go to the same user's folder inside each profile's
+# folder, e.g. ikeaapp/cart_ikeaapp/<user id>/80001.PNG.
+#
+# Thumbnails are also indexed by that MD5 and the thumbnail size:
+# ikeaapp/thumbs_ikeaapp/<md5>_<size> is an empty object whose
+# metadata ("thumbnail-key") names a thumbnail already made from that
+# image. When the same photo is uploaded again, or under another
+# product id, its thumbnails are server-side copies of that one, so
+# the image isn't downloaded, decoded or encoded again. This saves
+# compute, not storage: every cart item still has a thumbnail of its
+# own, since the cart zip and the sprite are built by listing the
+# cart folder. An entry whose thumbnail has since been removed (or
+# replaced) is simply not used, and is pointed at the next thumbnail
+# made from that image.
+#
+# Authors:
+#   Karen Lee, Bhavi Barnwal
+#   Northwestern University
+#   CS 310
+#
+
+import io
+import hashlib
+import pathlib
+
+from cartarchive import CART_PREFIX, error_code
+
+SOURCE_MD5 = 'source-md5'
+
+THUMBNAIL_KEY = 'thumbnail-key'
+
+THUMBS_PREFIX = 'ikeaapp/thumbs_ikeaapp/'
+
+IMAGES_PREFIX = 'ikeaapp/images_ikeaapp/'
+
+# (name, size, folder); the cart profile is always made
+CART_PROFILE = ('cart', 50, CART_PREFIX)
+
+
+###################################################################
+#
+# get_profiles:
+#
+# The [compute] profiles setting lists name:size pairs, e.g.
+# "cart:50, preview:200". Profiles other than cart are stored in
+# their own folder, e.g. ikeaapp/preview_ikeaapp/.
+#
+def get_profiles(configur):
+  """
+  Returns the thumbnail profiles to make for each image
+
+  Parameters
+  ----------
+  configur : the parsed config file
+
+  Returns
+  -------
+  list of (name, size in pixels, folder) tuples, cart first
+  """
+  profiles = [CART_PROFILE]
+
+  setting = configur.get('compute', 'profiles', fallback='')
+
+  for entry in setting.split(','):
+    if entry.strip() == '':
+      continue
+    name, size = entry.split(':')
+    name = name.strip()
+    if name == 'cart':
+      profiles[0] = ('cart', int(size), CART_PREFIX)
+    else:
+      profiles.append((name, int(size), "ikeaapp/" + name + "_ikeaapp/"))
+
+  return profiles
+
+
+###################################################################
+#
+# image_key:
+#
+# The key an original image is uploaded to, e.g. ("alice", 80001) ->
+# "ikeaapp/images_ikeaapp/alice/80001.jpg".
+#
+def image_key(user_id, productid):
+  return IMAGES_PREFIX + user_id + "/" + str(productid) + ".jpg"
+
+
+###################################################################
+#
+# thumbnail_key:
+#
+# The key of an image's thumbnail in a profile's folder, in the
+# folder of the user the image was uploaded for, e.g.
+# "ikeaapp/images_ikeaapp/alice/80001.jpg" ->
+# "ikeaapp/cart_ikeaapp/alice/80001.PNG".
+#
+def thumbnail_key(bucketkey, folder=CART_PREFIX):
+  relative = pathlib.PurePosixPath(bucketkey[len(IMAGES_PREFIX):])
+
+  if not bucketkey.startswith(IMAGES_PREFIX) or len(relative.parts) != 2:
+    raise Exception("expecting image key like " + IMAGES_PREFIX +
+                    "<user id>/<product id>.jpg")
+
+  # .PNG, a different format than the original, so writing the
+  # thumbnail doesn't trigger ikea_compute again
+  return folder + str(relative.with_suffix(".PNG"))
+
+
+###################################################################
+#
+# hash_key:
+#
+# The key of an image's entry in the thumbnail index, for one size.
+# No .PNG suffix: the entry is empty, and only names a thumbnail.
+#
+def hash_key(md5, size, palette=True):
+  suffix = "" if palette else "_rgb"
+  return THUMBS_PREFIX + md5 + "_" + str(size) + suffix
+
+
+###################################################################
+#
+# etag_md5:
+#
+# The MD5 in an S3 ETag, or None when the ETag isn't one (multipart
+# uploads have ETags like "<md5 of the parts' md5s>-<# of parts>").
+#
+def etag_md5(etag):
+  if not etag:
+    return None
+  etag = etag.strip('"')
+  return None if '-' in etag else etag
+
+
+###################################################################
+#
+# source_md5:
+#
+def source_md5(data):
+  return hashlib.md5(data).hexdigest()
+
+
+###################################################################
+#
+# encode_png:
+#
+def encode_png(image, palette=True, optimize=True):
+  """
+  Encodes an image as a PNG, by default reduced to a 256 color
+  palette (thumbnails this small don't show the difference, and the
+  file is a fraction of the size); optimize=True searches for the
+  smallest encoding, which is worth it for small images only
+
+  Returns
+  -------
+  bytes of the PNG
+  """
+  from PIL import Image
+
+  if palette and image.mode != 'P':
+    # fast octree is the quickest of Pillow's quantizers, and the only
+    # one that keeps an alpha channel
+    mode = 'RGBA' if image.mode in ('RGBA', 'LA', 'PA') else 'RGB'
+    image = image.convert(mode).quantize(256, method=Image.FASTOCTREE)
+
+  buffer = io.BytesIO()
+  image.save(buffer, format='PNG', optimize=optimize)
+
+  return buffer.getvalue()
+
+
+###################################################################
+#
+# make_thumbnails:
+#
+def make_thumbnails(data, sizes, palette=True):
+  """
+  Shrinks an image to PNG thumbnails of one or more sizes, from a
+  single decode, all in memory
+
+  Parameters
+  ----------
+  data : bytes of the original image,
+  sizes : list of sizes in pixels (each thumbnail fits in a
+          size x size box),
+  palette : True to write palette (8-bit) PNGs
+
+  Returns
+  -------
+  dict of size -> bytes of the PNG thumbnail
+  """
+  # deferred import: Pillow comes from a lambda layer, and is slow
+  # to import
+  from PIL import Image
+
+  image = Image.open(io.BytesIO(data))
+
+  #
+  # for a JPEG, have the decoder scale down by 1/2, 1/4 or 1/8 as
+  # long as the result is still at least as large as the largest
+  # thumbnail (no-op for other formats); a 4000px photo is then
+  # decoded at 500px instead of at full size:
+  #
+  largest = max(sizes)
+  image.draft('RGB', (largest, largest))
+  image.load()
+
+  results = {}
+
+  for size in sorted(set(sizes), reverse=True):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    results[size] = encode_png(thumbnail, palette)
+
+  return results
+
+
+###################################################################
+#
+# put_thumbnail:
+#
+def put_thumbnail(s3_client, bucketname, key, png, md5):
+  """
+  Writes a thumbnail to S3, tagged with the MD5 of its source image
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  key : key of the thumbnail,
+  png : bytes of the thumbnail,
+  md5 : hex MD5 of the image it was made from
+
+  Returns
+  -------
+  nothing
+  """
+  s3_client.put_object(Bucket=bucketname,
+                       Key=key,
+                       Body=png,
+                       ACL='public-read',
+                       ContentType='image/PNG',
+                       Metadata={SOURCE_MD5: md5})
+
+
+###################################################################
+#
+# index_thumbnail:
+#
+def index_thumbnail(s3_client, bucketname, md5, size, palette, key):
+  """
+  Points the index entry of an image's thumbnail of the given size
+  at key (an empty object, so nothing is stored twice)
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  md5 : hex MD5 of the image the thumbnail was made from,
+  size : size of the thumbnail,
+  palette : True for palette (8-bit) PNGs,
+  key : key of the thumbnail
+
+  Returns
+  -------
+  nothing
+  """
+  s3_client.put_object(Bucket=bucketname,
+                       Key=hash_key(md5, size, palette),
+                       Body=b'',
+                       Metadata={THUMBNAIL_KEY: key})
+
+
+###################################################################
+#
+# store_thumbnails:
+#
+def store_thumbnails(s3_client, bucketname, bucketkey, data, profiles,
+                     palette=True):
+  """
+  Makes an image's thumbnail for every profile, writes them to the
+  profiles' folders, and indexes them by the image's MD5
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  bucketkey : key of the original image,
+  data : bytes of the original image,
+  profiles : list of (name, size, folder), see get_profiles,
+  palette : True to write palette (8-bit) PNGs
+
+  Returns
+  -------
+  dict of thumbnail key -> bytes of the PNG
+  """
+  md5 = source_md5(data)
+  pngs = make_thumbnails(data, [size for name, size, folder in profiles],
+                         palette)
+
+  results = {}
+  for name, size, folder in profiles:
+    key = thumbnail_key(bucketkey, folder)
+    put_thumbnail(s3_client, bucketname, key, pngs[size], md5)
+    index_thumbnail(s3_client, bucketname, md5, size, palette, key)
+    results[key] = pngs[size]
+
+  return results
+
+
+###################################################################
+#
+# link_thumbnails:
+#
+def link_thumbnails(s3_client, bucketname, bucketkey, md5, profiles,
+                    palette=True):
+  """
+  Copies an image's thumbnails into the profiles' folders from the
+  thumbnails the index has for it, if it has them all
+
+  S3 has no links, so each thumbnail is a server-side copy (nothing
+  goes through here); only the cart thumbnail is read back, for the
+  cached cart zip.
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  bucketkey : key of the original image,
+  md5 : hex MD5 of the original image,
+  profiles : list of (name, size, folder), see get_profiles,
+  palette : True for palette (8-bit) PNGs
+
+  Returns
+  -------
+  dict of cart thumbnail key -> bytes of the PNG, or None if the
+  index doesn't have every thumbnail of this image (any longer)
+  """
+  sources = {}
+
+  for name, size, folder in profiles:
+    try:
+      response = s3_client.head_object(Bucket=bucketname,
+                                       Key=hash_key(md5, size, palette))
+    except Exception as err:
+      if error_code(err) in ('404', 'NoSuchKey', 'NotFound'):
+        return None
+      raise
+
+    # the thumbnail it names may since have been removed from its
+    # cart, or replaced by another image's:
+    source = response.get('Metadata', {}).get(THUMBNAIL_KEY)
+    if source is None or not is_current(s3_client, bucketname, source, md5):
+      return None
+
+    sources[thumbnail_key(bucketkey, folder)] = source
+
+  results = {}
+
+  for key, source in sources.items():
+    if key != source:
+      try:
+        s3_client.copy_object(Bucket=bucketname,
+                              Key=key,
+                              CopySource={
+                                  'Bucket': bucketname,
+                                  'Key': source
+                              },
+                              ACL='public-read',
+                              ContentType='image/PNG',
+                              Metadata={SOURCE_MD5: md5},
+                              MetadataDirective='REPLACE')
+      except Exception as err:
+        if error_code(err) in ('404', 'NoSuchKey', 'NotFound'):
+          return None
+        raise
+
+    if key.startswith(CART_PREFIX):
+      response = s3_client.get_object(Bucket=bucketname, Key=key)
+      results[key] = response['Body'].read()
+
+  return results
+
+
+###################################################################
+#
+# is_current:
+#
+def is_current(s3_client, bucketname, key, md5):
+  """
+  Checks if the thumbnail at key was made from the image with the
+  given MD5 (a HEAD request; the thumbnail itself isn't read)
+
+  Parameters
+  ----------
+  s3_client : boto3 S3 client,
+  bucketname : name of the bucket,
+  key : key of the thumbnail,
+  md5 : hex MD5 of the image, or None
+
+  Returns
+  -------
+  True if the thumbnail exists and is up to date, False if not
+  """
+  if md5 is None:
+    return False
+
+  try:
+    response = s3_client.head_object(Bucket=bucketname, Key=key)
+  except Exception as err:
+    if error_code(err) in ('404', 'NoSuchKey', 'NotFound'):
+      return False
+    raise
+
+  return response.get('Metadata', {}).get(SOURCE_MD5) == md5